@@ -0,0 +1,140 @@
+# a stand-in for youtube-dl serving locally generated media, for offline benchmarks. see run_benchmarks.py
+
+import json
+import os
+import shutil
+import sys
+import time
+
+
+# video ids look like bench_<codec>_<seconds>s_<index>, e.g. bench_opus_600s_003
+# and are served from the media library in $YT2MP3_BENCH_MEDIA (see media_file_name)
+ID_PREFIX = 'bench'
+# the container youtube would serve each audio codec in
+CODEC_EXTENSIONS = {'mp3': 'mp3', 'aac': 'm4a', 'opus': 'webm'}
+CHUNK_SIZE = 64 * 1024
+
+
+def video_id_for(codec, seconds, index):
+    return '{}_{}_{}s_{:03d}'.format(ID_PREFIX, codec, seconds, index)
+
+
+def parse_video_id(video_url):
+    """
+    Returns (video id, codec, seconds, index) of a benchmark video id or url
+    """
+    vid = video_url.split('watch?v=')[-1].split('&')[0]
+    prefix, codec, seconds, index = vid.split('_')
+    assert prefix == ID_PREFIX and codec in CODEC_EXTENSIONS, 'Not a benchmark video: "{}"'.format(video_url)
+    return vid, codec, int(seconds.rstrip('s')), int(index)
+
+
+def media_file_name(media_dir, codec, seconds):
+    return os.path.join(media_dir, 'source-{}s.{}'.format(seconds, CODEC_EXTENSIONS[codec]))
+
+
+def parse_arguments(argv):
+    """
+    Parses the subset of the youtube-dl command line used by yt2mp3_utils
+    """
+    options = {'urls': []}
+    value_options = ['--format', '--download-archive', '--output', '--limit-rate']
+    i = 0
+    while i < len(argv):
+        if argv[i] in value_options:
+            options[argv[i]] = argv[i + 1]
+            i += 2
+        elif argv[i].startswith('--'):
+            options[argv[i]] = True
+            i += 1
+        else:
+            options['urls'].append(argv[i])
+            i += 1
+    return options
+
+
+def copy_throttled(source, target, rate, total_size=None, report=False):
+    """
+    Copies the source to the target file object at no more than rate bytes per second (if given),
+    printing youtube-dl style progress lines if requested
+    """
+    t_start = time.time()
+    copied = 0
+    last_report = 0
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        target.write(chunk)
+        copied += len(chunk)
+        elapsed = time.time() - t_start
+        if rate:
+            ahead = copied / rate - elapsed
+            if ahead > 0:
+                time.sleep(ahead)
+                elapsed += ahead
+        if report and (time.time() - last_report > 0.5):
+            last_report = time.time()
+            print('[download] {:5.1f}% of {:.2f}MiB at {:.2f}MiB/s'.format(
+                100. * copied / total_size, total_size / 1024**2, copied / max(elapsed, 1e-6) / 1024**2), flush=True)
+    return copied
+
+
+def main(argv):
+    options = parse_arguments(argv)
+    media_dir = os.environ['YT2MP3_BENCH_MEDIA']
+    # the simulated network bandwidth, shared by nobody: each download gets the full rate
+    network_rate = float(os.environ.get('YT2MP3_BENCH_RATE') or 0) or None
+    limit_rate = float(options['--limit-rate']) if '--limit-rate' in options else None
+    rate = min(r for r in [network_rate, limit_rate] if r) if network_rate or limit_rate else None
+
+    if '--flat-playlist' in options:
+        # playlists look like bench_<codec>_<seconds>s_<number of videos>
+        for url in options['urls']:
+            _, codec, seconds, n_videos = parse_video_id(url)
+            for index in range(n_videos):
+                print(json.dumps({'id': video_id_for(codec, seconds, index),
+                                  'title': 'Benchmark {} {}s {:03d}'.format(codec, seconds, index)}))
+        return 0
+
+    for url in options['urls']:
+        vid, codec, seconds, index = parse_video_id(url)
+        source_file_name = media_file_name(media_dir, codec, seconds)
+        output = options.get('--output', '%(title)s-%(id)s.%(ext)s')
+
+        if output == '-':
+            with open(source_file_name, 'rb') as source:
+                try:
+                    copy_throttled(source, sys.stdout.buffer, rate)
+                except BrokenPipeError:
+                    return 1
+            continue
+
+        file_name = output % {'title': 'Benchmark {} {}s {:03d}'.format(codec, seconds, index),
+                              'id': vid, 'ext': CODEC_EXTENSIONS[codec]}
+        if '--get-filename' in options:
+            print(file_name)
+            continue
+
+        archive_file = options.get('--download-archive')
+        if archive_file and os.path.isfile(archive_file):
+            print('[download] {} has already been recorded in archive'.format(vid))
+            continue
+        print('[youtube] {}: Downloading webpage'.format(vid))
+        print('[download] Destination: {}'.format(file_name), flush=True)
+        total_size = os.path.getsize(source_file_name)
+        part_file_name = file_name + '.part'
+        offset = os.path.getsize(part_file_name) if '--continue' in options and os.path.isfile(part_file_name) else 0
+        with open(source_file_name, 'rb') as source, open(part_file_name, 'ab' if offset else 'wb') as target:
+            source.seek(offset)
+            copy_throttled(source, target, rate, total_size, report=True)
+        shutil.move(part_file_name, file_name)
+        print('[download] 100% of {:.2f}MiB'.format(total_size / 1024**2), flush=True)
+        if archive_file:
+            with open(archive_file, 'at') as f:
+                f.write('youtube {}\n'.format(vid))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
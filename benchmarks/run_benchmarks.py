@@ -0,0 +1,351 @@
+# offline end-to-end benchmarks of the yt2mp3 command line, against a local stand-in for youtube-dl
+#
+# usage: python benchmarks/run_benchmarks.py -o results.json [--compare previous_results.json]
+#
+# each scenario runs yt2mp3.py --nogui in a fresh scratch directory, on media generated with ffmpeg's lavfi sources
+# and served by fake_youtube_dl.py, and reports wall time, throughput, job latency percentiles (from the --events_file
+# log), the peak RSS of yt2mp3 and all its child processes and the peak disk usage of its working directory.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import fake_youtube_dl
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+MODES = ['single', 'segmented', 'stream', 'batch', 'concurrency']
+# ffmpeg encoder settings for the generated source media, at typical youtube audio bitrates
+SOURCE_ENCODERS = {'mp3': ['-c:a', 'libmp3lame', '-b:a', '128k'],
+                   'aac': ['-c:a', 'aac', '-b:a', '128k'],
+                   'opus': ['-c:a', 'libopus', '-b:a', '128k']}
+SEGMENT_LENGTH = 60
+
+
+def generate_media(media_dir, codecs, durations):
+    """
+    Generates one source file per codec and duration: a tone over pink noise, which compresses like real audio
+    """
+    for codec in codecs:
+        for seconds in durations:
+            file_name = fake_youtube_dl.media_file_name(media_dir, codec, seconds)
+            if os.path.isfile(file_name):
+                continue
+            print('[yt2mp3] [BENCHMARK] Generating {}'.format(file_name))
+            sources = ('sine=frequency=440:sample_rate=48000:duration={0},volume=0.5[tone];'
+                       'anoisesrc=color=pink:amplitude=0.1:sample_rate=48000:duration={0}[noise];'
+                       '[tone][noise]amix=inputs=2'.format(seconds))
+            subprocess.check_call(['ffmpeg', '-loglevel', 'error', '-y', '-filter_complex', sources, '-ac', '2']
+                                  + SOURCE_ENCODERS[codec] + [file_name])
+
+
+def install_fake_youtube_dl(bin_dir):
+    """
+    Puts an executable youtube-dl into bin_dir which runs fake_youtube_dl.py
+    """
+    os.makedirs(bin_dir, exist_ok=True)
+    executable = os.path.join(bin_dir, 'youtube-dl')
+    with open(executable, 'wt') as f:
+        f.write('#!/bin/sh\nexec "{}" "{}" "$@"\n'.format(sys.executable, os.path.join(BENCHMARK_DIR, 'fake_youtube_dl.py')))
+    os.chmod(executable, 0o755)
+
+
+def scenarios(codecs, durations, batch_size, concurrency_levels, modes):
+    """
+    Returns the list of scenarios to run, each a dict with a unique name, the video ids and the extra yt2mp3 arguments
+    """
+    result = []
+    for codec in codecs:
+        for seconds in durations:
+            video = fake_youtube_dl.video_id_for(codec, seconds, 0)
+            if 'single' in modes:
+                result.append({'name': 'single-{}-{}s'.format(codec, seconds), 'mode': 'single',
+                               'videos': [video], 'arguments': []})
+            if 'segmented' in modes:
+                result.append({'name': 'segmented-{}-{}s'.format(codec, seconds), 'mode': 'segmented',
+                               'videos': [video], 'arguments': ['-sl', str(SEGMENT_LENGTH)]})
+            if 'stream' in modes:
+                result.append({'name': 'stream-{}-{}s'.format(codec, seconds), 'mode': 'stream',
+                               'videos': [video], 'arguments': ['--stream']})
+    # batches mix all codecs at the shortest duration
+    batch = [fake_youtube_dl.video_id_for(codecs[i % len(codecs)], min(durations), i) for i in range(batch_size)]
+    if 'batch' in modes:
+        result.append({'name': 'batch-{}'.format(batch_size), 'mode': 'batch', 'videos': batch, 'arguments': []})
+    if 'concurrency' in modes:
+        for n_jobs in concurrency_levels:
+            result.append({'name': 'concurrency-{}-j{}'.format(batch_size, n_jobs), 'mode': 'concurrency',
+                           'videos': batch, 'arguments': ['-j', str(n_jobs), '-dj', str(n_jobs)]})
+    return result
+
+
+def process_tree_rss(root_pid):
+    """
+    Returns the summed resident set size in bytes of a process and all its descendants (Linux only)
+    """
+    children = {}
+    rss = {}
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(pid), 'rt') as f:
+                # the command name may contain spaces, the fields after it do not
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(pid))
+        rss[int(pid)] = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+    total, pending = 0, [root_pid]
+    while pending:
+        pid = pending.pop()
+        total += rss.get(pid, 0)
+        pending += children.get(pid, [])
+    return total
+
+
+def directory_size(path):
+    total = 0
+    for root, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total += os.path.getsize(os.path.join(root, file_name))
+            except OSError:
+                pass    # removed in the meantime
+    return total
+
+
+class PeakSampler(object):
+    """
+    Samples the RSS of a process tree and the size of a directory until stopped, keeping the peaks
+    """
+
+    def __init__(self, pid, scratch_dir, interval):
+        self.pid = pid
+        self.scratch_dir = scratch_dir
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_scratch = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        has_proc = os.path.isdir('/proc/self')
+        while True:
+            if has_proc:
+                self.peak_rss = max(self.peak_rss, process_tree_rss(self.pid))
+            self.peak_scratch = max(self.peak_scratch, directory_size(self.scratch_dir))
+            if self.stop_event.wait(self.interval):
+                break
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def run_scenario(scenario, work_dir, environment, sample_interval):
+    """
+    Runs a scenario once in a fresh directory below work_dir.
+
+    Returns:
+    --------
+    dict with the wall time, the latencies of all jobs, the peaks and the exit code of the run
+    """
+    run_dir = tempfile.mkdtemp(prefix=scenario['name'] + '-', dir=work_dir)
+    scratch_dir = os.path.join(run_dir, 'scratch')
+    output_dir = os.path.join(run_dir, 'output')
+    os.makedirs(scratch_dir)
+    events_file = os.path.join(run_dir, 'events.jsonl')
+    cmd = ([sys.executable, os.path.join(REPO_DIR, 'yt2mp3.py'), '--nogui', '-o', output_dir, '-ef', events_file]
+           + scenario['arguments'] + scenario['videos'])
+    try:
+        with open(os.path.join(run_dir, 'log.txt'), 'wt') as log:
+            t_start = time.time()
+            proc = subprocess.Popen(cmd, cwd=scratch_dir, env=environment, stdout=log, stderr=subprocess.STDOUT)
+            sampler = PeakSampler(proc.pid, scratch_dir, sample_interval)
+            proc.wait()
+            wall_seconds = time.time() - t_start
+            sampler.stop()
+        latencies = []
+        if os.path.isfile(events_file):
+            with open(events_file, 'rt') as f:
+                for line in f:
+                    event = json.loads(line)
+                    if event['event'] == 'job' and event['seconds'] is not None:
+                        latencies.append(event['seconds'])
+        if proc.returncode != 0 or len(latencies) != len(scenario['videos']):
+            with open(os.path.join(run_dir, 'log.txt'), 'rt') as f:
+                print(f.read()[-2000:])
+        return {'wall_seconds': wall_seconds, 'latencies': latencies, 'peak_rss_bytes': sampler.peak_rss,
+                'peak_scratch_bytes': sampler.peak_scratch, 'exit_code': proc.returncode,
+                'output_bytes': directory_size(output_dir)}
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def percentile(values, fraction):
+    """
+    Returns the given percentile (0 <= fraction <= 1) of values, linearly interpolated
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(scenario, runs, durations_by_video):
+    """
+    Aggregates the repeated runs of a scenario
+    """
+    wall_seconds = statistics.median(run['wall_seconds'] for run in runs)
+    latencies = [latency for run in runs for latency in run['latencies']]
+    media_seconds = sum(durations_by_video[video] for video in scenario['videos'])
+    return {'name': scenario['name'],
+            'mode': scenario['mode'],
+            'arguments': scenario['arguments'],
+            'n_videos': len(scenario['videos']),
+            'media_seconds': media_seconds,
+            'repeats': len(runs),
+            'failed_runs': sum(1 for run in runs if run['exit_code'] != 0),
+            'wall_seconds': {'median': wall_seconds,
+                             'min': min(run['wall_seconds'] for run in runs),
+                             'max': max(run['wall_seconds'] for run in runs)},
+            'throughput': {'videos_per_second': len(scenario['videos']) / wall_seconds,
+                           'media_seconds_per_second': media_seconds / wall_seconds},
+            'latency_seconds': {'p50': percentile(latencies, 0.5),
+                                'p90': percentile(latencies, 0.9),
+                                'p99': percentile(latencies, 0.99),
+                                'max': max(latencies) if latencies else None},
+            'peak_rss_bytes': max(run['peak_rss_bytes'] for run in runs),
+            'peak_scratch_bytes': max(run['peak_scratch_bytes'] for run in runs),
+            'output_bytes': max(run['output_bytes'] for run in runs)}
+
+
+def environment_info():
+    """
+    Describes the code and machine measured, to tell results apart
+    """
+    def output_of(cmd, cwd=None):
+        try:
+            return subprocess.check_output(cmd, cwd=cwd, universal_newlines=True, stderr=subprocess.DEVNULL).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    ffmpeg_version = output_of(['ffmpeg', '-version'])
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'revision': output_of(['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR),
+            'python': platform.python_version(),
+            'ffmpeg': ffmpeg_version.split('\n')[0] if ffmpeg_version else None,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()}
+
+
+def compare(results, baseline):
+    """
+    Prints the relative change of the key figures of each scenario against a baseline result file
+    """
+    baseline_scenarios = {scenario['name']: scenario for scenario in baseline['scenarios']}
+    figures = [('wall', lambda s: s['wall_seconds']['median']),
+               ('p50', lambda s: s['latency_seconds']['p50']),
+               ('p99', lambda s: s['latency_seconds']['p99']),
+               ('rss', lambda s: s['peak_rss_bytes']),
+               ('scratch', lambda s: s['peak_scratch_bytes'])]
+    print('[yt2mp3] [BENCHMARK] Changes against {} ({}):'.format(baseline['environment']['revision'],
+                                                                 baseline['environment']['date']))
+    for scenario in results['scenarios']:
+        old = baseline_scenarios.get(scenario['name'])
+        if old is None:
+            continue
+        changes = []
+        for name, figure in figures:
+            if figure(old) and figure(scenario) is not None:
+                changes.append('{} {:+.1f}%'.format(name, 100. * (figure(scenario) / figure(old) - 1)))
+        print('  {:<28} {}'.format(scenario['name'], ', '.join(changes)))
+
+
+def print_summary(summary):
+    latency = summary['latency_seconds']
+    print('[yt2mp3] [BENCHMARK] {:<28} wall {:7.2f}s  {:6.2f} videos/s  {:7.1f}x realtime  '
+          'p50 {}  p99 {}  rss {:6.1f}MiB  scratch {:7.1f}MiB{}'.format(
+              summary['name'], summary['wall_seconds']['median'], summary['throughput']['videos_per_second'],
+              summary['throughput']['media_seconds_per_second'],
+              '?' if latency['p50'] is None else '{:.2f}s'.format(latency['p50']),
+              '?' if latency['p99'] is None else '{:.2f}s'.format(latency['p99']),
+              summary['peak_rss_bytes'] / 1024**2, summary['peak_scratch_bytes'] / 1024**2,
+              '  FAILED {}x'.format(summary['failed_runs']) if summary['failed_runs'] else ''))
+
+
+def comma_separated(value_type):
+    return lambda value: [value_type(item) for item in value.split(',') if item]
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description='Offline end-to-end benchmarks of yt2mp3')
+    argument_parser.add_argument('-o', '--output', type=str, default=None,
+                                 help='Write the results as JSON to this file')
+    argument_parser.add_argument('--compare', type=str, default=None, metavar='RESULTS_FILE',
+                                 help='Print the changes against the results of a previous run')
+    argument_parser.add_argument('-m', '--modes', type=comma_separated(str), default=MODES,
+                                 help='Comma separated modes to benchmark. Default: {}'.format(','.join(MODES)))
+    argument_parser.add_argument('-c', '--codecs', type=comma_separated(str), default=['mp3', 'aac', 'opus'],
+                                 help='Comma separated source audio codecs, of mp3, aac and opus')
+    argument_parser.add_argument('-d', '--durations', type=comma_separated(int), default=[30, 600],
+                                 help='Comma separated source durations in seconds')
+    argument_parser.add_argument('-b', '--batch_size', type=int, default=12,
+                                 help='The number of videos of the batch and concurrency modes')
+    argument_parser.add_argument('-cl', '--concurrency_levels', type=comma_separated(int), default=[1, 2, 4],
+                                 help='Comma separated numbers of concurrent downloads and conversions for the concurrency mode')
+    argument_parser.add_argument('-r', '--repeat', type=int, default=3,
+                                 help='Run each scenario this many times, reporting the median wall time')
+    argument_parser.add_argument('--network_rate', type=float, default=None, metavar='BYTES_PER_SECOND',
+                                 help='Simulate a network bandwidth for each download. Unlimited by default')
+    argument_parser.add_argument('--media_dir', type=str, default=None,
+                                 help='Keep the generated source media in this folder for later runs. A temporary folder by default')
+    argument_parser.add_argument('--sample_interval', type=float, default=0.05,
+                                 help='The time in seconds between two samples of RSS and scratch disk usage')
+    args = argument_parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='yt2mp3-benchmark-')
+    try:
+        media_dir = os.path.abspath(args.media_dir) if args.media_dir else os.path.join(work_dir, 'media')
+        os.makedirs(media_dir, exist_ok=True)
+        generate_media(media_dir, args.codecs, args.durations)
+        install_fake_youtube_dl(os.path.join(work_dir, 'bin'))
+        environment = dict(os.environ,
+                           PATH=os.path.join(work_dir, 'bin') + os.pathsep + os.environ.get('PATH', ''),
+                           YT2MP3_BENCH_MEDIA=media_dir,
+                           YT2MP3_BENCH_RATE=str(args.network_rate or ''))
+
+        results = {'environment': environment_info(),
+                   'settings': {key: value for key, value in vars(args).items() if key not in ['output', 'compare']},
+                   'scenarios': []}
+        for scenario in scenarios(args.codecs, args.durations, args.batch_size, args.concurrency_levels, args.modes):
+            runs = [run_scenario(scenario, work_dir, environment, args.sample_interval) for _ in range(args.repeat)]
+            durations_by_video = {video: fake_youtube_dl.parse_video_id(video)[2] for video in scenario['videos']}
+            summary = summarize(scenario, runs, durations_by_video)
+            print_summary(summary)
+            results['scenarios'].append(summary)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'wt') as f:
+            # stable key order and one value per line, so results of two versions can be diffed
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if args.compare:
+        with open(args.compare, 'rt') as f:
+            compare(results, json.load(f))
@@ -1,22 +1,34 @@
-import os
 import sys
+from collections import OrderedDict
 
 from PyQt5.QtWidgets import QApplication     # pylint: disable=F0401
 from PyQt5.QtWidgets import QPushButton      # pylint: disable=F0401
 from PyQt5.QtWidgets import QWidget          # pylint: disable=F0401
 from PyQt5.QtWidgets import QLabel           # pylint: disable=F0401
-from PyQt5.QtWidgets import QTabWidget       # pylint: disable=F0401
+from PyQt5.QtWidgets import QTableView       # pylint: disable=F0401
+from PyQt5.QtWidgets import QStackedWidget   # pylint: disable=F0401
+from PyQt5.QtWidgets import QSplitter        # pylint: disable=F0401
+from PyQt5.QtWidgets import QAbstractItemView  # pylint: disable=F0401
+from PyQt5.QtWidgets import QHeaderView      # pylint: disable=F0401
 from PyQt5.QtWidgets import QVBoxLayout      # pylint: disable=F0401
 from PyQt5.QtWidgets import QHBoxLayout      # pylint: disable=F0401
 from PyQt5.QtWidgets import QGridLayout      # pylint: disable=F0401
-from PyQt5 import QtGui                      # pylint: disable=F0401
 from PyQt5.QtGui import QIcon                # pylint: disable=F0401
+from PyQt5.QtCore import Qt                  # pylint: disable=F0401
+from PyQt5.QtCore import QTimer              # pylint: disable=F0401
 from PyQt5.QtCore import pyqtSlot            # pylint: disable=F0401
 from PyQt5.QtCore import QSize               # pylint: disable=F0401
 
-from concurrent.futures import ThreadPoolExecutor
 import yt2mp3
-
+import yt2mp3_utils
+import yt2mp3_pipeline
+import yt2mp3_progress
+import yt2mp3_daemon
+import yt2mp3_jobstore
+import yt2mp3_concurrency
+
+from .job_table import Job
+from .job_table import JobTableModel
 from .job_panel import JobPanel
 from .process_output_monitor import ProcessOutputMonitor
 
@@ -25,6 +37,11 @@ from .process_output_monitor import ProcessOutputMonitor
 # import <this_module>
 # <this_module>.run()
 
+# the interval in milliseconds in which job changes, including the output of the shown job, are rendered
+FLUSH_INTERVAL = 100
+# the maximum number of job editor panels kept alive. panels of other jobs are created again when they are selected
+MAX_PANELS = 8
+
 
 def run():
     app = QApplication(sys.argv)
@@ -44,27 +61,33 @@ class MainWindow(QWidget):
         self.left = 0
         self.top = 0
         self.width = 900
-        self.height = 385
+        self.height = 600
         self.setWindowTitle(self.title)
         self.setGeometry(self.left, self.top, self.width, self.height)
 
         ###################################################################################
         # set up threading work backend, leaving at least one cpu for the OS and other crap
+        # downloads and transcodes are run in separate pools, see yt2mp3_pipeline
         ###################################################################################
-        self.worker_thread_pool = ThreadPoolExecutor(max_workers=max(1, os.cpu_count()-1))
-        self.gui_communicator_thread_pool = ThreadPoolExecutor(max_workers=max(1, os.cpu_count()-1))
+        args = yt2mp3.parse_command_line_args()
+        if args.use_daemon:
+            # all jobs run in a separately started daemon, see yt2mp3_daemon
+            self.pipeline_scheduler = yt2mp3_daemon.RemoteScheduler(args.daemon_address)
+        else:
+            self.pipeline_scheduler = yt2mp3_pipeline.scheduler_from_args(args, yt2mp3_jobstore.job_store_from_args(args))
+            yt2mp3_concurrency.controller_from_args(self.pipeline_scheduler, args)
 
         ###############################
         # set up layout of main window
         ###############################
 
         # first, some buttons to the right
-        self.add_tab_button = QPushButton('+ Tab')           # button for adding new tabs (see below)
+        self.add_job_button = QPushButton('+ Job')              # button for adding new jobs (see below)
+        self.remove_jobs_button = QPushButton('Remove')         # button for removing the selected jobs
         self.run_all_jobs_button = QPushButton('Run all (?)')    # button to run all runnable (not yet running and un-run) jobs
         self.stop_all_jobs_button = QPushButton('Stop all (?)')  # button to terminate all running jobs
 
         # labels for summarizing job stati
-        self.previous_job_stati = None  # memorize the previously received status to avoid uneccessary rendering.
         self.status_widget = QWidget()
         self.job_status_layout = QGridLayout()
         self.status_widget.setLayout(self.job_status_layout)
@@ -81,6 +104,10 @@ class MainWindow(QWidget):
         self.n_jobs_stopped_number_label = QLabel('?')
         self.n_jobs_failed_label = QLabel('Failed:')
         self.n_jobs_failed_number_label = QLabel('?')
+        self.throughput_label = QLabel('Throughput:')
+        self.throughput_number_label = QLabel('?')
+        self.queue_eta_label = QLabel('Queue ETA:')
+        self.queue_eta_number_label = QLabel('?')
 
         self.job_status_layout.addWidget(self.n_jobs_idle_label, 0, 0)
         self.job_status_layout.addWidget(self.n_jobs_idle_number_label, 0, 1)
@@ -94,11 +121,16 @@ class MainWindow(QWidget):
         self.job_status_layout.addWidget(self.n_jobs_failed_number_label, 4, 1)
         self.job_status_layout.addWidget(self.n_jobs_finished_label, 5, 0)
         self.job_status_layout.addWidget(self.n_jobs_finished_number_label, 5, 1)
+        self.job_status_layout.addWidget(self.throughput_label, 6, 0)
+        self.job_status_layout.addWidget(self.throughput_number_label, 6, 1)
+        self.job_status_layout.addWidget(self.queue_eta_label, 7, 0)
+        self.job_status_layout.addWidget(self.queue_eta_number_label, 7, 1)
 
         self.button_panel = QWidget()                       # widget and layout to group buttons
         button_layout = QVBoxLayout(self)
 
-        button_layout.addWidget(self.add_tab_button)        # assemble buttons
+        button_layout.addWidget(self.add_job_button)        # assemble buttons
+        button_layout.addWidget(self.remove_jobs_button)
         button_layout.addStretch()                          # add some spacing
         button_layout.addWidget(self.status_widget)
         button_layout.addStretch()                          # add some spacing
@@ -106,135 +138,218 @@ class MainWindow(QWidget):
         button_layout.addWidget(self.stop_all_jobs_button)
         self.button_panel.setLayout(button_layout)
 
-        # second, a tab panel for job specification to the left
-        # list of icons for the tabs to use.
-        self.tab_icons = {JobPanel.STATUS_IDLE: QIcon('resources/edit.png'),
-                          JobPanel.STATUS_SUBMITTED: QIcon('resources/stopwatch.png'),
-                          JobPanel.STATUS_RUNNING: QIcon('resources/download.png'),
-                          JobPanel.STATUS_STOPPED: QIcon('resources/stop.png'),
-                          JobPanel.STATUS_FINISHED: QIcon('resources/finish-flag.png'),
-                          JobPanel.STATUS_FAILED: QIcon('resources/alarm.png')
-                          }
-
-        self.tab_status = {}                                # keep track of each tab's job's status
-        self.tab_icon_size = QSize(24, 24)
-        self.tab_panel = QTabWidget()
-        self.tab_panel.setTabsClosable(True)                # make tabs closable.
-        self.tab_panel.setIconSize(self.tab_icon_size)
-        self.tabs_created = 0                               # count how many tabs have been created
+        # second, the table of all jobs above the editor panel of the selected job to the left
+        # list of icons for the job stati to use.
+        self.status_icons = {Job.STATUS_IDLE: QIcon('resources/edit.png'),
+                             Job.STATUS_SUBMITTED: QIcon('resources/stopwatch.png'),
+                             Job.STATUS_RUNNING: QIcon('resources/download.png'),
+                             Job.STATUS_STOPPED: QIcon('resources/stop.png'),
+                             Job.STATUS_FINISHED: QIcon('resources/finish-flag.png'),
+                             Job.STATUS_FAILED: QIcon('resources/alarm.png')
+                             }
+
+        self.job_model = JobTableModel(self.status_icons, self)
+        self.job_table = QTableView()
+        self.job_table.setModel(self.job_model)
+        self.job_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.job_table.setIconSize(QSize(16, 16))
+        self.job_table.setWordWrap(False)
+        # fixed row heights: the view never measures rows, whatever their number
+        self.job_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.job_table.verticalHeader().setDefaultSectionSize(22)
+        self.job_table.verticalHeader().hide()
+        self.job_table.horizontalHeader().setStretchLastSection(True)
+        self.job_table.setColumnWidth(JobTableModel.COLUMN_STATUS, 110)
+        self.job_table.setColumnWidth(JobTableModel.COLUMN_NAME, 300)
+
+        # editor panels are created for selected jobs only, see show_job_panel
+        self.panel_stack = QStackedWidget()
+        self.panels = OrderedDict()                         # job -> JobPanel, the least recently shown first
+
+        splitter = QSplitter(Qt.Vertical)
+        splitter.addWidget(self.job_table)
+        splitter.addWidget(self.panel_stack)
 
         # assemble gui elements
         window_layout = QHBoxLayout(self)
-        window_layout.addWidget(self.tab_panel)             # tab panel to the left
+        window_layout.addWidget(splitter)                   # jobs to the left
         window_layout.addWidget(self.button_panel)          # controls to the right
         self.setLayout(window_layout)
 
-        # add initial tab from argparse_namespace input and show
-        self.add_tab()
-
         # create process output monitor
-        self.process_output_monitor = ProcessOutputMonitor(self.tab_panel)
+        self.process_output_monitor = ProcessOutputMonitor()
 
         ################################
         # add functionality and controls
         ################################
-        self.add_tab_button.clicked.connect(self.add_tab)
-        self.tab_panel.tabCloseRequested.connect(self.close_tab)
+        self.add_job_button.clicked.connect(self.add_job)
+        self.remove_jobs_button.clicked.connect(self.remove_selected_jobs)
         self.run_all_jobs_button.clicked.connect(self.run_all_jobs)
         self.stop_all_jobs_button.clicked.connect(self.stop_all_jobs)
+        self.job_table.selectionModel().currentRowChanged.connect(self.show_job_panel)
 
-        self.process_output_monitor.update_output.connect(self.handle_process_output)
-        self.process_output_monitor.update_tabinfo.connect(self.handle_tabinfo_change)
-        self.process_output_monitor.update_stati.connect(self.handle_process_status_summary)
-        self.process_output_monitor.update_runnable_stoppable_count.connect(self.handle_runnable_stoppable_count)
+        self.job_model.summary_changed.connect(self.handle_job_summary)
         self.process_output_monitor.monitor_outputs()
 
+        # job changes are collected from all threads and rendered in batches
+        self.flush_timer = QTimer(self)
+        self.flush_timer.timeout.connect(self.flush_job_changes)
+        self.flush_timer.start(FLUSH_INTERVAL)
+
+        # add one job per video given on the command line or in the input file, or an empty one
+        videos = yt2mp3.collect_videos(args)
+        if videos:
+            jobs = [Job(self.pipeline_scheduler, args,
+                        {'video': [video], 'output': yt2mp3.namespace_for_video(args, video, len(videos)).output},
+                        self.process_output_monitor)
+                    for video in videos]
+        else:
+            jobs = [Job(self.pipeline_scheduler, args, None, self.process_output_monitor)]
+        self.job_model.add_jobs(jobs)
+        self.job_table.selectRow(0)
+        if not args.use_daemon:
+            yt2mp3_utils.sweep_download_dirs(args.sweep_age * 24 * 3600)
+            self.resume_jobs(yt2mp3_jobstore.resumable_jobs_from_args(args))
+
         self.show()
 
-    @pyqtSlot(JobPanel, str)
-    def handle_process_output(self, job_panel, msg):
-        job_panel.output_window.insertPlainText(msg)
-        job_panel.output_window.moveCursor(QtGui.QTextCursor.End)
-
-    @pyqtSlot(dict)
-    def handle_tabinfo_change(self, tabinfodict):
-        # tabinfodict: {tabindex:(jobstatus,tabname)}
-        for idx, vals in tabinfodict.items():
-            tab = self.tab_panel.widget(idx)
-            current_status, current_tabname = vals
-            if not self.tab_panel.tabText(idx) == current_tabname:
-                self.tab_panel.setTabText(idx, current_tabname)
-            if tab not in self.tab_status or not self.tab_status[tab] is current_status:
-                self.tab_status[tab] = current_status
-                self.tab_panel.setTabIcon(idx, self.tab_icons[current_status])
-
-    @pyqtSlot(dict)
-    def handle_process_status_summary(self, status_dict):
-        if not status_dict == self.previous_job_stati:
-            # if we receive a real update, render status text.
-            self.n_jobs_idle_number_label.setText('{}'.format(status_dict[JobPanel.STATUS_IDLE]))
-            self.n_jobs_submitted_number_label.setText('{}'.format(status_dict[JobPanel.STATUS_SUBMITTED]))
-            self.n_jobs_running_number_label.setText('{}'.format(status_dict[JobPanel.STATUS_RUNNING]))
-            self.n_jobs_finished_number_label.setText('{}'.format(status_dict[JobPanel.STATUS_FINISHED]))
-            self.n_jobs_stopped_number_label.setText('{}'.format(status_dict[JobPanel.STATUS_STOPPED]))
-            self.n_jobs_failed_number_label.setText('{}'.format(status_dict[JobPanel.STATUS_FAILED]))
-            # remember current values
-            self.previous_job_stati = status_dict
-
-    @pyqtSlot(int, int)
-    def handle_runnable_stoppable_count(self, n_runnable, n_stoppable):
-        self.run_all_jobs_button.setEnabled(n_runnable)
+    def flush_job_changes(self):
+        """
+        Renders the jobs changed since the last call: their table rows, the shown editor panel and the aggregate progress.
+        Hidden panels are brought up to date when they are shown, see show_job_panel
+        """
+        changed_jobs = self.job_model.flush()
+        panel = self.panel_stack.currentWidget()
+        if panel is not None and panel.job in changed_jobs:
+            panel.update_user_interface()
+            panel.render_output()
+        if changed_jobs:
+            self.show_aggregate_progress()
+
+    @pyqtSlot(dict, int, int)
+    def handle_job_summary(self, status_counts, n_runnable, n_stoppable):
+        self.n_jobs_idle_number_label.setText('{}'.format(status_counts[Job.STATUS_IDLE]))
+        self.n_jobs_submitted_number_label.setText('{}'.format(status_counts[Job.STATUS_SUBMITTED]))
+        self.n_jobs_running_number_label.setText('{}'.format(status_counts[Job.STATUS_RUNNING]))
+        self.n_jobs_finished_number_label.setText('{}'.format(status_counts[Job.STATUS_FINISHED]))
+        self.n_jobs_stopped_number_label.setText('{}'.format(status_counts[Job.STATUS_STOPPED]))
+        self.n_jobs_failed_number_label.setText('{}'.format(status_counts[Job.STATUS_FAILED]))
+
+        self.run_all_jobs_button.setEnabled(n_runnable > 0)
         self.run_all_jobs_button.setText('Run all ({})'.format(n_runnable))
 
-        self.stop_all_jobs_button.setEnabled(n_stoppable)
+        self.stop_all_jobs_button.setEnabled(n_stoppable > 0)
         self.stop_all_jobs_button.setText('Stop all ({})'.format(n_stoppable))
 
-
-    def add_tab(self):
+    def show_aggregate_progress(self):
+        """
+        Renders throughput and queue ETA, aggregated over the running jobs only
         """
-        Adds a new tab to the JobTabPanel
+        running_snapshots = [job.pipeline_job.progress.snapshot() for job in self.job_model.running if job.pipeline_job]
+        aggregate = yt2mp3_progress.aggregate_progress(running_snapshots, self.job_model.status_counts[Job.STATUS_SUBMITTED],
+                                                       self.pipeline_scheduler.n_transcode_workers,
+                                                       self.job_model.mean_job_seconds())
+        self.throughput_number_label.setText('{:.2f} MiB/s'.format(aggregate['bytes_per_second'] / 1024**2))
+        queue_eta = aggregate['queue_eta_seconds']
+        self.queue_eta_number_label.setText('?' if queue_eta is None else '{:.0f}s'.format(queue_eta))
+
+    def current_job(self):
+        index = self.job_table.currentIndex()
+        return self.job_model.job(index.row()) if index.isValid() else None
+
+    def show_job_panel(self, current, previous=None):
         """
-        active_tab_index = self.tab_panel.currentIndex()
-        if active_tab_index >= 0:
-            argparse_namespace = self.tab_panel.widget(active_tab_index).get_args()
+        Shows the editor panel of the job in the current row, creating it if necessary.
+        Only the MAX_PANELS most recently shown panels are kept.
+        """
+        if not current.isValid():
+            return
+        previous_panel = self.panel_stack.currentWidget()
+        if previous_panel is not None:
+            previous_panel.job.log.follow(False)
+        job = self.job_model.job(current.row())
+        panel = self.panels.pop(job, None)
+        if panel is None:
+            panel = JobPanel(job)
+            self.panel_stack.addWidget(panel)
         else:
-            argparse_namespace = yt2mp3.parse_command_line_args()
-
-        new_tab_name = 'New Job {}'.format(self.tabs_created)  # NOTE: this name actually never is used right now.
-        new_tab = JobPanel(self.worker_thread_pool, self.gui_communicator_thread_pool, argparse_namespace)
-
-        self.tab_panel.addTab(new_tab, new_tab_name)
-        self.tabs_created += 1
-
-        self.tab_panel.setCurrentIndex(active_tab_index+1)
+            panel.update_user_interface()
+        self.panels[job] = panel
+        self.panel_stack.setCurrentWidget(panel)
+        job.log.follow(True)
+        panel.render_output()
+        while len(self.panels) > MAX_PANELS:
+            self.discard_panel(*self.panels.popitem(last=False))
+
+    def discard_panel(self, job, panel):
+        job.log.follow(False)
+        self.panel_stack.removeWidget(panel)
+        job.panel = None
+        panel.deleteLater()
+
+    def add_job(self):
+        """
+        Adds a new job to the table, with the options of the current job
+        """
+        current_job = self.current_job()
+        if current_job is not None:
+            new_job = Job(self.pipeline_scheduler, current_job.base_args, current_job.options, self.process_output_monitor)
+            new_job.segmented = current_job.segmented
+        else:
+            new_job = Job(self.pipeline_scheduler, yt2mp3.parse_command_line_args(), None, self.process_output_monitor)
+        self.job_model.add_jobs([new_job])
+        self.job_table.selectRow(self.job_model.row_of(new_job))
 
-    def close_tab(self, index):
+    def resume_jobs(self, records):
+        """
+        Adds a job for each interrupted job recorded in the job database and runs it from its last completed stage
+        """
+        jobs = []
+        for record in records:
+            job = Job(self.pipeline_scheduler, record.args, None, self.process_output_monitor)
+            job.resume_from = record
+            jobs.append(job)
+        self.job_model.add_jobs(jobs)
+        for job in jobs:
+            job.run()
+
+    def remove_selected_jobs(self):
         """
-        Removes JobTab, its data and kills its job (if running)
+        Removes the selected jobs, their data and kills their jobs (if running)
         """
-        # TODO: figure out what to do. what if job is running? just blindly kill thread?
-        self.tab_panel.widget(index).stop_job_callback_fxn()
-        self.tab_status.pop(self.tab_panel.widget(index), None)
-        self.tab_panel.removeTab(index)
+        rows = [index.row() for index in self.job_table.selectionModel().selectedRows()]
+        for row in rows:
+            job = self.job_model.job(row)
+            if job.is_stoppable():
+                job.stop()
+            job.log.spill()
+            if job in self.panels:
+                self.discard_panel(job, self.panels.pop(job))
+        self.job_model.remove_rows(rows)
 
     def run_all_jobs(self):
         """
-        Attempts to run all jobs in the job panel
+        Attempts to run all jobs in the table
         """
-        for i in range(len(self.tab_panel)):
-            if self.tab_panel.widget(i).is_runnable():
-                self.tab_panel.widget(i).run_job_callback_fxn()
+        for job in list(self.job_model.jobs):
+            if job.is_runnable():
+                job.run()
 
     def stop_all_jobs(self):
         """
-        Attempts to stop all jobs in the job panel
+        Attempts to stop all jobs in the table
         """
-        for i in range(len(self.tab_panel)):
-            if self.tab_panel.widget(i).is_stoppable():
-                self.tab_panel.widget(i).stop_job_callback_fxn()
+        for job in list(self.job_model.jobs):
+            if job.is_stoppable():
+                job.stop()
 
     def closeEvent(self, event):
         self.stop_all_jobs()
-        self.worker_thread_pool.shutdown(wait=False)
+        self.flush_timer.stop()
+        for job in self.job_model.jobs:
+            job.log.spill()
+        self.pipeline_scheduler.shutdown(wait=False)
+        if getattr(self.pipeline_scheduler, 'job_store', None) is not None:
+            self.pipeline_scheduler.job_store.flush()
         self.process_output_monitor.stop()
         event.accept()
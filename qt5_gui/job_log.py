@@ -0,0 +1,144 @@
+import collections
+import threading
+
+
+# the number of output lines kept in memory per job, if not configured otherwise
+DEFAULT_MAX_LINES = 1000
+
+
+class JobLog(object):
+    """
+    The output of a job: its last max_lines lines in a ring buffer and, if a log file is given, all of them on disk.
+    Output is appended by the process output monitor's thread. The GUI thread renders it in batches (see take_pending),
+    and only while a panel follows the log, so logs of jobs nobody looks at cost no rendering.
+    """
+
+    # the number of complete lines collected before they are appended to the log file
+    SPILL_BATCH_SIZE = 200
+    # the maximum length of output pending to be rendered. beyond it, the whole log is rendered again instead
+    MAX_PENDING_LENGTH = 64 * 1024
+
+    __slots__ = ['lock', 'lines', 'current_line', 'ends_with_progress_line', 'log_file', 'unspilled',
+                 'following', 'pending', 'pending_overwrite', 'reset']
+
+    def __init__(self, max_lines=DEFAULT_MAX_LINES, log_file=None):
+        """
+        Parameters:
+        -----------
+        max_lines: int - (optional) the number of complete lines kept in memory
+
+        log_file: str - (optional) the file all complete lines are appended to. may be set later, see set_log_file
+        """
+        self.lock = threading.Lock()
+        self.lines = collections.deque(maxlen=max_lines)   # complete lines, the oldest are dropped first
+        self.current_line = ''                  # the last, incomplete line
+        self.ends_with_progress_line = False    # the current line is overwritten by the next output
+        self.log_file = log_file
+        self.unspilled = []                     # complete lines not yet appended to the log file
+        self.following = False                  # a panel renders this log
+        self.pending = ''                       # the output appended since the last take_pending
+        self.pending_overwrite = False          # pending replaces the last rendered line
+        self.reset = True                       # the follower has to render the whole log
+
+    @property
+    def max_lines(self):
+        return self.lines.maxlen
+
+    def append(self, msg):
+        """
+        Appends a message as coalesced by the ProcessOutputMonitor. May be called from any thread.
+        As in a terminal, a message following one ending in a carriage return replaces the last line.
+        """
+        with self.lock:
+            # a leading line feed (of a \r\n split across two reads) keeps the progress line instead
+            overwrite = self.ends_with_progress_line and not msg.startswith('\n')
+            if overwrite:
+                self.current_line = ''
+            self.ends_with_progress_line = msg.endswith('\r')
+            text = msg.rstrip('\r')
+            lines = text.split('\n')
+            self.current_line += lines[0]
+            if len(lines) > 1:
+                complete_lines = [self.current_line] + lines[1:-1]
+                self.current_line = lines[-1]
+                self.lines.extend(complete_lines)
+                if self.log_file is not None:
+                    self.unspilled.extend(complete_lines)
+                    if len(self.unspilled) >= JobLog.SPILL_BATCH_SIZE:
+                        self._spill()
+            if self.following and not self.reset:
+                self._add_pending(text, overwrite)
+
+    def _add_pending(self, text, overwrite):
+        if overwrite:
+            last_line_start = self.pending.rfind('\n') + 1
+            if last_line_start > 0:
+                # the line to replace has not been rendered yet
+                self.pending = self.pending[:last_line_start]
+            else:
+                self.pending = ''
+                self.pending_overwrite = True
+        self.pending += text
+        if len(self.pending) > JobLog.MAX_PENDING_LENGTH:
+            # the buffered lines are cheaper to render at once
+            self.pending, self.pending_overwrite, self.reset = '', False, True
+
+    def follow(self, following):
+        """
+        Starts or stops collecting output to be rendered. A new follower renders the whole log first.
+        """
+        with self.lock:
+            self.following = following
+            self.pending, self.pending_overwrite, self.reset = '', False, True
+
+    def take_pending(self):
+        """
+        Returns the output to be rendered since the last call, or None if there is none.
+
+        Returns:
+        --------
+        (text, overwrite, reset): text replaces the whole rendered log if reset is set, and is appended otherwise,
+        replacing the last rendered line first if overwrite is set
+        """
+        with self.lock:
+            if self.reset:
+                self.pending, self.pending_overwrite, self.reset = '', False, False
+                return self._text(), False, True
+            if not self.pending and not self.pending_overwrite:
+                return None
+            pending = self.pending, self.pending_overwrite, False
+            self.pending, self.pending_overwrite = '', False
+            return pending
+
+    def text(self):
+        with self.lock:
+            return self._text()
+
+    def _text(self):
+        return '\n'.join(list(self.lines) + [self.current_line])
+
+    def set_log_file(self, log_file):
+        """
+        Sets the file complete lines are appended to from now on
+        """
+        with self.lock:
+            self._spill()
+            self.log_file = log_file
+
+    def spill(self):
+        """
+        Appends the complete lines not yet written to the log file, if any
+        """
+        with self.lock:
+            self._spill()
+
+    def _spill(self):
+        if self.log_file is None or not self.unspilled:
+            return
+        try:
+            # the file is not kept open, so thousands of jobs do not exhaust the file descriptors
+            with open(self.log_file, 'at') as f:
+                f.write('\n'.join(self.unspilled) + '\n')
+        except OSError as e:
+            print('[yt2mp3] Could not write to log file "{}": {}'.format(self.log_file, e))
+        self.unspilled = []
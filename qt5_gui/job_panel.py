@@ -6,54 +6,33 @@ from PyQt5.QtWidgets import QLineEdit        # pylint: disable=F0401
 from PyQt5.QtWidgets import QCheckBox        # pylint: disable=F0401
 from PyQt5.QtWidgets import QFileDialog      # pylint: disable=F0401
 from PyQt5.QtWidgets import QPlainTextEdit   # pylint: disable=F0401
+from PyQt5.QtWidgets import QProgressBar     # pylint: disable=F0401
+from PyQt5 import QtGui                      # pylint: disable=F0401
 
-from threading import current_thread
-import argparse
+import yt2mp3_progress
 
-import yt2mp3
-import yt2mp3_utils
+from .job_table import Job
 
 
 class JobPanel(QWidget):
     """
-    A Widget class representing all information required for executing
-    a download+conversion job
+    A Widget class for editing a download+conversion job and following its output.
+    All information lives in the Job: panels are only created for jobs being looked at, and may be discarded any time.
     """
 
-    # JOB STATI
-    STATUS_IDLE = 0
-    STATUS_SUBMITTED = 1
-    STATUS_RUNNING = 2
-    STATUS_FINISHED = 3
-    STATUS_STOPPED = 4
-    STATUS_FAILED = 5
-
-    def __init__(self, worker_thread_pool, gui_communicator_thread_pool, argparse_namespace):
+    def __init__(self, job):
         """
         Constitutes a GUI container for job information and execution.
-        Holds the necessary data, allows editing of parameters.
+        Shows the data of the job, allows editing of parameters.
 
         Parameters:
         -----------
-        worker_thread_pool: multiprocessing.Pool - Executor for running jobs.
-        gui_communicator_thread_pool: multiprocessing.Pool - Executor for communicating with background processes
-
-        argparse_namespace: argparse.Namespace - container for job data
+        job: Job - the job to edit. its panel is set to this JobPanel
         """
         super(QWidget, self).__init__()
 
-        # use this ThreadPoolExecutor instance for executing jobs
-        self.worker_thread_pool = worker_thread_pool
-        self.communicator_thread_pool = gui_communicator_thread_pool
-        # use this argparse.Namespace instance for job data specification
-        self.argparse_namespace = argparse_namespace
-        # use this to keep track of all created subprocess (in case they need killin')
-        # yt2mp3.download_convert_split provides an interface for that list.
-        self.child_processes = []
-        self.worker_thread = None
-        self.communicator_thread = None
-        self.containing_tab = None
-        self.job_status = JobPanel.STATUS_IDLE
+        self.job = job
+        job.panel = self
 
         ################################
         # set up tab elements and layout
@@ -64,40 +43,47 @@ class JobPanel(QWidget):
         # an option to enter that information as QTextEdit/QFileDialog
         # controls and feedback (QPlainTextEdit, setReadOnly(True)) for this one job.
 
-        # create gui elements and populate with default values from self.argparse_namespace
+        # create gui elements and populate with the current values of the job
         self.video_id_url_label = QLabel('URL/ID')
         self.video_id_url_input = QLineEdit()
-        self.video_id_url_input.setText(argparse_namespace.video[0] if argparse_namespace.video else '')
+        self.video_id_url_input.setText(job.video())
 
         self.output_location_label = QLabel('Output location')
         self.output_location_input = QLineEdit()
-        self.output_location_input.setText(argparse_namespace.output)
+        self.output_location_input.setText(job.option('output'))
         self.output_location_dialog_button = QPushButton('Choose...')
 
         self.segment_output_label = QLabel('Split output into segments')
         self.segment_output_checkbox = QCheckBox()
-        self.segment_output_checkbox.setChecked(self.argparse_namespace.segment_length is not None)
+        self.segment_output_checkbox.setChecked(job.segmented)
 
         self.output_segment_duration_label = QLabel('Output segment duration')
         self.output_segment_duration_input = QLineEdit()
         self.output_segment_duration_input.setEnabled(self.segment_output_checkbox.isChecked())
         self.output_segment_duration_label.setEnabled(self.segment_output_checkbox.isChecked())
-        self.output_segment_duration_input.setText(str(self.argparse_namespace.segment_length).replace('None', ''))
+        self.output_segment_duration_input.setText(str(job.option('segment_length')).replace('None', ''))
 
         self.output_segment_name_pattern_label = QLabel('Segment name pattern')
         self.output_segment_name_pattern_input = QLineEdit()
         self.output_segment_duration_label.setEnabled(self.segment_output_checkbox.isChecked())
         self.output_segment_name_pattern_input.setEnabled(self.segment_output_checkbox.isChecked())
-        self.output_segment_name_pattern_input.setText(self.argparse_namespace.segment_name)
+        self.output_segment_name_pattern_input.setText(job.option('segment_name'))
 
         self.output_window_label = QLabel('Process output')
         self.output_window = QPlainTextEdit()
         self.output_window.setEnabled(True)
         self.output_window.setReadOnly(True)
+        # like the job's log, the widget only keeps the most recent lines
+        self.output_window.setMaximumBlockCount(job.log.max_lines + 1)
+        # the output is rendered by render_output, once the panel is shown
 
         self.run_job_button = QPushButton('Run')
         self.stop_job_button = QPushButton('Stop')
         self.job_status_label = QLabel('')
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setTextVisible(True)
 
         ##############
         # assemble tab
@@ -128,6 +114,7 @@ class JobPanel(QWidget):
         layout.setRowStretch(6, 1)
 
         layout.addWidget(self.output_window_label, 7, 0)
+        layout.addWidget(self.progress_bar, 7, 1)
         layout.addWidget(self.job_status_label, 7, 2)
         layout.addWidget(self.output_window, 8, 0, 1, 3)
         layout.setRowStretch(8, 2)  # make output text box two rows high
@@ -152,37 +139,6 @@ class JobPanel(QWidget):
         # configure UI activity status
         self.update_user_interface()
 
-    def is_runnable(self):
-        """
-        Are all required arguments present to run the job?
-        """
-
-        if self.job_status in [JobPanel.STATUS_SUBMITTED, JobPanel.STATUS_RUNNING]:
-            # currently submitted stuff can not be re-submitted
-            return False
-        elif not ((self.argparse_namespace.video and len(self.argparse_namespace.video[0]) > 0) and self.argparse_namespace.output):
-            # can not run incomplete input sets
-            return False
-        elif (self.segment_output_checkbox.isChecked() and
-              not (self.argparse_namespace.segment_name and
-                   self.argparse_namespace.segment_length and
-                   self.argparse_namespace.segment_length > 0
-                   )
-              ):
-            # can not run incomplete optional input sets
-            return False
-        elif self.job_status in [JobPanel.STATUS_FINISHED]:
-            # no running of finished jobs to avoid overwriting of results.
-            return False
-        else:
-            return True
-
-    def is_stoppable(self):
-        """
-        Is there anything in this job, which can be stopped?
-        """
-        return self.job_status in [JobPanel.STATUS_RUNNING, JobPanel.STATUS_SUBMITTED]
-
     def enable_these_elements(self, *args):
         for a in args:
             a.setEnabled(True)
@@ -205,7 +161,7 @@ class JobPanel(QWidget):
         self.disable_these_elements(self.stop_job_button,
                                     self.output_window)
 
-        if self.is_runnable():
+        if self.job.is_runnable():
             self.enable_these_elements(self.run_job_button)
         else:
             self.disable_these_elements(self.run_job_button)
@@ -226,72 +182,80 @@ class JobPanel(QWidget):
 
     def update_user_interface(self):
         """
-        Enables/disables UI elements wrt process status and/or enterd data.
+        Enables/disables UI elements wrt process status and/or enterd data, and shows the job's progress.
+        Must be called from the GUI thread, see JobTableModel.flush.
         """
-        if self.job_status == JobPanel.STATUS_IDLE:
+        job_status = self.job.status
+        if job_status == Job.STATUS_IDLE:
             self.job_status_label.setText('Status: Idle')
             self.gui_to_edit_mode()
 
-        elif self.job_status == JobPanel.STATUS_SUBMITTED:
+        elif job_status == Job.STATUS_SUBMITTED:
             self.job_status_label.setText('Status: Submitted')
             self.gui_to_submitted_mode()
 
-        elif self.job_status == JobPanel.STATUS_RUNNING:
+        elif job_status == Job.STATUS_RUNNING:
             self.job_status_label.setText('Status: Running')
-            # comes after running. no change in UI elements
+            # comes after submitted. the UI elements are the same
+            self.gui_to_submitted_mode()
 
-        elif self.job_status == JobPanel.STATUS_FINISHED:
+        elif job_status == Job.STATUS_FINISHED:
             self.job_status_label.setText('Status: Finished')
             # keep inputs deactivated. all of them.
+            self.gui_to_submitted_mode()
             self.disable_these_elements(self.stop_job_button)
 
-        elif self.job_status == JobPanel.STATUS_STOPPED:
+        elif job_status == Job.STATUS_STOPPED:
             self.job_status_label.setText('Status: Stopped')
             self.gui_to_edit_mode()
             # reactivate inputs to allow editing/fixing of wrong params
 
-        elif self.job_status == JobPanel.STATUS_FAILED:
+        elif job_status == Job.STATUS_FAILED:
             self.job_status_label.setText('Status: Failed')
             self.gui_to_edit_mode()
             # reactivate inputs to allow editing/fixing of wrong params
 
         else:
-            raise Exception('Unknown job status id {}'.format(self.job_status))
+            raise Exception('Unknown job status id {}'.format(job_status))
+
+        if self.job.pipeline_job is not None:
+            self.show_progress(self.job.pipeline_job.progress.snapshot())
         # TODO Capture REGULAR printline outputs! (reroute to process_watcher.pipes?)
         # TODO add job cleanup button to kill remaining .tmp-folders.
 
-    def get_args(self, copy=True):
+    def show_progress(self, snapshot):
         """
-        Returns the argparse.Namespace object of this JobPanel instance
-
-        Parameters:
-        -----------
-        copy: bool - (optional). Default:True . Controls wheter to return a
-            copy or a reference to the argparse.Namespace object
+        Renders a progress snapshot (see yt2mp3_progress.JobProgress.snapshot) in the progress bar
+        """
+        self.progress_bar.setValue(int(snapshot['percent'] or 0))
+        self.progress_bar.setFormat(yt2mp3_progress.format_progress(snapshot))
 
-        Returns:
-        --------
-        argparse.Namespace containing this JobPanel's configuration
+    def render_output(self):
+        """
+        Renders the output appended to the job's log since the last call in a single update, see JobLog.take_pending.
+        The job's log has to be followed while this panel is shown.
         """
-        if copy:
-            arg_copy = argparse.Namespace(**vars(self.argparse_namespace))
-            arg_copy.video = []
-            arg_copy.video.extend(self.argparse_namespace.video)
-            return arg_copy
+        pending = self.job.log.take_pending()
+        if pending is None:
+            return
+        text, overwrite, reset = pending
+        if reset:
+            self.output_window.setPlainText(text)
         else:
-            return self.argparse_namespace
+            cursor = self.output_window.textCursor()
+            cursor.movePosition(QtGui.QTextCursor.End)
+            if overwrite:
+                cursor.movePosition(QtGui.QTextCursor.StartOfBlock, QtGui.QTextCursor.KeepAnchor)
+                cursor.removeSelectedText()
+            cursor.insertText(text)
+        self.output_window.moveCursor(QtGui.QTextCursor.End)
 
     def parse_video_id_url_callback_fxn(self):
         """
-        Attempts to parse video URL output fiel and add its value to self.argparse_namespace
+        Attempts to parse video URL output fiel and add its value to the job
         """
-        # NOTE: self.argparse_namespace is a list of strings!
-        text = self.video_id_url_input.text()
-        if len(self.argparse_namespace.video) == 0:
-            self.argparse_namespace.video.append(text)
-        else:
-            self.argparse_namespace.video[0] = text
-
+        # NOTE: the video option is a list of strings!
+        self.job.set_option('video', [self.video_id_url_input.text()])
         # update UI elements
         self.update_user_interface()
 
@@ -299,7 +263,7 @@ class JobPanel(QWidget):
         """
         Attempts to parse output path
         """
-        self.argparse_namespace.output = self.output_location_input.text()
+        self.job.set_option('output', self.output_location_input.text())
         # update UI elements
         self.update_user_interface()
 
@@ -329,10 +293,8 @@ class JobPanel(QWidget):
         self.output_segment_duration_input.setEnabled(box_is_checked)
         self.output_segment_name_pattern_input.setEnabled(box_is_checked)
 
-        if box_is_checked:
-            self.parse_output_segment_length_callback_fxn()
-        else:
-            self.argparse_namespace.segment_length = None
+        self.job.segmented = box_is_checked
+        self.parse_output_segment_length_callback_fxn()
 
     def parse_output_segment_length_callback_fxn(self):
         """
@@ -342,12 +304,11 @@ class JobPanel(QWidget):
         text = self.output_segment_duration_input.text()
         if text:
             try:
-                self.argparse_namespace.segment_length = int(text)
+                self.job.set_option('segment_length', int(text))
             except ValueError:
-                self.argparse_namespace.segment_length = -1
-                pass
+                self.job.set_option('segment_length', -1)
         else:
-            self.argparse_namespace.segment_length = None
+            self.job.set_option('segment_length', None)
         # update UI elements
         self.update_user_interface()
 
@@ -355,85 +316,20 @@ class JobPanel(QWidget):
         """
         Attempts to parse the output name pattern for segmented mp3 files
         """
-        self.argparse_namespace.segment_name = self.output_segment_name_pattern_input.text()
-        # update UI elements
-        self.update_user_interface()
-
-    def run_job_function(self):
-        """
-        Container function for submission to self.thread_pool
-        holding all necessary functionality for runnanle and stoppable job treads
-        """
-        if self.thread_level_job_stop_check():
-            return
-
-        self.job_status = JobPanel.STATUS_RUNNING
-        self.update_user_interface()
-        self.worker_thread = current_thread()
-
-        try:
-            yt2mp3_utils.check_requirements()
-            yt2mp3.download_convert_split(self.argparse_namespace, self)
-            if not self.job_status == JobPanel.STATUS_STOPPED:
-                self.job_status = JobPanel.STATUS_FINISHED
-
-        except Exception as e:
-            # has the job been stopped manually, or has it crashed?
-            if not self.job_status == JobPanel.STATUS_STOPPED:
-                self.job_status = JobPanel.STATUS_FAILED
-                print(e)
-
+        self.job.set_option('segment_name', self.output_segment_name_pattern_input.text())
         # update UI elements
         self.update_user_interface()
 
     def run_job_callback_fxn(self):
         """
-        Try to run this JobPanel's job according to parameterization
+        Try to run the job according to parameterization
         """
-        self.job_status = JobPanel.STATUS_SUBMITTED
+        self.job.run()
         self.update_user_interface()
-        self.worker_thread_pool.submit(self.run_job_function)
-
-    def thread_level_job_stop_check(self):
-        if self.job_status == JobPanel.STATUS_STOPPED:
-            self.update_user_interface()
-            return True
-        else:
-            return False
 
     def stop_job_callback_fxn(self):
         """
-        Try to stop this JobPanel's job according to parameterization
+        Try to stop the job according to parameterization
         """
-        self.job_status = JobPanel.STATUS_STOPPED
-
-        for p in self.child_processes:
-            print('KILLING CHILD PROCESS', p)
-            p.kill()
-
-        self.child_processes = []
-        self.worker_thread = None
-        self.communicator_thread = None
-        # update UI elements
+        self.job.stop()
         self.update_user_interface()
-
-    def get_process_output(self, timeout):
-        """
-        Collects and returns the string produced by all subprocesses
-        """
-
-        # problem: youtube-dl writes to stdout, ffmpeg writes to stderr.
-        # attempting to read the one blocks the other.
-        # TODO: work smarter. assemble a message instead of reading line-by-line.
-        # msg = ''
-        for p in self.child_processes:
-            out_line = p.stdout.readline()
-            if out_line:
-                return out_line
-                # msg += out_line
-
-                # PROBLEM: FFMPEG WRITES IN x-sec intervals. blocks all other stdouts with only one thread managing console IO
-                # seprate manager for all processes?
-                # NOTE: maybe later. for now, this is ok.
-
-        # return msg
@@ -0,0 +1,455 @@
+from PyQt5.QtCore import Qt                      # pylint: disable=F0401
+from PyQt5.QtCore import QAbstractTableModel     # pylint: disable=F0401
+from PyQt5.QtCore import QModelIndex             # pylint: disable=F0401
+from PyQt5.QtCore import pyqtSignal              # pylint: disable=F0401
+
+import argparse
+import os
+import threading
+
+import yt2mp3_utils
+import yt2mp3_pipeline
+import yt2mp3_progress
+import yt2mp3_metadata
+import yt2mp3_postprocess
+
+from .job_log import JobLog
+from .job_log import DEFAULT_MAX_LINES
+
+
+class ChildProcessList(list):
+    """
+    A list of child processes, which reports each appended process to a callback
+    """
+
+    def __init__(self, append_callback=None):
+        super().__init__()
+        self.append_callback = append_callback
+
+    def append(self, process):
+        super().append(process)
+        if self.append_callback:
+            self.append_callback(process)
+
+
+class Job(object):
+    """
+    A download+conversion job of the GUI: its options, status and output, without any widgets.
+    Jobs share the options they have not changed with the other jobs created from the same arguments,
+    and only hold their own values (e.g. video and output location), so thousands of jobs stay cheap.
+    Editor widgets (see JobPanel) are created for few jobs at a time and render the job's state.
+    """
+
+    # JOB STATI
+    STATUS_IDLE = 0
+    STATUS_SUBMITTED = 1
+    STATUS_RUNNING = 2
+    STATUS_FINISHED = 3
+    STATUS_STOPPED = 4
+    STATUS_FAILED = 5
+    STATI = [STATUS_IDLE, STATUS_SUBMITTED, STATUS_RUNNING, STATUS_FINISHED, STATUS_STOPPED, STATUS_FAILED]
+    STATUS_NAMES = {STATUS_IDLE: 'Idle',
+                    STATUS_SUBMITTED: 'Submitted',
+                    STATUS_RUNNING: 'Running',
+                    STATUS_FINISHED: 'Finished',
+                    STATUS_STOPPED: 'Stopped',
+                    STATUS_FAILED: 'Failed'}
+
+    __slots__ = ['base_args', 'options', 'segmented', 'status', 'pipeline_job', 'resume_from', 'child_processes',
+                 'log', 'pipeline_scheduler', 'process_output_monitor',
+                 'model', 'panel', 'counted_status', 'counted_runnable', 'finish_counted']
+
+    def __init__(self, pipeline_scheduler, base_args, options=None, process_output_monitor=None):
+        """
+        Parameters:
+        -----------
+        pipeline_scheduler: yt2mp3_pipeline.PipelineScheduler - Executor for running jobs.
+
+        base_args: argparse.Namespace - the options shared with other jobs. not modified
+
+        options: dict - (optional) the options of this job which differ from base_args, e.g. video and output
+
+        process_output_monitor: ProcessOutputMonitor - (optional) collects the output of this job's child processes
+        """
+        self.pipeline_scheduler = pipeline_scheduler
+        self.base_args = base_args
+        self.options = dict(options or {})
+        if 'video' not in self.options:
+            self.options['video'] = list(base_args.video[:1])
+        self.segmented = self.option('segment_length') is not None   # the user asked for segments
+        self.status = Job.STATUS_IDLE
+        self.pipeline_job = None
+        self.resume_from = None
+        self.process_output_monitor = process_output_monitor
+        # use this to keep track of all created subprocess (in case they need killin')
+        # the yt2mp3_pipeline stages provide an interface for that list.
+        self.child_processes = ChildProcessList(self.watch_child_process)
+        self.log = JobLog(getattr(base_args, 'log_lines', None) or DEFAULT_MAX_LINES)
+        self.model = None           # the JobTableModel listing this job
+        self.panel = None           # the JobPanel editing this job, if one has been created
+        # the status and runnability the model's summary currently counts this job with, see JobTableModel.flush
+        self.counted_status = None
+        self.counted_runnable = False
+        self.finish_counted = False
+
+    def option(self, name):
+        """
+        Returns the value of an option of this job
+        """
+        if name in self.options:
+            return self.options[name]
+        return getattr(self.base_args, name, None)
+
+    def set_option(self, name, value):
+        """
+        Sets an option of this job, e.g. while it is edited
+        """
+        self.options[name] = value
+        self.changed()
+
+    def get_args(self):
+        """
+        Returns a new argparse.Namespace with all options of this job
+        """
+        args_namespace = argparse.Namespace(**vars(self.base_args))
+        for name, value in self.options.items():
+            setattr(args_namespace, name, list(value) if isinstance(value, list) else value)
+        return args_namespace
+
+    def video(self):
+        video = self.option('video')
+        return video[0] if video else ''
+
+    def name(self):
+        """
+        Returns the title of the video once its metadata has been prefetched, or the URL/ID otherwise
+        """
+        video = self.video()
+        if not video:
+            return ''
+        metadata = self.pipeline_job.state.metadata if self.pipeline_job is not None else None
+        if metadata is None:
+            metadata = yt2mp3_metadata.metadata_cache_from_args(self.base_args).get_any(video)
+        return metadata['title'] if metadata is not None else video
+
+    def progress_text(self):
+        if self.status == Job.STATUS_FINISHED:
+            return 'Done'
+        if self.status != Job.STATUS_RUNNING or self.pipeline_job is None:
+            return ''
+        return yt2mp3_progress.format_progress(self.pipeline_job.progress.snapshot())
+
+    def changed(self):
+        """
+        Reports a change of this job's status, options or progress to the model. May be called from any thread.
+        """
+        if self.model is not None:
+            self.model.job_changed(self)
+
+    def is_runnable(self):
+        """
+        Are all required arguments present to run the job?
+        """
+        segment_length = self.option('segment_length')
+        if self.status in [Job.STATUS_SUBMITTED, Job.STATUS_RUNNING]:
+            # currently submitted stuff can not be re-submitted
+            return False
+        elif not (self.video() and self.option('output')):
+            # can not run incomplete input sets
+            return False
+        elif self.segmented and not (self.option('segment_name') and segment_length and segment_length > 0):
+            # can not run incomplete optional input sets
+            return False
+        elif self.status in [Job.STATUS_FINISHED]:
+            # no running of finished jobs to avoid overwriting of results.
+            return False
+        else:
+            return True
+
+    def is_stoppable(self):
+        """
+        Is there anything in this job, which can be stopped?
+        """
+        return self.status in [Job.STATUS_RUNNING, Job.STATUS_SUBMITTED]
+
+    def run(self):
+        """
+        Try to run this job according to parameterization
+        """
+        self.status = Job.STATUS_SUBMITTED
+        self.changed()
+        args_namespace = self.get_args()
+        if not self.segmented:
+            args_namespace.segment_length = None
+        # the complete output is appended to a log file per video, if configured
+        log_dir = self.option('log_dir')
+        if log_dir:
+            log_dir = os.path.abspath(os.path.expanduser(log_dir))
+            yt2mp3_utils.ensure_dir_exists(log_dir)
+            self.log.set_log_file(os.path.join(log_dir, '{}.log'.format(yt2mp3_utils.video_id(self.video()))))
+        self.pipeline_job = self.pipeline_scheduler.submit(args_namespace, self, self.pipeline_stage_callback_fxn,
+                                                           resume_from=self.resume_from)
+        self.resume_from = None
+        self.pipeline_job.future.add_done_callback(lambda future, job=self.pipeline_job: self.pipeline_job_done_callback_fxn(job))
+
+    def stop(self):
+        """
+        Try to stop this job according to parameterization
+        """
+        self.status = Job.STATUS_STOPPED
+        if self.pipeline_job:
+            self.pipeline_job.stop()
+
+        for p in self.child_processes:
+            print('KILLING CHILD PROCESS', p)
+            p.kill()
+
+        self.child_processes = ChildProcessList(self.watch_child_process)
+        self.log.spill()
+        self.changed()
+
+    def pipeline_stage_callback_fxn(self, pipeline_job, stage):
+        """
+        Called by the pipeline scheduler's worker threads whenever this job enters a new stage
+        """
+        if pipeline_job.stopped or self.status == Job.STATUS_STOPPED:
+            return
+
+        if self.status == Job.STATUS_SUBMITTED and stage != yt2mp3_pipeline.PipelineJob.STAGE_QUEUED:
+            # resumed jobs may skip the download stage
+            yt2mp3_utils.check_requirements(yt2mp3_pipeline.output_format_of(pipeline_job.state.args),
+                                            yt2mp3_postprocess.required_filters(
+                                                yt2mp3_postprocess.settings_from_args(pipeline_job.state.args)))
+            self.status = Job.STATUS_RUNNING
+        self.changed()
+
+    def pipeline_job_done_callback_fxn(self, pipeline_job):
+        """
+        Called once this job's pipeline job has finished, failed or been cancelled
+        """
+        if pipeline_job.stopped or pipeline_job.future.cancelled():
+            # stopped jobs have already been handled by stop
+            return
+
+        exception = pipeline_job.future.exception()
+        # has the job been stopped manually, or has it crashed?
+        if not self.status == Job.STATUS_STOPPED:
+            if exception is None:
+                self.status = Job.STATUS_FINISHED
+            else:
+                self.status = Job.STATUS_FAILED
+                print(exception)
+        self.log.spill()
+        self.changed()
+
+    def watch_child_process(self, process):
+        """
+        Hands a newly started child process over to the process output monitor
+        """
+        if self.process_output_monitor:
+            self.process_output_monitor.watch_process(self, process)
+
+    def handle_output(self, line):
+        """
+        Hands an output line not read from a child process over to the process output monitor,
+        e.g. of a job running in a daemon or of the in-process download engine
+        """
+        if self.process_output_monitor:
+            self.process_output_monitor.post_output(self, line)
+
+    def duration(self):
+        """
+        Returns the time in seconds from the start of the download to the end of the job, or None
+        """
+        if self.pipeline_job is None:
+            return None
+        timestamps = self.pipeline_job.timestamps
+        if yt2mp3_pipeline.PipelineJob.STAGE_DOWNLOADING in timestamps and yt2mp3_pipeline.PipelineJob.STAGE_DONE in timestamps:
+            return timestamps[yt2mp3_pipeline.PipelineJob.STAGE_DONE] - timestamps[yt2mp3_pipeline.PipelineJob.STAGE_DOWNLOADING]
+        return None
+
+
+class JobTableModel(QAbstractTableModel):
+    """
+    The table of all jobs of the GUI, one row per Job.
+    Jobs report changes from any thread (see Job.changed). The changes are applied in the GUI thread by flush,
+    which repaints only the changed rows and keeps the summary counts up to date incrementally,
+    so neither depends on the total number of jobs.
+    """
+
+    COLUMN_STATUS = 0
+    COLUMN_NAME = 1
+    COLUMN_OUTPUT = 2
+    COLUMN_PROGRESS = 3
+    HEADERS = ['Status', 'Video', 'Output', 'Progress']
+
+    # status counts, number of runnable jobs, number of stoppable jobs
+    summary_changed = pyqtSignal(dict, int, int)
+
+    def __init__(self, status_icons=None, parent=None):
+        """
+        Parameters:
+        -----------
+        status_icons: dict - (optional) Job status -> QIcon shown in the status column
+
+        parent: QObject - (optional) the Qt parent object
+        """
+        super().__init__(parent)
+        self.status_icons = status_icons or {}
+        self.jobs = []
+        self.rows = {}                  # job -> row
+        self.lock = threading.Lock()
+        self.dirty = set()              # jobs changed since the last flush
+        self.status_counts = {status: 0 for status in Job.STATI}
+        self.n_runnable = 0
+        self.running = set()            # jobs with status running
+        self.finished_seconds = 0.      # the total and number of durations of the finished jobs
+        self.n_finished_durations = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.jobs)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(JobTableModel.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        job = self.jobs[index.row()]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            if column == JobTableModel.COLUMN_STATUS:
+                return Job.STATUS_NAMES[job.status]
+            elif column == JobTableModel.COLUMN_NAME:
+                return job.name()
+            elif column == JobTableModel.COLUMN_OUTPUT:
+                return os.path.basename(job.option('output') or '')
+            elif column == JobTableModel.COLUMN_PROGRESS:
+                return job.progress_text()
+        elif role == Qt.DecorationRole and column == JobTableModel.COLUMN_STATUS:
+            return self.status_icons.get(job.status)
+        elif role == Qt.ToolTipRole:
+            if column == JobTableModel.COLUMN_NAME:
+                return job.video()
+            elif column == JobTableModel.COLUMN_OUTPUT:
+                return job.option('output')
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return JobTableModel.HEADERS[section]
+        return None
+
+    def job(self, row):
+        return self.jobs[row]
+
+    def row_of(self, job):
+        return self.rows.get(job)
+
+    def add_jobs(self, jobs):
+        """
+        Appends jobs to the table, in a single insertion
+        """
+        if not jobs:
+            return
+        first = len(self.jobs)
+        self.beginInsertRows(QModelIndex(), first, first + len(jobs) - 1)
+        for row, job in enumerate(jobs, first):
+            job.model = self
+            self.jobs.append(job)
+            self.rows[job] = row
+        self.endInsertRows()
+        with self.lock:
+            self.dirty.update(jobs)
+
+    def remove_rows(self, rows):
+        """
+        Removes the jobs in the given rows from the table. Running jobs should be stopped before.
+        """
+        # remove ranges of consecutive rows from the end, so the remaining row numbers stay valid
+        for first, last in reversed(JobTableModel._ranges(rows)):
+            self.beginRemoveRows(QModelIndex(), first, last)
+            removed = self.jobs[first:last + 1]
+            del self.jobs[first:last + 1]
+            self.endRemoveRows()
+            for job in removed:
+                self._uncount(job)
+                job.model = None
+        self.rows = {job: row for row, job in enumerate(self.jobs)}
+        self.summary_changed.emit(dict(self.status_counts), self.n_runnable, self.n_stoppable())
+
+    def job_changed(self, job):
+        """
+        Marks the row of a job for repainting with the next flush. May be called from any thread.
+        """
+        with self.lock:
+            self.dirty.add(job)
+
+    def flush(self):
+        """
+        Repaints the rows of the jobs changed since the last flush and updates the summary counts.
+        To be called periodically from the GUI thread.
+
+        Returns:
+        --------
+        list of the changed jobs
+        """
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+        changed_jobs = [job for job in dirty if job in self.rows]
+        if not changed_jobs:
+            return changed_jobs
+        summary = (dict(self.status_counts), self.n_runnable)
+        for job in changed_jobs:
+            self._recount(job)
+        for first, last in JobTableModel._ranges(self.rows[job] for job in changed_jobs):
+            self.dataChanged.emit(self.index(first, 0), self.index(last, len(JobTableModel.HEADERS) - 1))
+        if summary != (self.status_counts, self.n_runnable):
+            self.summary_changed.emit(dict(self.status_counts), self.n_runnable, self.n_stoppable())
+        return changed_jobs
+
+    def n_stoppable(self):
+        return self.status_counts[Job.STATUS_SUBMITTED] + self.status_counts[Job.STATUS_RUNNING]
+
+    def mean_job_seconds(self):
+        """
+        Returns the mean duration of the finished jobs, or None
+        """
+        return self.finished_seconds / self.n_finished_durations if self.n_finished_durations else None
+
+    def _recount(self, job):
+        self._uncount(job)
+        status = job.status
+        job.counted_status = status
+        job.counted_runnable = job.is_runnable()
+        self.status_counts[status] += 1
+        self.n_runnable += job.counted_runnable
+        if status == Job.STATUS_RUNNING:
+            self.running.add(job)
+        if status == Job.STATUS_FINISHED and not job.finish_counted:
+            duration = job.duration()
+            if duration is not None:
+                job.finish_counted = True
+                self.finished_seconds += duration
+                self.n_finished_durations += 1
+
+    def _uncount(self, job):
+        if job.counted_status is not None:
+            self.status_counts[job.counted_status] -= 1
+            self.n_runnable -= job.counted_runnable
+            job.counted_status = None
+            job.counted_runnable = False
+        self.running.discard(job)
+
+    @staticmethod
+    def _ranges(rows):
+        """
+        Groups row numbers into (first, last) ranges of consecutive rows, in ascending order
+        """
+        ranges = []
+        for row in sorted(set(rows)):
+            if ranges and ranges[-1][1] == row - 1:
+                ranges[-1][1] = row
+            else:
+                ranges.append([row, row])
+        return [tuple(row_range) for row_range in ranges]
@@ -1,61 +1,149 @@
 import os
-import time
-from PyQt5.QtCore import QObject             # pylint: disable=F0401
-from PyQt5.QtCore import pyqtSignal
+import re
+import codecs
+import socket
+import selectors
+import threading
 from threading import Thread
-from .job_panel import JobPanel
 
 
-class ProcessOutputMonitor(QObject):
+class ProcessOutputMonitor(object):
     """
-    A Monitor for handling subprocess communication
+    A Monitor for handling subprocess communication.
+
+    A single thread waits on the stdout pipes of all registered child processes
+    and on a wakeup socket using a selector, and appends output to the job's log as it arrives.
+    Progress lines feed the job's metrics. Either marks the job as changed (see job_table.Job.changed),
+    so its row and, if shown, its log are rendered with the next flush of the job table.
+    Nothing is polled: while jobs are idle, the monitor thread sleeps.
     """
-    update_output = pyqtSignal(JobPanel, str)   # the text output signals
-    update_stati = pyqtSignal(dict)             # proces stati
-    update_tabinfo = pyqtSignal(dict)           # process tab names
-    update_runnable_stoppable_count = pyqtSignal(int, int) # number of runnable and stoppable jobs
-
-    def __init__(self, tab_panel):
-        super(QObject, self).__init__()
-        self.tabs = tab_panel
+
+    # complete lines, terminated by either \n, \r\n or \r (progress updates)
+    LINE_PATTERN = re.compile(r'[^\r\n]*(?:\r\n|\r|\n)')
+
+    def __init__(self):
         self.monitor = None
         self.stopped = False
 
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.selector.register(self.wakeup_receiver, selectors.EVENT_READ, None)
+
+        self.lock = threading.Lock()
+        self.pending_processes = []     # (job, process) tuples to be registered by the monitor thread
+
     def monitor_outputs(self):
-        self.monitor = Thread(target=self._monitor_job_panels)
-        self.monitor.deamon = True
+        self.monitor = Thread(target=self._monitor_processes)
+        self.monitor.daemon = True
         self.monitor.setName('Process Output Monitor Thread')
         self.monitor.start()
 
     def stop(self):
         self.stopped = True
+        self._wakeup()
+
+    def watch_process(self, job, process):
+        """
+        Registers the stdout pipe of a child process of job for output collection.
+        May be called from any thread.
+        """
+        if process.stdout is None:
+            return
+        with self.lock:
+            self.pending_processes.append((job, process))
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self.wakeup_sender.send(b'\0')
+        except (BlockingIOError, OSError):
+            # the socket buffer is full of wakeup requests already
+            pass
+
+    def _register_pending_processes(self):
+        with self.lock:
+            pending_processes = self.pending_processes
+            self.pending_processes = []
+        for job, process in pending_processes:
+            stream = {'job': job,
+                      'process': process,
+                      'decoder': codecs.getincrementaldecoder('utf-8')(errors='replace'),
+                      'tail': ''}
+            try:
+                self.selector.register(process.stdout.fileno(), selectors.EVENT_READ, stream)
+            except (ValueError, OSError):
+                # pipe has been closed in the meantime
+                pass
 
-    def _monitor_job_panels(self):
+    def _read_process_output(self, key):
+        stream = key.data
+        try:
+            data = os.read(key.fd, 65536)
+        except OSError:
+            data = b''
+
+        if data:
+            text = stream['tail'] + stream['decoder'].decode(data)
+            lines = ProcessOutputMonitor.LINE_PATTERN.findall(text)
+            stream['tail'] = text[sum(len(line) for line in lines):]
+        else:
+            # end of file. flush the remainder and forget the process
+            self.selector.unregister(key.fd)
+            text = stream['tail'] + stream['decoder'].decode(b'', final=True)
+            lines = [text] if text else []
+
+        self._publish_lines(stream['job'], lines)
+
+    def post_output(self, job, line):
+        """
+        Publishes an output line not read from a child process, see yt2mp3_daemon.RemoteScheduler and yt2mp3_engine.
+        May be called from any thread.
+        """
+        self._publish_lines(job, [line])
+
+    def _publish_lines(self, job, lines):
+        if not lines:
+            return
+        pipeline_job = job.pipeline_job
+        if pipeline_job is not None:
+            # machine readable progress lines are consumed by the job's metrics and not displayed
+            lines = [line for line in lines if not pipeline_job.progress.feed(line)]
+
+        msg = self._coalesce_lines(lines)
+        if msg:
+            job.log.append(msg)
+        job.changed()
+
+    @staticmethod
+    def _coalesce_lines(lines):
+        """
+        Joins lines to a single message. As in a terminal, a line terminated by a carriage return
+        is overwritten by the next line, thus only the most recent of consecutive progress updates remains.
+        Only the last line of the message may end in a carriage return.
+        """
+        out = []
+        for line in lines:
+            if line.endswith('\r\n'):
+                line = line[:-2] + '\n'
+            if out and out[-1].endswith('\r'):
+                out[-1] = line
+            else:
+                out.append(line)
+        return ''.join(out)
+
+    def _monitor_processes(self):
 
         while not self.stopped:
-            job_status_summary = {JobPanel.STATUS_IDLE: 0,
-                                  JobPanel.STATUS_SUBMITTED: 0,
-                                  JobPanel.STATUS_RUNNING: 0,
-                                  JobPanel.STATUS_STOPPED: 0,
-                                  JobPanel.STATUS_FINISHED: 0,
-                                  JobPanel.STATUS_FAILED: 0
-                                  }
-            runnable_count = 0
-            stoppable_count = 0
-            tab_information = {}  # job status and tab name
-            for i in range(len(self.tabs)):
-                try:
-                    job_panel = self.tabs.widget(i)
-                    runnable_count += job_panel.is_runnable()
-                    stoppable_count += job_panel.is_stoppable()
-                    job_status_summary[job_panel.job_status] += 1
-                    tab_information[i] = (job_panel.job_status, os.path.basename(job_panel.output_location_input.text()))
-                    msg = job_panel.get_process_output(timeout=0.1)  # NOTE. NO TIMEOUT NEEDED. REDO STDOUT COLLECTION
-                    if msg:
-                        self.update_output.emit(job_panel, msg)
-                except Exception as e:
-                    print(e)
-            self.update_stati.emit(job_status_summary)
-            self.update_tabinfo.emit(tab_information)
-            self.update_runnable_stoppable_count.emit(runnable_count, stoppable_count)
-            time.sleep(1/50)  # update frequency of 50 hz
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    # wakeup request. drain the socket
+                    try:
+                        while self.wakeup_receiver.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self._read_process_output(key)
+
+            self._register_pending_processes()
@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yt2mp3_cache     # noqa: E402
+
+
+class CacheCheckoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source_file = os.path.join(self.tmp_dir.name, 'abc.m4a')
+        with open(self.source_file, 'wb') as f:
+            f.write(b'media')
+        self.target_dir = os.path.join(self.tmp_dir.name, 'target')
+        os.makedirs(self.target_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_media_checkout_hit(self):
+        cache = yt2mp3_cache.MediaCache(os.path.join(self.tmp_dir.name, 'media'), 1024 ** 2)
+        cache.put_media('abc', 'bestaudio', self.source_file)
+        self.assertTrue(cache.contains_media('abc', 'bestaudio'))
+        checked_out = cache.checkout_media('abc', 'bestaudio', self.target_dir)
+        self.assertEqual(checked_out, os.path.join(self.target_dir, 'abc.m4a'))
+        with open(checked_out, 'rb') as f:
+            self.assertEqual(f.read(), b'media')
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_encoded_checkout_hit(self):
+        cache = yt2mp3_cache.EncodedCache(os.path.join(self.tmp_dir.name, 'encoded'), 1024 ** 2)
+        cache.put_encoded('abc', 'bestaudio', ['-q:a', '0'], self.source_file)
+        checked_out = cache.checkout_encoded('abc', 'bestaudio', ['-q:a', '0'], self.target_dir)
+        self.assertEqual(checked_out, os.path.join(self.target_dir, 'abc.m4a'))
+        self.assertFalse(os.path.samefile(checked_out, self.source_file))
+
+    def test_checkout_miss(self):
+        cache = yt2mp3_cache.MediaCache(os.path.join(self.tmp_dir.name, 'media'), 1024 ** 2)
+        self.assertIsNone(cache.checkout_media('abc', 'bestaudio', self.target_dir))
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_put_marks_entry_used(self):
+        # e.g. youtube-dl dates downloads back to their upload
+        os.utime(self.source_file, (0, 0))
+        cache = yt2mp3_cache.MediaCache(os.path.join(self.tmp_dir.name, 'media'), 1024 ** 2)
+        cache.put_media('abc', 'bestaudio', self.source_file)
+        cache.prune(max_age_seconds=3600)
+        self.assertTrue(cache.contains_media('abc', 'bestaudio'))
+
+    def test_prune_removes_interrupted_puts(self):
+        cache = yt2mp3_cache.MediaCache(os.path.join(self.tmp_dir.name, 'media'), 1024 ** 2)
+        stale_entry_dir = os.path.join(cache.cache_dir, 'abc.1.2.tmp')
+        fresh_entry_dir = os.path.join(cache.cache_dir, 'def.1.2.tmp')
+        os.makedirs(stale_entry_dir)
+        os.makedirs(fresh_entry_dir)
+        os.utime(stale_entry_dir, (0, 0))
+        cache.prune()
+        self.assertFalse(os.path.isdir(stale_entry_dir))
+        self.assertTrue(os.path.isdir(fresh_entry_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,21 @@
 import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import yt2mp3_utils
+import yt2mp3_pipeline
+import yt2mp3_cache
+import yt2mp3_progress
+import yt2mp3_daemon
+import yt2mp3_jobstore
+import yt2mp3_sync
+import yt2mp3_bandwidth
+import yt2mp3_concurrency
+import yt2mp3_tools
+import yt2mp3_engine
+import yt2mp3_silence
+import yt2mp3_postprocess
 
 
 def download_convert_split(args_namespace, process_watcher=None):
@@ -21,40 +37,260 @@ def download_convert_split(args_namespace, process_watcher=None):
     Returns:
     --------
 
-    argparse.Namespace object as a configuration container.
+    the output destination, i.e. the path to the written mp3 file or segment folder
     """
 
-    # prepare some variables
-    # NOTE: PREPARE PATH VARIABLES IN EXTRA FUNCTION. MUST EXIST/BE RETURNED BEFORE subprocess.Popen calls!
-    download_dir = None
-    archive_file = None
-    video_file   = None
-    mp3_file     = None
-    tmp_mp3_file = None
+    # prepare the job state container holding all paths created along the way.
+    # NOTE: PATH VARIABLES MUST EXIST BEFORE subprocess.Popen calls, FOR THE CLEANUP TO WORK!
+    # NOTE: ONLY USES THE FIRST PASSED VIDEO ID OR URL. SEE batch_download_convert_split FOR MULTIPLE VIDEOS.
+    job_state = yt2mp3_pipeline.new_job_state(args_namespace)
+    succeeded = False
 
     try:
-        # NOTE: ONLY USES THE FIRST PASSED VIDEO ID OR URL. IGNORES THE REST, FOR NOW.
-        download_dir, archive_file = yt2mp3_utils.download_video(args_namespace.video[0], process_watcher)
-        mp3_file, video_file, tmp_mp3_file = yt2mp3_utils.video_to_mp3(download_dir, archive_file, process_watcher)
-        output_destination = yt2mp3_utils.determine_prepare_output(mp3_file, args_namespace.output, args_namespace.segment_length)
-
-        if args_namespace.segment_length is None:
-            # no segments but single file: move output
-            yt2mp3_utils.move_download_to_output(mp3_file, output_destination)
-        else:
-            # split mp3 into segments
-            yt2mp3_utils.split_download_into_segments(mp3_file, output_destination,
-                                                      args_namespace.segment_length,
-                                                      args_namespace.segment_name,
-                                                      process_watcher)
-        print('[yt2mp3] SUCCESS! OUTPUTS CAN BE FOUND AT {}'.format(output_destination))
+        yt2mp3_pipeline.download_stage(job_state, process_watcher)
+        yt2mp3_pipeline.transcode_stage(job_state, process_watcher)
+        succeeded = True
+        print('[yt2mp3] SUCCESS! OUTPUTS CAN BE FOUND AT {}'.format(job_state.output_destination))
     except Exception as e:
         print('[yt2mp3] Bollocks! Process did not finish!')
         raise e
 
     finally:
-        # clean up
-        yt2mp3_utils.cleanup(download_dir, archive_file, video_file, tmp_mp3_file)
+        # clean up. failed downloads are continued by the next attempt
+        yt2mp3_pipeline.cleanup_stage(job_state, keep_download=not succeeded)
+
+    return job_state.output_destination
+
+
+def collect_videos(args_namespace):
+    """
+    Collects all video IDs or URLs to process from the positional arguments and,
+    if given, from the input file (or stdin, if the input file is "-").
+    Empty lines and lines starting with "#" are ignored. Duplicates are dropped, keeping the order.
+
+    Parameters:
+    -----------
+
+    args_namespace: argparse.Namespace - the parsed command line arguments
+
+    Returns:
+    --------
+
+    list of video IDs or URLs
+    """
+    candidates = list(args_namespace.video)
+    if args_namespace.input_file == '-':
+        candidates += sys.stdin.read().splitlines()
+    elif args_namespace.input_file is not None:
+        with open(args_namespace.input_file, 'rt') as f:
+            candidates += f.read().splitlines()
+
+    videos = []
+    seen = set()
+    for candidate in candidates:
+        candidate = candidate.strip()
+        if not candidate or candidate.startswith('#'):
+            continue
+        vid = yt2mp3_utils.video_id(candidate)
+        if vid not in seen:
+            seen.add(vid)
+            videos.append(candidate)
+    return videos
+
+
+def namespace_for_video(args_namespace, video, n_videos, parent_output=False):
+    """
+    Creates a copy of args_namespace describing the conversion of a single video of a batch.
+    If more than one video is processed (or parent_output is set) and an output location is given, that location is
+    treated as a parent folder holding one output (file or segment folder) per video ID.
+
+    Parameters:
+    -----------
+
+    args_namespace: argparse.Namespace - the parsed command line arguments for the whole batch
+
+    video: str - the video ID or URL to process
+
+    n_videos: int - the number of videos in the batch
+
+    parent_output: bool - (optional) treat the output location as parent folder, whatever the number of videos
+
+    Returns:
+    --------
+
+    argparse.Namespace for a single video conversion call
+    """
+    video_namespace = argparse.Namespace(**vars(args_namespace))
+    video_namespace.video = [video]
+    if (n_videos > 1 or parent_output) and args_namespace.output is not None:
+        video_namespace.output = os.path.join(args_namespace.output, yt2mp3_utils.video_id(video))
+    return video_namespace
+
+
+def batch_download_convert_split(args_namespace, videos, scheduler=None, done_callback=None, parent_output=False):
+    """
+    Runs the conversion of all given videos on a yt2mp3_pipeline.PipelineScheduler,
+    with separate worker pools for downloading and transcoding.
+    With --resume, the unfinished jobs recorded in the job database are continued as well.
+    A failing video does not stop the others. Prints one summary line per video,
+    periodic progress reports and a final throughput report.
+    The output of youtube-dl and ffmpeg is not shown, except for the last lines of failed jobs.
+
+    Parameters:
+    -----------
+
+    args_namespace: argparse.Namespace - the parsed command line arguments for the whole batch
+
+    videos: list - the video IDs or URLs to process
+
+    scheduler: object - (optional) the scheduler to submit the jobs to, e.g. a yt2mp3_daemon.RemoteScheduler.
+        By default, a yt2mp3_pipeline.PipelineScheduler is created for the batch.
+
+    done_callback: callable - (optional) called as done_callback(video, output_destination) for each successful video
+
+    parent_output: bool - (optional) always treat the output location as a parent folder, see namespace_for_video
+
+    Returns:
+    --------
+
+    the number of failed videos
+    """
+
+    if args_namespace.output is not None and (len(videos) > 1 or parent_output):
+        yt2mp3_utils.ensure_dir_exists(args_namespace.output)
+
+    job_store = None
+    resumed = []
+    controller = None
+    if scheduler is None:
+        # a daemon records and resumes jobs in its own job database, and controls its own concurrency
+        job_store = yt2mp3_jobstore.job_store_from_args(args_namespace)
+        resumed = yt2mp3_jobstore.resumable_jobs_from_args(args_namespace)
+        scheduler = yt2mp3_pipeline.scheduler_from_args(args_namespace, job_store)
+        controller = yt2mp3_concurrency.controller_from_args(scheduler, args_namespace)
+    resumed_videos = set(record.video for record in resumed)
+    submissions = [(record.video, record.args, record) for record in resumed]
+    submissions += [(video, namespace_for_video(args_namespace, video, len(videos), parent_output), None)
+                    for video in videos if video not in resumed_videos]
+    print('[yt2mp3] Processing {} videos ({} resumed) with {} download and {} transcode workers'.format(
+        len(submissions), len(resumed), scheduler.n_download_workers, scheduler.n_transcode_workers))
+    t_batch_start = time.time()
+    jobs = {}
+    for video, video_args_namespace, resume_from in submissions:
+        progress = yt2mp3_progress.JobProgress()
+        job = scheduler.submit(video_args_namespace, yt2mp3_progress.ProgressWatcher(progress), progress=progress,
+                               resume_from=resume_from)
+        jobs[job.future] = (video, job)
+    scheduler.shutdown(wait=False)
+
+    n_failed = 0
+    job_durations = []
+    pending = set(jobs)
+    while pending:
+        done, pending = wait(pending, timeout=args_namespace.progress_interval, return_when=FIRST_COMPLETED)
+        for future in done:
+            video, job = jobs[future]
+            # failed remote jobs and cancelled jobs never reach the done stage
+            duration = (job.timestamps.get(yt2mp3_pipeline.PipelineJob.STAGE_DONE, time.time())
+                        - job.timestamps.get(yt2mp3_pipeline.PipelineJob.STAGE_QUEUED, t_batch_start))
+            job_durations.append(duration)
+            try:
+                print('[yt2mp3] [DONE]   {} after {:.1f}s -> {}'.format(video, duration, future.result()))
+                if done_callback:
+                    done_callback(video, future.result())
+            except Exception as e:
+                n_failed += 1
+                print('[yt2mp3] [FAILED] {} after {:.1f}s: {}'.format(video, duration, e))
+                for line in job.progress.last_lines:
+                    print('[yt2mp3]          | {}'.format(line))
+        if not done:
+            print_batch_progress([job for _, job in jobs.values() if not job.future.done()], scheduler, job_durations)
+
+    if job_store is not None:
+        job_store.flush()
+    if controller is not None:
+        controller.stop()
+    t_batch = time.time() - t_batch_start
+    print('[yt2mp3] Batch finished: {} succeeded, {} failed, {:.1f}s wall time, {:.2f} videos/min'.format(
+        len(jobs) - n_failed, n_failed, t_batch, 60 * len(jobs) / max(t_batch, 1e-9)))
+    for name, cache in yt2mp3_cache.caches_from_args(args_namespace).items():
+        print('[yt2mp3] {} cache: {}'.format(name, cache.stats()))
+    return n_failed
+
+
+def sync_playlists(args_namespace, scheduler=None):
+    """
+    Mirrors the playlists or channels given by --sync into the output folder.
+    Only videos not yet listed in the folder's archive (see yt2mp3_sync.SyncArchive) are converted, as one batch.
+    Failed videos are not archived and thus retried by the next sync.
+
+    Parameters:
+    -----------
+
+    args_namespace: argparse.Namespace - the parsed command line arguments
+
+    scheduler: object - (optional) the scheduler to submit the jobs to, see batch_download_convert_split
+
+    Returns:
+    --------
+
+    the number of failed videos
+    """
+    assert args_namespace.output is not None, 'Syncing requires an output folder (-o)'
+    yt2mp3_utils.ensure_dir_exists(args_namespace.output)
+    archive = yt2mp3_sync.SyncArchive(args_namespace.output)
+
+    with ThreadPoolExecutor(max_workers=max(1, args_namespace.download_jobs)) as executor:
+        engine = yt2mp3_engine.engine_from_args(args_namespace)
+        playlists = list(executor.map(lambda playlist_url: yt2mp3_utils.list_playlist(playlist_url, engine), args_namespace.sync))
+    titles = {}
+    for playlist_url, entries in zip(args_namespace.sync, playlists):
+        print('[yt2mp3] {} videos listed in "{}"'.format(len(entries), playlist_url))
+        for entry in entries:
+            titles.setdefault(entry['id'], entry['title'])
+
+    new_videos = [vid for vid in titles if vid not in archive]
+    print('[yt2mp3] {} videos mirrored already, {} new'.format(len(titles) - len(new_videos), len(new_videos)))
+    if not new_videos:
+        return 0
+    return batch_download_convert_split(args_namespace, new_videos, scheduler,
+                                        done_callback=lambda vid, output_destination: archive.add(vid, titles[vid], output_destination),
+                                        parent_output=True)
+
+
+def print_batch_progress(unfinished_jobs, scheduler, job_durations):
+    """
+    Prints the progress of all running jobs of a batch, their total throughput and an estimate of the remaining time.
+
+    Parameters:
+    -----------
+
+    unfinished_jobs: list - the yt2mp3_pipeline.PipelineJob objects not done yet
+
+    scheduler: yt2mp3_pipeline.PipelineScheduler - the scheduler running the jobs
+
+    job_durations: list - the run times of all finished jobs in seconds
+    """
+    running = [job for job in unfinished_jobs if job.stage != yt2mp3_pipeline.PipelineJob.STAGE_QUEUED]
+    snapshots = [job.progress.snapshot() for job in running]
+    aggregate = yt2mp3_progress.aggregate_progress(snapshots,
+                                                   n_queued=len(unfinished_jobs) - len(running),
+                                                   n_workers=scheduler.n_transcode_workers,
+                                                   mean_job_seconds=sum(job_durations) / len(job_durations) if job_durations else None)
+    print('[yt2mp3] [PROGRESS] {} running, {} queued, {:.2f}MiB/s, ETA {}'.format(
+        len(running), len(unfinished_jobs) - len(running), aggregate['bytes_per_second'] / 1024**2,
+        '?' if aggregate['queue_eta_seconds'] is None else '{:.0f}s'.format(aggregate['queue_eta_seconds'])))
+    queued_metadata = [job.state.metadata for job in unfinished_jobs
+                       if job.stage == yt2mp3_pipeline.PipelineJob.STAGE_QUEUED and job.state.metadata is not None]
+    if queued_metadata:
+        # prefetched, see yt2mp3_metadata
+        print('[yt2mp3]            queued (of {} resolved): {:.1f}MiB to download, {:.1f}min of media'.format(
+            len(queued_metadata), sum(metadata['filesize'] or 0 for metadata in queued_metadata) / 1024**2,
+            sum(metadata['duration'] or 0 for metadata in queued_metadata) / 60))
+    for job, snapshot in zip(running, snapshots):
+        name = job.state.args.video[0] if job.state.metadata is None else '{} ({})'.format(job.state.args.video[0],
+                                                                                           job.state.metadata['title'])
+        print('[yt2mp3]            {}: {}'.format(name, yt2mp3_progress.format_progress(snapshot)))
 
 
 def parse_command_line_args(argument_list=None):
@@ -73,7 +309,6 @@ def parse_command_line_args(argument_list=None):
     # TODO: add keep-video option
     # TODO: add keep archive-file option
     # TODO: infer default output outside of .tmp folder
-    # TODO: extend cleanup routine to catch orphaned .tmp folders in failure cases
     argument_parser = argparse.ArgumentParser(description='Convert videos from Youtube to mp3 files!')
     argument_parser.add_argument('video', type=str, nargs='*',
                                  help='The URL or ID of the video to download and convert')
@@ -81,31 +316,183 @@ def parse_command_line_args(argument_list=None):
                                  help='If given, the downloaded mp3 file will be divided into segments of this length (in seconds)')
     argument_parser.add_argument('-sn', '--segment_name', type=str, default='%03d.mp3',
                                  help='the naming pattern of the output mp3 file segments')
+    argument_parser.add_argument('-f', '--output_format', type=str, default=yt2mp3_utils.DEFAULT_OUTPUT_FORMAT,
+                                 choices=sorted(yt2mp3_utils.OUTPUT_FORMATS),
+                                 help='The output audio format. Sources already in a fitting codec are copied without re-encoding')
+    argument_parser.add_argument('-sp', '--single_pass', action='store_true',
+                                 help='Convert and split into segments in a single ffmpeg run, without writing the full length mp3 file')
+    argument_parser.add_argument('-sa', '--silence_aware', action='store_true',
+                                 help='End each segment in the quietest passage near the segment length instead of at exactly '
+                                      'the segment length, e.g. to not cut audiobooks mid-word. Requires numpy')
+    argument_parser.add_argument('-sw', '--silence_window', type=float, default=None, metavar='SECONDS',
+                                 help='The time before and after each segment boundary searched for a quiet passage. '
+                                      'Defaults to a tenth of the segment length, at most 30 seconds')
+    argument_parser.add_argument('-ln', '--loudnorm', action='store_true',
+                                 help='Normalize the loudness as part of the encode. The loudness is measured once per source '
+                                      'and cached in CACHE_DIR, if given')
+    argument_parser.add_argument('--loudness_target', type=float, default=yt2mp3_postprocess.DEFAULT_LOUDNESS, metavar='LUFS',
+                                 help='The integrated loudness in LUFS to normalize to. Defaults to {:g}'.format(
+                                     yt2mp3_postprocess.DEFAULT_LOUDNESS))
+    argument_parser.add_argument('-tm', '--tempo', type=float, default=None, metavar='FACTOR',
+                                 help='Change the playback speed by this factor without changing the pitch, e.g. 1.25')
+    argument_parser.add_argument('-ts', '--trim_silence', action='store_true',
+                                 help='Trim leading and trailing silence as part of the encode')
+    argument_parser.add_argument('-st', '--stream', action='store_true',
+                                 help='Pipe the download directly into ffmpeg without an intermediate media file, '
+                                      'where the format allows it')
+    argument_parser.add_argument('-pm', '--prefetch_metadata', action='store_true',
+                                 help='Resolve title, duration, formats and size of queued videos in batches ahead of their '
+                                      'download, for progress estimates and disk space checks. Cached in CACHE_DIR, if given')
+    argument_parser.add_argument('-e', '--engine', type=str, default='cli', choices=['cli', 'api'],
+                                 help='How videos are downloaded: "cli" starts a youtube-dl process per video, "api" uses the '
+                                      'youtube_dl Python package in-process, reusing its extractors and cookies across videos')
+    argument_parser.add_argument('-cw', '--chunk_workers', type=int, default=1,
+                                 help='Encode long sources in this many time ranges in parallel ffmpeg processes. '
+                                      'When segmenting, each segment is encoded by its own process')
+    argument_parser.add_argument('-mcl', '--min_chunk_length', type=float, default=300,
+                                 help='The minimum length of a time range encoded in parallel, in seconds')
     argument_parser.add_argument('-o', '--output', type=str, default=None,
                                  help='The destination file or folder the output shall be written to.')
+    argument_parser.add_argument('-cd', '--cache_dir', type=str, default=None,
+                                 help='If given, downloaded media is cached in this folder and reused by later jobs for the same video')
+    argument_parser.add_argument('-mcs', '--media_cache_size', type=float, default=2048,
+                                 help='The maximum size of the downloaded media cache in MB. Least recently used media is evicted first')
+    argument_parser.add_argument('-ecs', '--encoded_cache_size', type=float, default=4096,
+                                 help='The maximum size of the encoded mp3 cache in MB. Least recently used files are evicted first')
+    argument_parser.add_argument('--cache_stats', action='store_true',
+                                 help='Print the statistics of the caches in CACHE_DIR and exit')
+    argument_parser.add_argument('--cache_prune', type=float, default=None, metavar='MAX_AGE_DAYS',
+                                 help='Evict cache entries unused for MAX_AGE_DAYS, shrink the caches in CACHE_DIR to their maximum '
+                                      'size and exit')
+    argument_parser.add_argument('--tool_info', action='store_true',
+                                 help='Print the paths, versions and number of encoders, muxers and filters of the discovered tools '
+                                      'and exit')
     argument_parser.add_argument('-n', '--nogui', action='store_true',
-                                 help='Setting this option runs yt2mp3 for a single video without showing a GUI')
+                                 help='Setting this option runs yt2mp3 without showing a GUI')
+    argument_parser.add_argument('-ld', '--log_dir', type=str, default=None,
+                                 help='(GUI) If given, the complete output of each job is appended to a log file per video in this folder')
+    argument_parser.add_argument('--log_lines', type=int, default=1000,
+                                 help='(GUI) The number of output lines of each job kept in memory and shown')
+    argument_parser.add_argument('-i', '--input_file', type=str, default=None,
+                                 help='A file listing further video URLs or IDs, one per line. Pass "-" to read from stdin.')
+    argument_parser.add_argument('-j', '--jobs', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                                 help='The number of concurrent transcode (ffmpeg) workers')
+    argument_parser.add_argument('-pi', '--progress_interval', type=float, default=10,
+                                 help='The interval in seconds between progress reports in batch mode')
+    argument_parser.add_argument('-dj', '--download_jobs', type=int, default=4,
+                                 help='The number of concurrent download (youtube-dl) workers')
+    argument_parser.add_argument('-qs', '--queue_size', type=int, default=None,
+                                 help='The number of finished downloads allowed to wait for a transcode worker. Defaults to JOBS')
+    argument_parser.add_argument('-ac', '--adaptive_concurrency', action='store_true',
+                                 help='Adjust the number of concurrent downloads and conversions at runtime to the measured '
+                                      'CPU utilization, I/O wait and network throughput, starting at DOWNLOAD_JOBS and JOBS')
+    argument_parser.add_argument('--min_jobs', type=int, default=1,
+                                 help='The minimum number of concurrent conversions with adaptive concurrency')
+    argument_parser.add_argument('--max_jobs', type=int, default=2 * (os.cpu_count() or 1),
+                                 help='The maximum number of concurrent conversions with adaptive concurrency')
+    argument_parser.add_argument('--min_download_jobs', type=int, default=1,
+                                 help='The minimum number of concurrent downloads with adaptive concurrency')
+    argument_parser.add_argument('--max_download_jobs', type=int, default=16,
+                                 help='The maximum number of concurrent downloads with adaptive concurrency')
+    argument_parser.add_argument('-rl', '--rate_limit', type=str, default=None, metavar='RATE',
+                                 help='The maximum total download rate of all concurrent downloads in bytes per second, '
+                                      'e.g. 500K or 2.5M. Shared fairly between the active downloads')
+    argument_parser.add_argument('-jrl', '--job_rate_limit', type=str, default=None, metavar='RATE',
+                                 help='The maximum download rate of each single download in bytes per second')
+    argument_parser.add_argument('-sy', '--sync', type=str, action='append', default=None, metavar='PLAYLIST_URL',
+                                 help='Mirror the videos of this playlist or channel into the OUTPUT folder, converting only '
+                                      'those not converted by previous syncs. Can be given multiple times. Implies --nogui')
+    argument_parser.add_argument('--sweep_age', type=float, default=7, metavar='MAX_AGE_DAYS',
+                                 help='At startup, remove the temporary files of failed jobs untouched for MAX_AGE_DAYS. '
+                                      'Younger ones are reused by the next job for the same video')
+    argument_parser.add_argument('-db', '--job_db', type=str, default=None,
+                                 help='If given, all jobs and their completed stages are recorded in this SQLite database')
+    argument_parser.add_argument('--resume', action='store_true',
+                                 help='Continue the unfinished jobs recorded in JOB_DB after their last completed stage')
+    argument_parser.add_argument('-ef', '--events_file', type=str, default=None,
+                                 help='If given, the stage changes of all jobs and a summary of each finished job, with the timings '
+                                      'and output sizes of its steps, its queue wait times and the exit codes of its child processes, '
+                                      'are appended to this JSON-lines file')
+    argument_parser.add_argument('-pf', '--prometheus_file', type=str, default=None,
+                                 help='If given, running totals of the job metrics are written to this file for the '
+                                      'node_exporter textfile collector, e.g. /var/lib/node_exporter/textfile/yt2mp3.prom')
+    argument_parser.add_argument('--daemon', action='store_true',
+                                 help='Run as a headless daemon accepting jobs at DAEMON_ADDRESS, with JOBS and DOWNLOAD_JOBS workers')
+    argument_parser.add_argument('-ud', '--use_daemon', action='store_true',
+                                 help='Submit all jobs to the daemon running at DAEMON_ADDRESS instead of processing them in this process')
+    argument_parser.add_argument('-da', '--daemon_address', type=str, default=None,
+                                 help='The unix socket path or "tcp:HOST:PORT" address of the daemon. '
+                                      'Defaults to ~/.cache/yt2mp3/daemon.sock')
 
     if argument_list is None:
-        return argument_parser.parse_args()
+        args_namespace = argument_parser.parse_args()
     else:
-        return argument_parser.parse_args(argument_list)
+        args_namespace = argument_parser.parse_args(argument_list)
+    for rate in [args_namespace.rate_limit, args_namespace.job_rate_limit]:
+        try:
+            yt2mp3_bandwidth.parse_rate(rate)
+        except ValueError as e:
+            argument_parser.error(str(e))
+    if args_namespace.log_lines < 1:
+        argument_parser.error('--log_lines must be positive')
+    if args_namespace.tempo is not None and args_namespace.tempo <= 0:
+        argument_parser.error('--tempo must be positive')
+    if args_namespace.engine == 'api' and not yt2mp3_engine.is_available():
+        argument_parser.error('--engine api requires the youtube_dl Python package (pip install youtube_dl)')
+    if args_namespace.silence_aware and args_namespace.segment_length is None:
+        argument_parser.error('--silence_aware requires --segment_length')
+    if args_namespace.silence_aware and not yt2mp3_silence.is_available():
+        argument_parser.error('--silence_aware requires the numpy Python package (pip install numpy)')
+    if args_namespace.daemon_address is None:
+        args_namespace.daemon_address = yt2mp3_daemon.default_address()
+    return args_namespace
 
 
 if __name__ == '__main__':
     # read command line args
     args = parse_command_line_args()
 
-    if args.nogui:
-        # check for ffmpeg and youtube-dl
-        yt2mp3_utils.check_requirements()
+    if args.cache_stats or args.cache_prune is not None:
+        caches = yt2mp3_cache.caches_from_args(args)
+        if not caches:
+            print('[yt2mp3] No cache directory given. terminating.')
+        for name, cache in caches.items():
+            if args.cache_prune is not None:
+                cache.prune(max_age_seconds=args.cache_prune * 24 * 3600)
+            print('[yt2mp3] {} cache at "{}": {}'.format(name, cache.cache_dir, cache.stats()))
+        exit()
 
-        if not args.video:
+    if args.tool_info:
+        print(yt2mp3_tools.tool_report())
+        exit()
+
+    if args.daemon:
+        yt2mp3_daemon.run_daemon(args)
+
+    elif args.nogui or args.sync:
+        if not args.use_daemon:
+            # check for ffmpeg and youtube-dl. the daemon does this once at its start.
+            yt2mp3_utils.check_requirements(args.output_format,
+                                            yt2mp3_postprocess.required_filters(yt2mp3_postprocess.settings_from_args(args)))
+            yt2mp3_utils.sweep_download_dirs(args.sweep_age * 24 * 3600)
+
+        scheduler = yt2mp3_daemon.RemoteScheduler(args.daemon_address) if args.use_daemon else None
+        if args.sync:
+            exit(1 if sync_playlists(args, scheduler) else 0)
+
+        videos = collect_videos(args)
+        if not videos and not args.resume:
             # NOTE: terminate command line mode if no video has been given.
             print('[yt2mp3] No video URL or ID argument passed. terminating.')
             exit()  # redundant exit call
         # core idea also for GUI use later: use Namespace object to bundle arguments.
-        download_convert_split(args)
+        if args.use_daemon:
+            exit(1 if batch_download_convert_split(args, videos, scheduler) else 0)
+        elif len(videos) == 1 and not (args.job_db or args.events_file or args.prometheus_file):
+            args.video = videos
+            download_convert_split(args)
+        else:
+            exit(1 if batch_download_convert_split(args, videos) else 0)
 
     else:
         import qt5_gui as gui
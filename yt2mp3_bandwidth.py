@@ -0,0 +1,166 @@
+# a download bandwidth budget, shared fairly between the concurrent downloads of a process
+
+import re
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+
+RATE_PATTERN = re.compile(r'^(?P<value>[\d.]+)\s*(?P<unit>[kKmMgG]?)$')
+RATE_FACTORS = {'': 1, 'k': 1024, 'm': 1024**2, 'g': 1024**3}
+
+
+def parse_rate(rate_string):
+    """
+    Parses a rate in bytes per second in the notation of youtube-dl's --limit-rate, e.g. "50K" or "4.2M".
+
+    Returns:
+    --------
+    the rate in bytes per second, or None for an empty rate_string
+    """
+    if not rate_string:
+        return None
+    match = RATE_PATTERN.match(rate_string.strip())
+    if not match:
+        raise ValueError('Invalid rate "{}". Expected e.g. 500K or 2.5M'.format(rate_string))
+    return float(match.group('value')) * RATE_FACTORS[match.group('unit').lower()]
+
+
+class BandwidthBudget(object):
+    """
+    Shares a global download rate equally between all active downloads, each optionally capped by its own per-job rate.
+    Rates left unused by capped downloads are shared among the others.
+
+    youtube-dl only takes a fixed --limit-rate at its start. When the fair share of a running download
+    shrinks because other downloads start, the download is restarted with its new rate right away, so the global rate holds.
+    Grown shares are only taken up once they differ substantially, at most every min_rebalance_interval seconds.
+    Restarted downloads continue from their partial file, see yt2mp3_utils.download_video.
+    """
+
+    def __init__(self, global_rate=None, rebalance_factor=1.5, min_rebalance_interval=30, check_interval=2):
+        """
+        Parameters:
+        -----------
+
+        global_rate: float - (optional) the total download rate in bytes per second. unlimited by default
+
+        rebalance_factor: float - (optional) restart a download if its fair share exceeds its current rate by this factor
+
+        min_rebalance_interval: float - (optional) the minimum time in seconds before a download is restarted at a higher rate
+
+        check_interval: float - (optional) the time in seconds between two checks of the fair share of a download
+        """
+        self.global_rate = global_rate
+        self.rebalance_factor = rebalance_factor
+        self.min_rebalance_interval = min_rebalance_interval
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.job_rates = {}     # token -> per-job cap or None
+        self.token_counter = 0
+
+    def join(self, job_rate=None):
+        """
+        Registers a starting download, capped at job_rate bytes per second (if given).
+
+        Returns:
+        --------
+        the download's token, to be passed to share and leave
+        """
+        with self.lock:
+            self.token_counter += 1
+            self.job_rates[self.token_counter] = job_rate
+            return self.token_counter
+
+    def leave(self, token):
+        with self.lock:
+            self.job_rates.pop(token, None)
+
+    def share(self, token):
+        """
+        Returns the current fair share of the download in bytes per second, or None if unlimited
+        """
+        with self.lock:
+            job_rate = self.job_rates[token]
+            if self.global_rate is None:
+                return job_rate
+            # water filling: capped downloads below the equal share keep their cap, the others split the remainder
+            remaining_rate = self.global_rate
+            uncapped = sorted(self.job_rates.values(), key=lambda rate: float('inf') if rate is None else rate)
+            while uncapped:
+                equal_share = remaining_rate / len(uncapped)
+                if uncapped[0] is None or uncapped[0] >= equal_share:
+                    break
+                remaining_rate -= uncapped.pop(0)
+            level = remaining_rate / len(uncapped) if uncapped else float('inf')
+            return level if job_rate is None else min(job_rate, level)
+
+    def wait(self, process, token, rate):
+        """
+        Waits for a download process started with the given rate limit.
+
+        Returns:
+        --------
+        True, if the process has been terminated to be restarted at its new fair share. False, if it has finished
+        """
+        started = time.time()
+        while True:
+            try:
+                process.wait(timeout=self.check_interval)
+                return False
+            except subprocess.TimeoutExpired:
+                pass
+            new_rate = self.share(token)
+            if new_rate is not None and (rate is None or new_rate < rate):
+                # the global rate only holds if shrunk shares are applied right away
+                changed = True
+            elif time.time() - started < self.min_rebalance_interval:
+                changed = False
+            elif rate is None or new_rate is None:
+                changed = rate != new_rate
+            else:
+                changed = new_rate / max(rate, 1) >= self.rebalance_factor
+            if changed:
+                # youtube-dl keeps its partial download for the restart
+                process.terminate()
+                process.wait()
+                return True
+
+
+# one budget per global rate and process, shared by all jobs
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+def budget_from_args(args_namespace):
+    """
+    Returns the process wide BandwidthBudget for the global rate limit given in args_namespace,
+    or None if neither a global nor a per-job rate limit is set.
+    """
+    global_rate = parse_rate(getattr(args_namespace, 'rate_limit', None))
+    if global_rate is None and not getattr(args_namespace, 'job_rate_limit', None):
+        return None
+    with _budgets_lock:
+        budget = _budgets.get(global_rate)
+        if budget is None:
+            budget = BandwidthBudget(global_rate)
+            _budgets[global_rate] = budget
+        return budget
+
+
+@contextmanager
+def fixed_share_from_args(args_namespace):
+    """
+    Registers a download which can not be restarted at a new rate, e.g. one piped straight into ffmpeg,
+    with the process wide BandwidthBudget for the enclosed block. Yields its fair share (or None if unlimited)
+    at the start, which it keeps to the end, while counting towards the shares of the other downloads.
+    """
+    budget = budget_from_args(args_namespace)
+    if budget is None:
+        yield None
+        return
+    token = budget.join(parse_rate(getattr(args_namespace, 'job_rate_limit', None)))
+    try:
+        yield budget.share(token)
+    finally:
+        budget.leave(token)
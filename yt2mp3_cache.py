@@ -0,0 +1,395 @@
+# persistent, size bounded caches shared by all jobs (and processes)
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import yt2mp3_utils
+
+try:
+    import fcntl
+except ImportError:
+    # no inter-process locking on systems without fcntl. threads of one process are still synchronized.
+    fcntl = None
+
+
+class FileCache(object):
+    """
+    A directory of cached files with least-recently-used eviction once a maximum total size is exceeded.
+    Entries are addressed by a key tuple, which is hashed into an entry directory name.
+    Each entry directory holds exactly one file, keeping its original base name.
+    Access from multiple threads and processes is serialized by a lock file in the cache directory.
+    """
+
+    # add and check out files as hard links instead of copies.
+    # only safe if neither the cached files nor the files they are linked to are ever modified in place.
+    HARD_LINKS = True
+    # the time in seconds after which an entry directory still being added is considered left behind by an interrupted put
+    STALE_TMP_ENTRY_AGE = 24 * 3600
+
+    def __init__(self, cache_dir, max_size_bytes):
+        """
+        Parameters:
+        -----------
+
+        cache_dir: str - the directory holding the cache. created if necessary.
+
+        max_size_bytes: int - the total size of all entries after which the least recently used entries are evicted.
+        """
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.thread_lock = threading.RLock()
+        self.lock_file_name = os.path.join(cache_dir, '.lock')
+        self.stats_file_name = os.path.join(cache_dir, '.stats.json')
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    ####################
+    # locking and stats
+    ####################
+
+    class _Lock(object):
+        def __init__(self, cache):
+            self.cache = cache
+            self.lock_file = None
+
+        def __enter__(self):
+            self.cache.thread_lock.acquire()
+            if fcntl is not None:
+                self.lock_file = open(self.cache.lock_file_name, 'a')
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            return self
+
+        def __exit__(self, *exc_info):
+            if self.lock_file is not None:
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+                self.lock_file.close()
+            self.cache.thread_lock.release()
+
+    def locked(self):
+        """
+        Returns a context manager holding the cache's thread and process lock
+        """
+        return FileCache._Lock(self)
+
+    def _read_stats(self):
+        try:
+            with open(self.stats_file_name, 'rt') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _count(self, stat):
+        # NOTE: caller holds the lock
+        stats = self._read_stats()
+        stats[stat] = stats.get(stat, 0) + 1
+        tmp_stats_file_name = '{}.{}.tmp'.format(self.stats_file_name, os.getpid())
+        with open(tmp_stats_file_name, 'wt') as f:
+            json.dump(stats, f)
+        os.replace(tmp_stats_file_name, self.stats_file_name)
+
+    def stats(self):
+        """
+        Returns a dict with the persisted hit, miss and eviction counts
+        as well as the current number of entries and their total size in bytes.
+        """
+        with self.locked():
+            stats = self._read_stats()
+            entries = self.entries()
+        stats['entries'] = len(entries)
+        stats['size_bytes'] = sum(size for _, _, size in entries)
+        stats['max_size_bytes'] = self.max_size_bytes
+        return stats
+
+    ##########
+    # entries
+    ##########
+
+    def entry_dir(self, key):
+        """
+        Returns the directory of the entry addressed by key, a tuple of strings.
+        """
+        digest = hashlib.sha1('\n'.join(key).encode('utf-8')).hexdigest()[:20]
+        return os.path.join(self.cache_dir, digest)
+
+    def _entry_file(self, entry_dir):
+        if os.path.isdir(entry_dir):
+            for file_name in os.listdir(entry_dir):
+                if not file_name.startswith('.'):
+                    return os.path.join(entry_dir, file_name)
+        return None
+
+    def entries(self):
+        """
+        Returns a list of (last_access_time, path_to_file, size_in_bytes) tuples for all entries, least recently used first
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.tmp'):
+                # entries currently being added
+                continue
+            entry_file = self._entry_file(os.path.join(self.cache_dir, name))
+            if entry_file is not None:
+                stat = os.stat(entry_file)
+                entries.append((stat.st_mtime, entry_file, stat.st_size))
+        return sorted(entries)
+
+    def get(self, key):
+        """
+        Looks up the entry addressed by key and marks it as recently used.
+
+        Parameters:
+        -----------
+
+        key: tuple of str - the cache key
+
+        Returns:
+        --------
+
+        path to the cached file, or None if the key is not cached
+        """
+        with self.locked():
+            return self._get(key)
+
+    def _get(self, key):
+        # NOTE: caller holds the lock. the process lock is not reentrant: flock locks belong to each opened lock file
+        entry_file = self._entry_file(self.entry_dir(key))
+        if entry_file is None:
+            self._count('misses')
+            return None
+        # the file modification time serves as access time, since atime is unreliable on many mounts
+        os.utime(entry_file)
+        self._count('hits')
+        return entry_file
+
+    def checkout(self, key, target_dir):
+        """
+        Looks up the entry addressed by key and places it in target_dir, keeping its base name.
+
+        Parameters:
+        -----------
+
+        key: tuple of str - the cache key
+
+        target_dir: str - the directory to place the file in
+
+        Returns:
+        --------
+
+        path to the checked out file, or None if the key is not cached
+        """
+        with self.locked():
+            # hold the lock, such that the entry can not be evicted while it is transferred
+            entry_file = self._get(key)
+            if entry_file is None:
+                return None
+            target_file = os.path.join(target_dir, os.path.basename(entry_file))
+            self._transfer(entry_file, target_file)
+            return target_file
+
+    def _transfer(self, source_file_name, target_file_name):
+        if self.HARD_LINKS:
+            yt2mp3_utils.link_or_copy_file(source_file_name, target_file_name)
+        else:
+            shutil.copy2(source_file_name, target_file_name)
+
+    def contains(self, key):
+        """
+        Returns whether key is cached, without counting a hit or a miss or touching the entry.
+        """
+        with self.locked():
+            return self._entry_file(self.entry_dir(key)) is not None
+
+    def put(self, key, file_name):
+        """
+        Adds a copy of file_name to the cache under key (hard linked if possible) and evicts
+        least recently used entries if the cache grew too large.
+
+        Parameters:
+        -----------
+
+        key: tuple of str - the cache key
+
+        file_name: str - the file to cache. stays in place.
+
+        Returns:
+        --------
+
+        path to the cached file
+        """
+        entry_dir = self.entry_dir(key)
+        # prepare the entry outside of the lock under a unique name, then rename atomically.
+        tmp_entry_dir = '{}.{}.{}.tmp'.format(entry_dir, os.getpid(), threading.get_ident())
+        os.makedirs(tmp_entry_dir)
+        tmp_entry_file = os.path.join(tmp_entry_dir, os.path.basename(file_name))
+        self._transfer(file_name, tmp_entry_file)
+
+        with self.locked():
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir)
+            os.rename(tmp_entry_dir, entry_dir)
+            entry_file = os.path.join(entry_dir, os.path.basename(file_name))
+            # the modification time serves as access time (see _get). downloads carry the upload time instead
+            os.utime(entry_file)
+            self._evict(keep=entry_dir)
+        return entry_file
+
+    def _remove_stale_tmp_entries(self):
+        # NOTE: caller holds the lock
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            tmp_entry_dir = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp') and os.path.isdir(tmp_entry_dir):
+                try:
+                    if now - os.path.getmtime(tmp_entry_dir) > self.STALE_TMP_ENTRY_AGE:
+                        print('[yt2mp3] Removing interrupted cache entry "{}"'.format(tmp_entry_dir))
+                        shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+                except OSError:
+                    # renamed into place meanwhile by a put of another process
+                    pass
+
+    def _evict(self, keep=None):
+        # NOTE: caller holds the lock
+        self._remove_stale_tmp_entries()
+        entries = self.entries()
+        total_size = sum(size for _, _, size in entries)
+        for _, entry_file, size in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            entry_dir = os.path.dirname(entry_file)
+            if entry_dir == keep:
+                continue
+            print('[yt2mp3] Evicting "{}" from cache'.format(entry_file))
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
+            self._count('evictions')
+
+    def prune(self, max_size_bytes=None, max_age_seconds=None):
+        """
+        Evicts least recently used entries until the cache fits into max_size_bytes,
+        and all entries not used for longer than max_age_seconds.
+
+        Parameters:
+        -----------
+
+        max_size_bytes: int - (optional) the target size. defaults to the cache's configured maximum size.
+
+        max_age_seconds: float - (optional) the maximum time since the last use of an entry
+        """
+        with self.locked():
+            if max_age_seconds is not None:
+                now = time.time()
+                for last_access, entry_file, _ in self.entries():
+                    if now - last_access > max_age_seconds:
+                        shutil.rmtree(os.path.dirname(entry_file), ignore_errors=True)
+                        self._count('evictions')
+            max_size_bytes_backup = self.max_size_bytes
+            if max_size_bytes is not None:
+                self.max_size_bytes = max_size_bytes
+            try:
+                self._evict()
+            finally:
+                self.max_size_bytes = max_size_bytes_backup
+
+
+class MediaCache(FileCache):
+    """
+    Caches downloaded source media, keyed by canonical video ID and the youtube-dl format selector.
+    """
+
+    def key(self, video_id, media_format):
+        return ('media', video_id, media_format)
+
+    def checkout_media(self, video_id, media_format, target_dir):
+        return self.checkout(self.key(video_id, media_format), target_dir)
+
+    def contains_media(self, video_id, media_format):
+        return self.contains(self.key(video_id, media_format))
+
+    def put_media(self, video_id, media_format, file_name):
+        return self.put(self.key(video_id, media_format), file_name)
+
+
+class EncodedCache(FileCache):
+    """
+    Caches encoded mp3 files, keyed by video ID, source format and encoder settings.
+    Entries are copied instead of hard linked, since checked out files end up as user facing outputs.
+    """
+
+    HARD_LINKS = False
+
+    def key(self, video_id, media_format, encoder_settings):
+        return ('encoded', video_id, media_format, ' '.join(encoder_settings))
+
+    def checkout_encoded(self, video_id, media_format, encoder_settings, target_dir):
+        return self.checkout(self.key(video_id, media_format, encoder_settings), target_dir)
+
+    def contains_encoded(self, video_id, media_format, encoder_settings):
+        return self.contains(self.key(video_id, media_format, encoder_settings))
+
+    def put_encoded(self, video_id, media_format, encoder_settings, file_name):
+        return self.put(self.key(video_id, media_format, encoder_settings), file_name)
+
+
+# one cache instance per directory and process, shared by all jobs
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(cache_class, cache_dir, max_size_megabytes):
+    """
+    Returns the process wide cache instance of type cache_class for cache_dir.
+
+    Parameters:
+    -----------
+
+    cache_class: type - FileCache or one of its subclasses
+
+    cache_dir: str - the directory holding the cache
+
+    max_size_megabytes: float - the maximum cache size in MB
+
+    Returns:
+    --------
+
+    the cache instance
+    """
+    cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    with _caches_lock:
+        cache = _caches.get((cache_class, cache_dir))
+        if cache is None:
+            cache = cache_class(cache_dir, int(max_size_megabytes * 1024 * 1024))
+            _caches[(cache_class, cache_dir)] = cache
+        return cache
+
+
+def media_cache_from_args(args_namespace):
+    """
+    Returns the MediaCache configured in args_namespace, or None if caching of source media is disabled.
+    """
+    cache_dir = getattr(args_namespace, 'cache_dir', None)
+    if not cache_dir:
+        return None
+    return get_cache(MediaCache, os.path.join(cache_dir, 'media'), getattr(args_namespace, 'media_cache_size', 2048))
+
+
+def encoded_cache_from_args(args_namespace):
+    """
+    Returns the EncodedCache configured in args_namespace, or None if caching of encoded mp3 files is disabled.
+    """
+    cache_dir = getattr(args_namespace, 'cache_dir', None)
+    if not cache_dir:
+        return None
+    return get_cache(EncodedCache, os.path.join(cache_dir, 'encoded'), getattr(args_namespace, 'encoded_cache_size', 4096))
+
+
+def caches_from_args(args_namespace):
+    """
+    Returns a dict {name: cache} of all caches configured in args_namespace
+    """
+    caches = {'media': media_cache_from_args(args_namespace),
+              'encoded': encoded_cache_from_args(args_namespace)}
+    return {name: cache for name, cache in caches.items() if cache is not None}
@@ -0,0 +1,173 @@
+# adapts the worker pool sizes of a PipelineScheduler to the measured load
+
+import os
+import threading
+import time
+
+
+def read_cpu_times():
+    """
+    Reads the system wide CPU times from /proc/stat (Linux only).
+
+    Returns:
+    --------
+    tuple (busy, iowait, total) of cumulative times, or None if not available
+    """
+    try:
+        with open('/proc/stat', 'rt') as f:
+            fields = [int(value) for value in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    # user nice system idle iowait irq softirq steal ...
+    idle, iowait = fields[3], fields[4]
+    total = sum(fields[:8])
+    return total - idle - iowait, iowait, total
+
+
+def read_received_bytes():
+    """
+    Reads the number of bytes received on all network interfaces but loopback from /proc/net/dev (Linux only).
+
+    Returns:
+    --------
+    the cumulative number of received bytes, or None if not available
+    """
+    try:
+        with open('/proc/net/dev', 'rt') as f:
+            lines = f.readlines()[2:]
+    except OSError:
+        return None
+    received_bytes = 0
+    for line in lines:
+        interface, counters = line.split(':', 1)
+        if interface.strip() != 'lo':
+            received_bytes += int(counters.split()[0])
+    return received_bytes
+
+
+class ConcurrencyController(object):
+    """
+    Periodically measures CPU utilization, I/O wait and network throughput, and adjusts the number of
+    concurrent downloads and conversions of a yt2mp3_pipeline.PipelineScheduler within user-set bounds:
+
+    - conversions are added while the CPU has headroom and downloaded jobs wait for a conversion,
+      and removed when the CPU is saturated, e.g. by multi-threaded encoders.
+    - downloads are added one at a time while jobs wait for a download and the network throughput grows with them.
+      If an added download did not raise the throughput, it is removed again and the count is kept for a while.
+      Downloads are removed under high I/O wait, and not added while finished downloads pile up for conversion.
+
+    Every decision is printed along with the measurements it is based on.
+    Without /proc (i.e. outside Linux), the load average stands in for the CPU utilization and I/O wait is ignored.
+    """
+
+    CPU_HIGH = 0.9              # utilization above which conversions are removed
+    CPU_LOW = 0.6               # utilization below which conversions are added
+    IOWAIT_HIGH = 0.25          # share of CPU time waiting for I/O above which downloads are removed
+    MIN_THROUGHPUT_GAIN = 0.1   # relative network throughput gain expected from an added download
+    PLATEAU_INTERVALS = 6       # measurement intervals to keep the download count after an unprofitable increase
+
+    def __init__(self, scheduler, download_bounds, transcode_bounds, interval=5):
+        """
+        Parameters:
+        -----------
+
+        scheduler: yt2mp3_pipeline.PipelineScheduler - the scheduler to control
+
+        download_bounds: tuple - (min, max) number of concurrent downloads
+
+        transcode_bounds: tuple - (min, max) number of concurrent conversions
+
+        interval: float - (optional) the time in seconds between two measurements and decisions
+        """
+        self.scheduler = scheduler
+        self.download_bounds = download_bounds
+        self.transcode_bounds = transcode_bounds
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.last_download_increase = None     # the network throughput before the last added download
+        self.plateau_countdown = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='Concurrency Controller', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        cpu_times, received_bytes, t_sample = read_cpu_times(), read_received_bytes(), time.time()
+        while not self.stop_event.wait(self.interval):
+            new_cpu_times, new_received_bytes, new_t_sample = read_cpu_times(), read_received_bytes(), time.time()
+            measurements = {'cpu': None, 'iowait': None, 'rx_bytes_per_second': None}
+            if cpu_times is not None and new_cpu_times is not None and new_cpu_times[2] > cpu_times[2]:
+                total = new_cpu_times[2] - cpu_times[2]
+                measurements['cpu'] = (new_cpu_times[0] - cpu_times[0]) / total
+                measurements['iowait'] = (new_cpu_times[1] - cpu_times[1]) / total
+            elif hasattr(os, 'getloadavg'):
+                measurements['cpu'] = os.getloadavg()[0] / (os.cpu_count() or 1)
+            if received_bytes is not None and new_received_bytes is not None:
+                measurements['rx_bytes_per_second'] = (new_received_bytes - received_bytes) / (new_t_sample - t_sample)
+            cpu_times, received_bytes, t_sample = new_cpu_times, new_received_bytes, new_t_sample
+            self.decide(measurements)
+
+    def decide(self, measurements):
+        """
+        Adjusts the worker limits of the scheduler to one set of measurements
+        """
+        scheduler = self.scheduler
+        measurements = dict(measurements,
+                            # including the jobs of workers waiting for a lowered limit, see WorkerLimit.recheck
+                            pending_downloads=scheduler.download_queue.qsize() + len(scheduler.download_limit.holding),
+                            pending_transcodes=scheduler.transcode_queue.qsize() + len(scheduler.transcode_limit.holding))
+        cpu, iowait, throughput = measurements['cpu'], measurements['iowait'], measurements['rx_bytes_per_second']
+
+        n_transcode = scheduler.n_transcode_workers
+        if cpu is not None and cpu > self.CPU_HIGH and n_transcode > self.transcode_bounds[0]:
+            self._set(measurements, 'transcode', n_transcode - 1, 'CPU saturated')
+        elif (cpu is not None and cpu < self.CPU_LOW and measurements['pending_transcodes'] > 0
+              and n_transcode < self.transcode_bounds[1]):
+            self._set(measurements, 'transcode', n_transcode + 1, 'CPU headroom while downloads wait for conversion')
+
+        n_download = scheduler.n_download_workers
+        if self.plateau_countdown > 0:
+            self.plateau_countdown -= 1
+        if iowait is not None and iowait > self.IOWAIT_HIGH and n_download > self.download_bounds[0]:
+            self.last_download_increase = None
+            self._set(measurements, 'download', n_download - 1, 'high I/O wait')
+        elif self.last_download_increase is not None and throughput is not None:
+            previous_throughput, self.last_download_increase = self.last_download_increase, None
+            if throughput < previous_throughput * (1 + self.MIN_THROUGHPUT_GAIN) and n_download > self.download_bounds[0]:
+                self.plateau_countdown = self.PLATEAU_INTERVALS
+                self._set(measurements, 'download', n_download - 1,
+                          'added download did not raise the throughput above {:.2f}MiB/s'.format(previous_throughput / 1024**2))
+        elif (measurements['pending_downloads'] > 0 and self.plateau_countdown == 0 and n_download < self.download_bounds[1]
+              and not scheduler.transcode_queue.full()):
+            self.last_download_increase = throughput
+            self._set(measurements, 'download', n_download + 1, 'videos wait for a download')
+
+    def _set(self, measurements, pool, n_workers, reason):
+        old_n_download, old_n_transcode = self.scheduler.n_download_workers, self.scheduler.n_transcode_workers
+        if pool == 'download':
+            self.scheduler.set_worker_limits(n_download_workers=n_workers)
+        else:
+            self.scheduler.set_worker_limits(n_transcode_workers=n_workers)
+        print('[yt2mp3] [CONCURRENCY] downloads {} -> {}, conversions {} -> {}: {} ({})'.format(
+            old_n_download, self.scheduler.n_download_workers, old_n_transcode, self.scheduler.n_transcode_workers, reason,
+            ', '.join('{}={}'.format(key, '?' if value is None else round(value, 3)) for key, value in sorted(measurements.items()))))
+
+
+def controller_from_args(scheduler, args_namespace):
+    """
+    Starts a ConcurrencyController for the scheduler if adaptive concurrency is enabled in args_namespace.
+
+    Returns:
+    --------
+    the running controller, or None
+    """
+    if not getattr(args_namespace, 'adaptive_concurrency', False):
+        return None
+    return ConcurrencyController(scheduler,
+                                 (args_namespace.min_download_jobs, len(scheduler.download_threads)),
+                                 (args_namespace.min_jobs, len(scheduler.transcode_threads))).start()
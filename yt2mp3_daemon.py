@@ -0,0 +1,451 @@
+# a long running job daemon owning the worker pools and caches, and its clients
+
+import argparse
+import collections
+import hmac
+import ipaddress
+import json
+import os
+import queue
+import secrets
+import socket
+import socketserver
+import threading
+
+import yt2mp3_utils
+import yt2mp3_pipeline
+import yt2mp3_progress
+import yt2mp3_jobstore
+import yt2mp3_concurrency
+
+
+def default_address():
+    """
+    Returns the default daemon address: a unix socket in the user's cache directory where supported,
+    a localhost TCP port otherwise.
+    """
+    if hasattr(socket, 'AF_UNIX'):
+        return os.path.join(os.path.expanduser('~'), '.cache', 'yt2mp3', 'daemon.sock')
+    return 'tcp:127.0.0.1:47823'
+
+
+# the number of finished jobs the daemon keeps for status requests. older ones are forgotten
+MAX_FINISHED_JOBS = 1000
+
+
+def token_file_name(address):
+    """
+    Returns the file holding the secret clients of a TCP daemon authenticate with. Only the daemon's user can read it.
+    """
+    _, host, port = address.split(':')
+    return os.path.join(os.path.expanduser('~'), '.cache', 'yt2mp3', 'daemon-{}-{}.token'.format(host, port))
+
+
+def read_token(address):
+    """
+    Returns the secret to authenticate with at a TCP daemon, or None for unix sockets, which are protected by their permissions
+    """
+    if not address.startswith('tcp:'):
+        return None
+    try:
+        with open(token_file_name(address), 'rt') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def check_loopback(host):
+    """
+    Raises a RuntimeError unless host resolves to a loopback address. The daemon writes files under its user's identity,
+    and must not accept jobs from other hosts.
+    """
+    if not ipaddress.ip_address(socket.gethostbyname(host)).is_loopback:
+        raise RuntimeError('The daemon only listens at loopback addresses, not at "{}"'.format(host))
+
+
+def connect(address):
+    """
+    Connects to a daemon listening at address, either a unix socket path or "tcp:HOST:PORT".
+
+    Returns:
+    --------
+    the connected socket
+    """
+    if address.startswith('tcp:'):
+        _, host, port = address.split(':')
+        return socket.create_connection((host, int(port)))
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(address)
+    return connection
+
+
+def send_message(wfile, message):
+    """
+    Writes a message as one line of JSON
+    """
+    wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+    wfile.flush()
+
+
+def request(address, message):
+    """
+    Sends a single request to the daemon and returns its reply
+    """
+    with connect(address) as connection:
+        rwfile = connection.makefile('rwb')
+        send_message(rwfile, dict(message, token=read_token(address)))
+        return json.loads(rwfile.readline().decode('utf-8'))
+
+
+###############
+# daemon side
+###############
+
+class DaemonJob(object):
+    """
+    Bookkeeping of the daemon for a single submitted job
+    """
+
+    def __init__(self, job_id, video):
+        self.job_id = job_id
+        self.video = video
+        self.pipeline_job = None
+        self.subscribers = []       # queue.Queue objects receiving the job's events
+        self.lock = threading.Lock()
+        self.done_event = None
+
+    def publish(self, event):
+        event['job'] = self.job_id
+        with self.lock:
+            if event['event'] == 'done':
+                self.done_event = event
+            for subscriber in self.subscribers:
+                subscriber.put(event)
+
+    def subscribe(self):
+        """
+        Returns a queue receiving all future events of this job. Receives the done event right away, if already done.
+        """
+        subscriber = queue.Queue()
+        with self.lock:
+            self.subscribers.append(subscriber)
+            if self.done_event is not None:
+                subscriber.put(self.done_event)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.remove(subscriber)
+
+    def status(self):
+        pipeline_job = self.pipeline_job
+        status = {'job': self.job_id,
+                  'video': self.video,
+                  'stage': pipeline_job.stage if pipeline_job else None,
+                  'progress': pipeline_job.progress.snapshot() if pipeline_job else None,
+                  'done': self.done_event is not None}
+        if self.done_event is not None:
+            status['result'] = self.done_event['result']
+            status['error'] = self.done_event['error']
+        return status
+
+
+class JobDaemon(object):
+    """
+    Owns a PipelineScheduler (and, via the args of submitted jobs, the process wide caches)
+    and accepts jobs over a local socket. The protocol is one JSON object per line:
+
+        {"cmd": "info"}                                 -> worker pool sizes
+        {"cmd": "submit", "args": {...}, "watch": bool} -> {"job": id}, then, if watching, the job's events
+        {"cmd": "watch", "job": id}                     -> the job's events, until it is done
+        {"cmd": "status", "job": id or null}            -> status of one or all jobs
+        {"cmd": "stop", "job": id}                      -> stops a job
+        {"cmd": "shutdown"}                             -> stops the daemon after all submitted jobs are done
+
+    Events are {"event": "stage", "stage": ...}, {"event": "output", "line": ...}
+    and finally {"event": "done", "result": ..., "error": ...}.
+
+    Since the daemon writes the outputs of the jobs under its user's identity, only that user may submit jobs:
+    unix sockets are created accessible to the user only, and TCP addresses have to be loopback addresses.
+    Messages to a TCP daemon carry the "token" written to token_file_name(address) at the daemon's start.
+    The last MAX_FINISHED_JOBS finished jobs are kept for status requests.
+    """
+
+    def __init__(self, address, scheduler):
+        """
+        Parameters:
+        -----------
+
+        address: str - the unix socket path or "tcp:HOST:PORT" address to listen at
+
+        scheduler: yt2mp3_pipeline.PipelineScheduler - runs all submitted jobs
+        """
+        self.address = address
+        self.scheduler = scheduler
+        self.jobs = {}
+        self.finished_job_ids = collections.deque()     # the oldest finished jobs are forgotten first
+        self.jobs_lock = threading.Lock()
+        self.job_counter = 0
+        self.server = None
+        self.token = None
+
+    def submit(self, args_dict, resume_from=None):
+        """
+        Submits a job for a single video conversion, described by the vars() of its argparse.Namespace.
+        See yt2mp3_pipeline.PipelineScheduler.submit for resume_from.
+
+        Returns:
+        --------
+        the DaemonJob
+        """
+        args_namespace = argparse.Namespace(**args_dict)
+        with self.jobs_lock:
+            self.job_counter += 1
+            daemon_job = DaemonJob(str(self.job_counter), args_namespace.video[0])
+            self.jobs[daemon_job.job_id] = daemon_job
+
+        progress = yt2mp3_progress.JobProgress()
+        watcher = yt2mp3_progress.ProgressWatcher(progress,
+                                                  line_callback=lambda line: daemon_job.publish({'event': 'output', 'line': line}))
+        daemon_job.pipeline_job = self.scheduler.submit(args_namespace, watcher,
+                                                        lambda job, stage: daemon_job.publish({'event': 'stage', 'stage': stage}),
+                                                        progress, resume_from)
+        daemon_job.pipeline_job.future.add_done_callback(lambda future: self._publish_done(daemon_job, future))
+        print('[yt2mp3] Job {} submitted: {}'.format(daemon_job.job_id, daemon_job.video))
+        return daemon_job
+
+    def _publish_done(self, daemon_job, future):
+        if future.cancelled():
+            result, error = None, 'cancelled'
+        elif future.exception() is not None:
+            result, error = None, str(future.exception()) or type(future.exception()).__name__
+        else:
+            result, error = future.result(), None
+        print('[yt2mp3] Job {} done: {}'.format(daemon_job.job_id, error or result))
+        daemon_job.publish({'event': 'done', 'result': result, 'error': error})
+        with self.jobs_lock:
+            self.finished_job_ids.append(daemon_job.job_id)
+            while len(self.finished_job_ids) > MAX_FINISHED_JOBS:
+                self.jobs.pop(self.finished_job_ids.popleft(), None)
+
+    def stop_job(self, job_id):
+        daemon_job = self.jobs[job_id]
+        pipeline_job = daemon_job.pipeline_job
+        pipeline_job.stop()
+        for process in pipeline_job.process_watcher.child_processes:
+            process.kill()
+
+    def serve_forever(self):
+        """
+        Listens for requests until a shutdown request has been received
+        """
+        if self.address.startswith('tcp:'):
+            _, host, port = self.address.split(':')
+            check_loopback(host)
+            # loopback connections may still come from other users of this machine
+            self.token = secrets.token_hex(16)
+            token_file = token_file_name(self.address)
+            yt2mp3_utils.ensure_dir_exists(os.path.dirname(token_file))
+            if os.path.exists(token_file):
+                os.remove(token_file)
+            with os.fdopen(os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wt') as f:
+                f.write(self.token)
+            self.server = socketserver.ThreadingTCPServer((host, int(port)), DaemonRequestHandler)
+        else:
+            yt2mp3_utils.ensure_dir_exists(os.path.dirname(self.address) or '.')
+            if os.path.exists(self.address):
+                # a stale socket of a previous daemon. refuse to take over a live one.
+                try:
+                    connect(self.address).close()
+                    raise RuntimeError('Another daemon is listening at "{}"'.format(self.address))
+                except (ConnectionRefusedError, FileNotFoundError):
+                    os.remove(self.address)
+            # create the socket accessible to this user only, without a window for others to connect
+            umask = os.umask(0o177)
+            try:
+                self.server = socketserver.ThreadingUnixStreamServer(self.address, DaemonRequestHandler)
+            finally:
+                os.umask(umask)
+        self.server.daemon_threads = True
+        self.server.job_daemon = self
+        print('[yt2mp3] Daemon listening at {} with {} download and {} transcode workers'.format(
+            self.address, self.scheduler.n_download_workers, self.scheduler.n_transcode_workers))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if not self.address.startswith('tcp:') and os.path.exists(self.address):
+                os.remove(self.address)
+            if self.token is not None and os.path.exists(token_file_name(self.address)):
+                os.remove(token_file_name(self.address))
+
+    def shutdown(self):
+        self.scheduler.shutdown(wait=True)
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles the requests of a single client connection, see JobDaemon
+    """
+
+    def send(self, message):
+        send_message(self.wfile, message)
+
+    def stream_events(self, daemon_job, subscriber):
+        try:
+            while True:
+                event = subscriber.get()
+                self.send(event)
+                if event['event'] == 'done':
+                    break
+        finally:
+            daemon_job.unsubscribe(subscriber)
+
+    def handle(self):
+        job_daemon = self.server.job_daemon
+        for raw_message in self.rfile:
+            try:
+                message = json.loads(raw_message.decode('utf-8'))
+                if job_daemon.token is not None and not hmac.compare_digest(str(message.get('token')), job_daemon.token):
+                    self.send({'error': 'Not authorized'})
+                    return
+                cmd = message.get('cmd')
+                if cmd == 'info':
+                    self.send({'n_download_workers': job_daemon.scheduler.n_download_workers,
+                               'n_transcode_workers': job_daemon.scheduler.n_transcode_workers})
+                elif cmd == 'submit':
+                    daemon_job = job_daemon.submit(message['args'])
+                    # subscribe before answering, such that no event can be missed
+                    subscriber = daemon_job.subscribe() if message.get('watch') else None
+                    self.send({'job': daemon_job.job_id})
+                    if subscriber is not None:
+                        self.stream_events(daemon_job, subscriber)
+                elif cmd == 'watch':
+                    daemon_job = job_daemon.jobs[message['job']]
+                    self.stream_events(daemon_job, daemon_job.subscribe())
+                elif cmd == 'status':
+                    if message.get('job') is None:
+                        self.send({'jobs': [daemon_job.status() for daemon_job in list(job_daemon.jobs.values())]})
+                    else:
+                        self.send(job_daemon.jobs[message['job']].status())
+                elif cmd == 'stop':
+                    job_daemon.stop_job(message['job'])
+                    self.send({'stopped': message['job']})
+                elif cmd == 'shutdown':
+                    self.send({'shutdown': True})
+                    job_daemon.shutdown()
+                    return
+                else:
+                    self.send({'error': 'Unknown command "{}"'.format(cmd)})
+            except (KeyError, ValueError, TypeError, AssertionError) as e:
+                self.send({'error': '{}: {}'.format(type(e).__name__, e)})
+
+
+def run_daemon(args_namespace):
+    """
+    Runs a JobDaemon configured by the command line arguments until it is shut down
+    """
+    yt2mp3_utils.check_requirements()
+    yt2mp3_utils.sweep_download_dirs(args_namespace.sweep_age * 24 * 3600)
+    scheduler = yt2mp3_pipeline.scheduler_from_args(args_namespace, yt2mp3_jobstore.job_store_from_args(args_namespace))
+    yt2mp3_concurrency.controller_from_args(scheduler, args_namespace)
+    job_daemon = JobDaemon(args_namespace.daemon_address, scheduler)
+    for record in yt2mp3_jobstore.resumable_jobs_from_args(args_namespace):
+        job_daemon.submit(vars(record.args), record)
+    try:
+        job_daemon.serve_forever()
+    finally:
+        if job_daemon.scheduler.job_store is not None:
+            job_daemon.scheduler.job_store.flush()
+
+
+###############
+# client side
+###############
+
+class RemotePipelineJob(yt2mp3_pipeline.PipelineJob):
+    """
+    A PipelineJob running in a daemon. Stage changes, progress and the result are mirrored from the daemon's events.
+    """
+
+    def __init__(self, scheduler, args_namespace, process_watcher=None, stage_callback=None, progress=None):
+        super().__init__(args_namespace, process_watcher, stage_callback, progress)
+        self.scheduler = scheduler
+        self.job_id = None
+
+    def stop(self):
+        super().stop()
+        if self.job_id is not None:
+            request(self.scheduler.address, {'cmd': 'stop', 'job': self.job_id})
+
+
+class RemoteScheduler(object):
+    """
+    A drop-in replacement for yt2mp3_pipeline.PipelineScheduler, submitting jobs to a JobDaemon.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        info = request(address, {'cmd': 'info'})
+        self.n_download_workers = info['n_download_workers']
+        self.n_transcode_workers = info['n_transcode_workers']
+
+    def submit(self, args_namespace, process_watcher=None, stage_callback=None, progress=None, resume_from=None):
+        """
+        See yt2mp3_pipeline.PipelineScheduler.submit. Interrupted jobs are resumed by the daemon itself, see JobDaemon.
+        If the process_watcher has a method handle_output, it receives every output line of the job's child processes,
+        just like a local process watcher reads them from their pipes. Otherwise, the lines feed the job's progress.
+        """
+        assert resume_from is None, 'Jobs of a daemon can only be resumed by the daemon'
+        job = RemotePipelineJob(self, args_namespace, process_watcher, stage_callback, progress)
+
+        # the daemon does not share the working directory of this process
+        args_dict = dict(vars(args_namespace))
+        for path_argument in ['output', 'cache_dir']:
+            if args_dict.get(path_argument):
+                args_dict[path_argument] = os.path.abspath(args_dict[path_argument])
+        args_dict['video'] = list(args_namespace.video)
+        args_dict['input_file'] = None
+
+        connection = connect(self.address)
+        rwfile = connection.makefile('rwb')
+        send_message(rwfile, {'cmd': 'submit', 'args': args_dict, 'watch': True, 'token': read_token(self.address)})
+        reply = json.loads(rwfile.readline().decode('utf-8'))
+        if 'error' in reply:
+            connection.close()
+            raise RuntimeError('Daemon refused job: {}'.format(reply['error']))
+        job.job_id = reply['job']
+        threading.Thread(target=self._receive_events, args=(job, connection, rwfile), daemon=True).start()
+        return job
+
+    def _receive_events(self, job, connection, rwfile):
+        output_callback = getattr(job.process_watcher, 'handle_output', None)
+        try:
+            for raw_event in rwfile:
+                event = json.loads(raw_event.decode('utf-8'))
+                if event['event'] == 'stage':
+                    if event['stage'] != yt2mp3_pipeline.PipelineJob.STAGE_QUEUED and not (job.future.running() or job.future.done()):
+                        job.future.set_running_or_notify_cancel()
+                    job.set_stage(event['stage'])
+                elif event['event'] == 'output':
+                    if output_callback:
+                        output_callback(event['line'])
+                    else:
+                        job.progress.feed(event['line'])
+                elif event['event'] == 'done':
+                    if job.future.done():
+                        break
+                    if event['error'] is None:
+                        job.future.set_result(event['result'])
+                    else:
+                        job.future.set_exception(RuntimeError(event['error']))
+                    break
+        finally:
+            connection.close()
+            if not job.future.done():
+                job.future.set_exception(ConnectionError('Lost connection to the daemon at "{}"'.format(self.address)))
+
+    def shutdown(self, wait=True):
+        # the daemon outlives its clients
+        pass
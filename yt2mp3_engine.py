@@ -0,0 +1,305 @@
+# an optional download engine driving the youtube_dl Python API in-process, instead of a youtube-dl process per video
+
+import re
+import threading
+import time
+import urllib.request
+
+try:
+    import youtube_dl
+except ImportError:
+    youtube_dl = None
+
+
+# the youtube_dl options shared by all downloads, mirroring the command line in yt2mp3_utils.download_video
+BASE_PARAMS = {'ignoreerrors': True,
+               'continuedl': True,
+               'noprogress': True,     # progress lines are emitted from the progress hook instead
+               'quiet': True,
+               'no_warnings': False}
+# the minimum time in seconds between two progress lines of a download
+PROGRESS_INTERVAL = 0.25
+
+
+def is_available():
+    return youtube_dl is not None
+
+
+def sanitize_file_name(value):
+    """
+    Turns a field of the info dict (e.g. the title) into a part of a file name as youtube-dl does in its output templates,
+    such that file names can be predicted without asking youtube-dl
+    """
+    if youtube_dl is not None:
+        return youtube_dl.utils.sanitize_filename(value)
+
+    # the same rules as youtube_dl.utils.sanitize_filename, without restricted file names
+    def replace_insane(char):
+        if char == '?' or ord(char) < 32 or ord(char) == 127:
+            return ''
+        if char == '"':
+            return '\''
+        if char == ':':
+            return ' -'
+        if char in '\\/|*<>':
+            return '_'
+        return char
+
+    # time stamps, e.g. 12:34
+    value = re.sub(r'[0-9]+(?::[0-9]+)+', lambda match: match.group(0).replace(':', '_'), value)
+    result = ''.join(map(replace_insane, value))
+    while '__' in result:
+        result = result.replace('__', '_')
+    result = result.strip('_')
+    if result.startswith('-'):
+        result = '_' + result[1:]
+    result = result.lstrip('.')
+    return result or '_'
+
+
+class OutputLogger(object):
+    """
+    Receives the messages of a youtube_dl.YoutubeDL instance and hands them to the output callback
+    of the download currently using the instance
+    """
+
+    def __init__(self):
+        self.output_callback = print
+        self.quiet = False      # drop informational messages, e.g. while only probing
+
+    def debug(self, message):
+        # progress bar updates start with \r. the progress hook reports them instead
+        if not self.quiet and not message.startswith('\r'):
+            self.output_callback(message)
+
+    def warning(self, message):
+        self.output_callback(message)
+
+    def error(self, message):
+        self.output_callback(message)
+
+
+class InProcessDownload(object):
+    """
+    Stands in for the subprocess.Popen object of a youtube-dl process, such that process watchers
+    can stop an in-process download and see its outcome like those of child processes
+    """
+
+    def __init__(self, video_url):
+        self.args = ['youtube_dl', video_url]
+        self.stdout = None      # there is nothing to read. output is handed over via handle_output
+        self.returncode = None
+        self.killed = False
+        self.done = threading.Event()
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.returncode
+
+    def kill(self):
+        # the next progress hook call aborts the download
+        self.killed = True
+
+    terminate = kill
+
+    def finish(self, returncode):
+        self.returncode = -9 if self.killed else returncode
+        self.done.set()
+
+
+class DownloadKilledError(Exception):
+    pass
+
+
+class YoutubeDLEngine(object):
+    """
+    Downloads videos with a pool of youtube_dl.YoutubeDL instances kept alive across all jobs of the process.
+    Compared to a youtube-dl process per video, this saves the interpreter start and the import of all extractors,
+    and each instance keeps its extractors, including their caches of player JavaScript and signature functions.
+    All instances share one cookie jar. Each instance serves one download at a time, with the options of that download.
+    """
+
+    def __init__(self):
+        assert is_available(), 'The in-process engine requires the youtube_dl Python package'
+        self.lock = threading.Lock()
+        self.idle = []          # (instance, logger, hook state) not in use by any download
+        self.cookiejar = None
+
+    def _acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        logger = OutputLogger()
+        hook_state = {'callback': None}
+        ydl = youtube_dl.YoutubeDL(dict(BASE_PARAMS, logger=logger,
+                                        progress_hooks=[lambda status: hook_state['callback'](status)]))
+        with self.lock:
+            if self.cookiejar is None:
+                self.cookiejar = ydl.cookiejar
+            else:
+                # route the cookies of all instances through the first instance's jar
+                ydl.cookiejar = self.cookiejar
+                for handler in ydl._opener.handlers:
+                    if isinstance(handler, urllib.request.HTTPCookieProcessor):
+                        handler.cookiejar = self.cookiejar
+        return ydl, logger, hook_state
+
+    def _release(self, instance):
+        with self.lock:
+            self.idle.append(instance)
+
+    def download(self, video_url, output_template, archive_file, format_selector, process_watcher=None,
+                 bandwidth_budget=None, job_rate=None, rate_callback=None):
+        """
+        Downloads the video behind video_url, like the youtube-dl command line in yt2mp3_utils.download_video.
+        Rate limits are applied to the running download: unlike a youtube-dl process, it needs no restart when
+        its fair share of the bandwidth_budget changes.
+
+        Parameters:
+        -----------
+        video_url: str - The youtube video url or id
+
+        output_template: str - the youtube-dl output file name template
+
+        archive_file: str - the youtube-dl download archive file
+
+        format_selector: str - the youtube-dl format selector
+
+        process_watcher: object - (optional) some object instance containing a field child_processes of type list,
+            which the download is registered with as an InProcessDownload. Output lines are passed to its method
+            handle_output, if available, and printed otherwise
+
+        bandwidth_budget: yt2mp3_bandwidth.BandwidthBudget - (optional) the download rate budget shared with concurrent downloads
+
+        job_rate: float - (optional) the maximum download rate of this video in bytes per second
+
+        rate_callback: callable - (optional) called with the allotted download rate in bytes per second (or None) whenever it is set
+
+        Returns:
+        --------
+        the exit code youtube-dl would have returned
+        """
+        download = InProcessDownload(video_url)
+        output_callback = print
+        if process_watcher is not None:
+            process_watcher.child_processes.append(download)
+            output_callback = getattr(process_watcher, 'handle_output', print)
+
+        token = bandwidth_budget.join(job_rate) if bandwidth_budget is not None else None
+        rate = bandwidth_budget.share(token) if token is not None else job_rate
+        if rate_callback:
+            rate_callback(rate)
+        instance = self._acquire()
+        ydl, logger, hook_state = instance
+        last_check = {'rate': time.time(), 'progress': 0}
+
+        def progress_hook(status):
+            if download.killed:
+                raise DownloadKilledError('Download of "{}" has been stopped'.format(video_url))
+            now = time.time()
+            if token is not None and now - last_check['rate'] > bandwidth_budget.check_interval:
+                last_check['rate'] = now
+                new_rate = bandwidth_budget.share(token)
+                if new_rate != ydl.params.get('ratelimit'):
+                    # read by youtube_dl's downloaders for every block
+                    ydl.params['ratelimit'] = new_rate
+                    if rate_callback:
+                        rate_callback(new_rate)
+            total_bytes = status.get('total_bytes') or status.get('total_bytes_estimate')
+            if status.get('status') == 'downloading' and total_bytes and now - last_check['progress'] > PROGRESS_INTERVAL:
+                last_check['progress'] = now
+                # the format of youtube-dl's progress lines, see yt2mp3_progress.DOWNLOAD_PATTERN
+                line = '[download] {:5.1f}% of {:.2f}MiB'.format(100. * status.get('downloaded_bytes', 0) / total_bytes,
+                                                                 total_bytes / 1024**2)
+                if status.get('speed'):
+                    line += ' at {:.2f}MiB/s'.format(status['speed'] / 1024**2)
+                if status.get('eta') is not None:
+                    line += ' ETA {:02d}:{:02d}'.format(*divmod(int(status['eta']), 60))
+                output_callback(line)
+
+        returncode = 1
+        try:
+            logger.output_callback = output_callback
+            hook_state['callback'] = progress_hook
+            ydl.params.update(outtmpl=output_template, download_archive=archive_file, format=format_selector, ratelimit=rate)
+            returncode = ydl.download([video_url])
+        finally:
+            download.finish(returncode)
+            hook_state['callback'] = None
+            logger.output_callback = print
+            if token is not None:
+                bandwidth_budget.leave(token)
+            self._release(instance)
+        return download.returncode
+
+    def get_filename(self, video_url, output_template, format_selector):
+        """
+        Returns the file name the download of video_url would be written to, like youtube-dl --get-filename
+        """
+        instance = self._acquire()
+        ydl, logger, _ = instance
+        try:
+            logger.quiet = True
+            ydl.params.update(outtmpl=output_template, format=format_selector, download_archive=None)
+            info = ydl.extract_info(video_url, download=False)
+            assert info is not None, 'Could not resolve video "{}"'.format(video_url)
+            return ydl.prepare_filename(info)
+        finally:
+            logger.quiet = False
+            self._release(instance)
+
+    def extract_metadata(self, video_url, format_selector):
+        """
+        Returns the youtube-dl info dict of the video with the given format selected, like youtube-dl --dump-json,
+        or None if it can not be resolved
+        """
+        instance = self._acquire()
+        ydl, logger, _ = instance
+        try:
+            logger.quiet = True
+            ydl.params.update(format=format_selector, download_archive=None)
+            return ydl.extract_info(video_url, download=False)
+        finally:
+            logger.quiet = False
+            self._release(instance)
+
+    def list_playlist(self, playlist_url):
+        """
+        Lists the videos of a playlist or channel, like youtube-dl --flat-playlist --dump-json.
+
+        Returns:
+        --------
+        list of dicts with the keys id and title, in playlist order
+        """
+        instance = self._acquire()
+        ydl, logger, _ = instance
+        try:
+            logger.quiet = True
+            ydl.params['extract_flat'] = 'in_playlist'
+            info = ydl.extract_info(playlist_url, download=False) or {}
+        finally:
+            logger.quiet = False
+            ydl.params.pop('extract_flat', None)
+            self._release(instance)
+        return [{'id': entry['id'], 'title': entry.get('title')} for entry in info.get('entries') or [] if entry]
+
+
+# one engine per process, shared by all jobs
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def engine_from_args(args_namespace):
+    """
+    Returns the process wide YoutubeDLEngine if the in-process engine is selected in args_namespace, or None
+    """
+    global _engine
+    if getattr(args_namespace, 'engine', 'cli') != 'api':
+        return None
+    with _engine_lock:
+        if _engine is None:
+            _engine = YoutubeDLEngine()
+        return _engine
@@ -0,0 +1,184 @@
+# a durable record of all jobs and the artifacts of their completed stages, for resuming after crashes
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import yt2mp3_pipeline
+
+
+# the job state fields holding paths, see yt2mp3_pipeline.new_job_state
+STATE_PATH_FIELDS = ['download_dir', 'archive_file', 'video_file', 'mp3_file', 'tmp_mp3_file', 'output_destination']
+STATE_FIELDS = STATE_PATH_FIELDS + ['stream_file_name', 'encoded_cached', 'cut_points']
+
+
+class JobStore(object):
+    """
+    Records the parameters, stage and artifacts of every job in a SQLite database.
+    Writes are cheap for the caller: they are collected in memory, coalesced per job,
+    and committed by a background thread in a single transaction every flush_interval seconds.
+    A crash thus loses at most the last flush_interval seconds of stage changes,
+    after which the affected jobs resume from an earlier stage. Records made with flush are committed before record returns.
+    """
+
+    def __init__(self, db_file, flush_interval=0.5):
+        """
+        Parameters:
+        -----------
+
+        db_file: str - the SQLite database file. created if missing
+
+        flush_interval: float - (optional) the maximum time in seconds between two commits
+        """
+        self.db_file = db_file
+        self.flush_interval = flush_interval
+        db_dir = os.path.dirname(os.path.abspath(db_file))
+        if not os.path.isdir(db_dir):
+            os.makedirs(db_dir)
+        self.connection = sqlite3.connect(db_file, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                                'job_id TEXT PRIMARY KEY, video TEXT, args TEXT, stage TEXT, state TEXT, '
+                                'result TEXT, error TEXT, created REAL, updated REAL)')
+        self.connection.commit()
+        self.db_lock = threading.Lock()
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.is_closed = False
+        self.writer = threading.Thread(target=self._write_pending, name='Job Store Writer', daemon=True)
+        self.writer.start()
+
+    def record(self, job_id, args_namespace, stage, job_state=None, result=None, error=None, flush=False):
+        """
+        Records the current stage of a job. Later records of the same job replace pending earlier ones.
+
+        Parameters:
+        -----------
+
+        job_id: str - the job's unique ID
+
+        args_namespace: argparse.Namespace - the options of the job
+
+        stage: str - the stage the job has entered, see yt2mp3_pipeline.PipelineJob
+
+        job_state: argparse.Namespace - (optional) the job state as created by yt2mp3_pipeline.new_job_state
+
+        result: str - (optional) the job's output destination, once done
+
+        error: str - (optional) why the job failed, if so
+
+        flush: bool - (optional) commit this and all other pending records before returning,
+            instead of at the next flush interval
+        """
+        state = {}
+        if job_state is not None:
+            for field in STATE_FIELDS:
+                value = getattr(job_state, field)
+                # resumed jobs may run from another working directory
+                state[field] = os.path.abspath(value) if value and field in STATE_PATH_FIELDS else value
+        now = time.time()
+        row = (job_id, args_namespace.video[0], json.dumps(vars(args_namespace)), stage, json.dumps(state),
+               result, error, now, now)
+        with self.pending_lock:
+            self.pending[job_id] = row
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Commits all pending records
+        """
+        # popping under the db lock keeps concurrent flushes from committing older records last
+        with self.db_lock:
+            if self.connection is None:
+                # closed. records made during close are lost, as they would be in a crash
+                return
+            with self.pending_lock:
+                rows = list(self.pending.values())
+                self.pending.clear()
+            if not rows:
+                return
+            with self.connection:
+                # keep the creation time of known jobs
+                self.connection.executemany('INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                                            'ON CONFLICT(job_id) DO UPDATE SET '
+                                            'args=excluded.args, stage=excluded.stage, state=excluded.state, '
+                                            'result=excluded.result, error=excluded.error, updated=excluded.updated',
+                                            rows)
+
+    def _write_pending(self):
+        while not self.is_closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def jobs(self, unfinished_only=False):
+        """
+        Returns the recorded jobs, oldest first, as argparse.Namespace objects with the fields
+        job_id, video, args (argparse.Namespace), stage, state (dict), result, error, created and updated.
+
+        Parameters:
+        -----------
+
+        unfinished_only: bool - (optional) only return jobs which have not been done yet
+        """
+        self.flush()
+        query = 'SELECT job_id, video, args, stage, state, result, error, created, updated FROM jobs'
+        parameters = ()
+        if unfinished_only:
+            query += ' WHERE stage != ?'
+            parameters = (yt2mp3_pipeline.PipelineJob.STAGE_DONE,)
+        with self.db_lock:
+            rows = self.connection.execute(query + ' ORDER BY created', parameters).fetchall()
+        return [argparse.Namespace(job_id=job_id, video=video, args=argparse.Namespace(**json.loads(args)),
+                                   stage=stage, state=json.loads(state), result=result, error=error,
+                                   created=created, updated=updated)
+                for job_id, video, args, stage, state, result, error, created, updated in rows]
+
+    def close(self):
+        """
+        Commits all pending records and closes the database
+        """
+        self.is_closed = True
+        self.wakeup.set()
+        self.writer.join()
+        self.flush()
+        with self.db_lock:
+            self.connection.close()
+            self.connection = None
+
+
+# one job store per database file and process
+_job_stores = {}
+_job_stores_lock = threading.Lock()
+
+
+def job_store_from_args(args_namespace):
+    """
+    Returns the process wide JobStore configured in args_namespace, or None if jobs are not recorded.
+    """
+    db_file = getattr(args_namespace, 'job_db', None)
+    if not db_file:
+        return None
+    db_file = os.path.abspath(os.path.expanduser(db_file))
+    with _job_stores_lock:
+        job_store = _job_stores.get(db_file)
+        if job_store is None:
+            job_store = JobStore(db_file)
+            _job_stores[db_file] = job_store
+        return job_store
+
+
+def resumable_jobs_from_args(args_namespace):
+    """
+    Returns the unfinished jobs recorded in the JobStore configured in args_namespace, if resuming is requested.
+    """
+    job_store = job_store_from_args(args_namespace)
+    if job_store is None or not getattr(args_namespace, 'resume', False):
+        return []
+    return job_store.jobs(unfinished_only=True)
@@ -0,0 +1,270 @@
+# resolves title, duration, formats and download size of videos ahead of their download, in batches
+
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import yt2mp3_utils
+import yt2mp3_tools
+import yt2mp3_engine
+
+
+# the fields kept of each available format
+FORMAT_FIELDS = ['format_id', 'ext', 'acodec', 'abr', 'filesize']
+
+
+def compact_metadata(info, format_selector):
+    """
+    Reduces the youtube-dl info dict of a video to what yt2mp3 uses.
+    With a single format selected, youtube-dl describes it in the top level fields of info.
+
+    Returns:
+    --------
+    dict with the keys id, selector, title, duration, uploader, format_id, ext, filesize (bytes of the selected format,
+    possibly estimated), formats (list of dicts with the keys FORMAT_FIELDS) and fetched (time stamp)
+    """
+    formats = [{field: format_info.get(field) for field in FORMAT_FIELDS} for format_info in info.get('formats') or []]
+    selected = info.get('requested_formats') or [info]
+    sizes = [format_info.get('filesize') or format_info.get('filesize_approx') for format_info in selected]
+    return {'id': info['id'],
+            'selector': format_selector,
+            'title': info.get('title'),
+            'duration': info.get('duration'),
+            'uploader': info.get('uploader'),
+            'format_id': info.get('format_id'),
+            'ext': info.get('ext'),
+            'filesize': sum(sizes) if sizes and all(sizes) else None,
+            'formats': formats,
+            'fetched': time.time()}
+
+
+def fetch_metadata(video_urls, format_selector, engine=None):
+    """
+    Resolves the metadata of several videos without downloading them, in a single youtube-dl call.
+    Videos which can not be resolved are left out.
+
+    Parameters:
+    -----------
+    video_urls: list - youtube video urls or ids
+
+    format_selector: str - the youtube-dl format selector the videos are going to be downloaded with
+
+    engine: yt2mp3_engine.YoutubeDLEngine - (optional) resolve in-process instead of starting a youtube-dl process
+
+    Returns:
+    --------
+    dict video id -> compact_metadata
+    """
+    if engine is not None:
+        infos = [engine.extract_metadata(video_url, format_selector) for video_url in video_urls]
+    else:
+        cmd = ['youtube-dl',
+               '--ignore-errors',
+               '--skip-download',
+               '--dump-json',
+               '--format', format_selector
+               ] + list(video_urls)
+        # unresolvable videos make youtube-dl exit with an error after it has dumped all others
+        proc = subprocess.run(yt2mp3_tools.resolve(cmd), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True)
+        infos = [json.loads(line) for line in proc.stdout.splitlines() if line.strip()]
+    return {info['id']: compact_metadata(info, format_selector) for info in infos if info}
+
+
+class MetadataCache(object):
+    """
+    Metadata of videos by video ID and format selector, kept in memory and,
+    if a file is given, appended to a JSON-lines file for later processes.
+    Entries older than max_age_seconds are refetched, since videos may be edited or removed.
+    """
+
+    def __init__(self, cache_file=None, max_age_seconds=7 * 24 * 3600):
+        """
+        Parameters:
+        -----------
+
+        cache_file: str - (optional) the JSON-lines file persisting the cache. created if missing
+
+        max_age_seconds: float - (optional) the time after which entries expire
+        """
+        self.cache_file = cache_file
+        self.max_age_seconds = max_age_seconds
+        self.lock = threading.Lock()
+        self.entries = {}       # (video id, format selector) -> compact_metadata
+        self.latest = {}        # video id -> the most recently fetched compact_metadata for any format selector
+        if cache_file is not None and os.path.isfile(cache_file):
+            self._load()
+
+    def _load(self):
+        n_lines = 0
+        with open(self.cache_file, 'rt') as f:
+            for line in f:
+                n_lines += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue    # cut off by a crash
+                if not self._expired(entry):
+                    self.entries[(entry['id'], entry['selector'])] = entry
+                    self.latest[entry['id']] = entry
+        if n_lines > 2 * len(self.entries) + 100:
+            # drop expired and replaced entries
+            tmp_file_name = self.cache_file + '.tmp'
+            with open(tmp_file_name, 'wt') as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry) + '\n')
+            os.replace(tmp_file_name, self.cache_file)
+
+    def _expired(self, entry):
+        return time.time() - entry['fetched'] > self.max_age_seconds
+
+    def get(self, video_url, format_selector):
+        """
+        Returns the cached compact_metadata of the video, or None
+        """
+        with self.lock:
+            entry = self.entries.get((yt2mp3_utils.video_id(video_url), format_selector))
+        return None if entry is None or self._expired(entry) else entry
+
+    def get_any(self, video_url):
+        """
+        Returns the cached compact_metadata of the video for any format selector, or None
+        """
+        with self.lock:
+            return self.latest.get(yt2mp3_utils.video_id(video_url))
+
+    def put(self, entries):
+        """
+        Adds a list of compact_metadata
+        """
+        with self.lock:
+            for entry in entries:
+                self.entries[(entry['id'], entry['selector'])] = entry
+                self.latest[entry['id']] = entry
+            if self.cache_file is not None and entries:
+                with open(self.cache_file, 'at') as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry) + '\n')
+
+
+class MetadataPrefetcher(object):
+    """
+    Resolves the metadata of submitted videos in the background: videos submitted within batch_delay seconds
+    are resolved together, in batches of up to batch_size videos per youtube-dl call, and up to n_workers calls at once.
+    """
+
+    def __init__(self, cache, n_workers=2, batch_size=20, batch_delay=0.2, engine=None):
+        """
+        Parameters:
+        -----------
+
+        cache: MetadataCache - consulted before and populated after fetching
+
+        n_workers: int - (optional) the number of concurrent youtube-dl calls
+
+        batch_size: int - (optional) the maximum number of videos resolved per youtube-dl call
+
+        batch_delay: float - (optional) the time in seconds to wait for further submissions before starting a batch
+
+        engine: yt2mp3_engine.YoutubeDLEngine - (optional) resolve in-process instead of starting youtube-dl processes
+        """
+        self.cache = cache
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.engine = engine
+        self.executor = ThreadPoolExecutor(max_workers=max(1, n_workers), thread_name_prefix='Metadata Prefetch')
+        self.condition = threading.Condition()
+        self.pending = []       # (video url, format selector, callback)
+        self.is_stopped = False
+        self.thread = threading.Thread(target=self._run, name='Metadata Prefetcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, video_url, format_selector, callback):
+        """
+        Requests the metadata of a video. callback is called with its compact_metadata, or None if it could not
+        be resolved: right away if cached, and from a worker thread otherwise.
+        """
+        entry = self.cache.get(video_url, format_selector)
+        if entry is not None:
+            callback(entry)
+            return
+        with self.condition:
+            self.pending.append((video_url, format_selector, callback))
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.is_stopped:
+                    self.condition.wait()
+                if self.is_stopped:
+                    return
+            # let a burst of submissions (e.g. a whole batch of jobs) accumulate
+            time.sleep(self.batch_delay)
+            with self.condition:
+                if self.is_stopped:
+                    return
+                pending, self.pending = self.pending, []
+            by_selector = {}
+            for request in pending:
+                by_selector.setdefault(request[1], []).append(request)
+            for format_selector, requests in by_selector.items():
+                for i in range(0, len(requests), self.batch_size):
+                    self.executor.submit(self._fetch_batch, format_selector, requests[i:i + self.batch_size])
+
+    def _fetch_batch(self, format_selector, requests):
+        video_urls = list(dict.fromkeys(video_url for video_url, _, _ in requests))
+        try:
+            entries = fetch_metadata(video_urls, format_selector, self.engine)
+        except Exception as e:
+            print('[yt2mp3] Metadata prefetch failed: {}'.format(e))
+            entries = {}
+        self.cache.put(list(entries.values()))
+        for video_url, _, callback in requests:
+            callback(entries.get(yt2mp3_utils.video_id(video_url)))
+
+    def stop(self):
+        """
+        Stops resolving submitted videos. Batches already running are finished in the background.
+        """
+        with self.condition:
+            self.is_stopped = True
+            self.condition.notify()
+        # the executor refuses submissions once shut down, so the submitting thread has to be gone first
+        self.thread.join()
+        self.executor.shutdown(wait=False)
+
+
+# one metadata cache per cache file and process
+_metadata_caches = {}
+_metadata_caches_lock = threading.Lock()
+
+
+def metadata_cache_from_args(args_namespace):
+    """
+    Returns the process wide MetadataCache, persisted in the CACHE_DIR configured in args_namespace (if any)
+    """
+    cache_dir = getattr(args_namespace, 'cache_dir', None)
+    cache_file = os.path.join(os.path.abspath(os.path.expanduser(cache_dir)), 'metadata.jsonl') if cache_dir else None
+    with _metadata_caches_lock:
+        cache = _metadata_caches.get(cache_file)
+        if cache is None:
+            if cache_file is not None:
+                yt2mp3_utils.ensure_dir_exists(os.path.dirname(cache_file))
+            cache = MetadataCache(cache_file)
+            _metadata_caches[cache_file] = cache
+        return cache
+
+
+def prefetcher_from_args(args_namespace):
+    """
+    Creates a MetadataPrefetcher if metadata prefetching is enabled in args_namespace, or returns None
+    """
+    if not getattr(args_namespace, 'prefetch_metadata', False):
+        return None
+    return MetadataPrefetcher(metadata_cache_from_args(args_namespace),
+                              n_workers=max(1, getattr(args_namespace, 'download_jobs', 2) // 2),
+                              engine=yt2mp3_engine.engine_from_args(args_namespace))
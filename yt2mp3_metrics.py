@@ -0,0 +1,203 @@
+# per job timings, byte counts and exit codes, exported as JSON-lines event log and Prometheus textfile
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import yt2mp3_pipeline
+
+
+def path_size(path):
+    """
+    Returns the size of a file, or the summed size of all files in a directory, in bytes. None for missing paths.
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, file_name))
+               for root, _, file_names in os.walk(path) for file_name in file_names)
+
+
+class JobMetrics(object):
+    """
+    Collects the timings and output sizes of the steps of a single job, e.g. download_video or video_to_mp3.
+    Thread safe, since the steps of a job may run in different threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.steps = []
+
+    @contextmanager
+    def step(self, name):
+        """
+        Times the enclosed block as step name. The yielded step record takes the produced file or directory
+        as its output attribute, whose size is recorded once the block has ended.
+        """
+        record = StepRecord(name)
+        t_start = time.time()
+        try:
+            yield record
+        except BaseException:
+            record.ok = False
+            raise
+        finally:
+            entry = {'step': name,
+                     'seconds': time.time() - t_start,
+                     'bytes': path_size(record.output),
+                     'ok': record.ok}
+            with self.lock:
+                self.steps.append(entry)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.steps)
+
+
+class StepRecord(object):
+    def __init__(self, name):
+        self.name = name
+        self.output = None
+        self.ok = True
+
+
+class MetricsExporter(object):
+    """
+    Writes an event per job stage change and a summary per finished job to a JSON-lines event log,
+    and keeps running totals in a Prometheus textfile collector file, rewritten after each finished job.
+    """
+
+    def __init__(self, events_file=None, prometheus_file=None):
+        """
+        Parameters:
+        -----------
+
+        events_file: str - (optional) the JSON-lines event log, appended to
+
+        prometheus_file: str - (optional) the Prometheus textfile, e.g. /var/lib/node_exporter/yt2mp3.prom
+        """
+        self.events_file = events_file
+        self.prometheus_file = prometheus_file
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)      # (metric name, sorted label items) -> value
+
+    def _write_event(self, event):
+        # NOTE: caller holds the lock
+        if self.events_file is not None:
+            with open(self.events_file, 'at') as f:
+                f.write(json.dumps(event) + '\n')
+
+    def stage_changed(self, job, stage):
+        """
+        Logs a stage change of a yt2mp3_pipeline.PipelineJob
+        """
+        with self.lock:
+            self._write_event({'event': 'stage', 'time': job.timestamps[stage], 'job': job.job_id,
+                               'video': job.state.args.video[0], 'stage': stage})
+
+    def job_finished(self, job, exit_codes, error=None):
+        """
+        Logs the summary of a finished yt2mp3_pipeline.PipelineJob and updates the Prometheus totals.
+
+        Parameters:
+        -----------
+
+        job: yt2mp3_pipeline.PipelineJob - the finished job
+
+        exit_codes: list - (tool, exit code) of each child process of the job
+
+        error: str - (optional) why the job failed, if so
+        """
+        summary = job_summary(job, exit_codes, error)
+        with self.lock:
+            self._write_event(summary)
+            self._count('yt2mp3_jobs_total', 1, result='failed' if error else 'succeeded')
+            self._count('yt2mp3_job_seconds_total', summary['seconds'] or 0)
+            for queue_name, seconds in summary['queue_wait'].items():
+                if seconds is not None:
+                    self._count('yt2mp3_queue_wait_seconds_total', seconds, queue=queue_name)
+            for step in summary['steps']:
+                self._count('yt2mp3_step_seconds_total', step['seconds'], step=step['step'])
+                self._count('yt2mp3_steps_total', 1, step=step['step'], ok=str(step['ok']).lower())
+                if step['bytes'] is not None:
+                    self._count('yt2mp3_step_bytes_total', step['bytes'], step=step['step'])
+            for tool, exit_code in exit_codes:
+                self._count('yt2mp3_subprocess_exits_total', 1, tool=tool, code=str(exit_code))
+            self._write_prometheus_file()
+
+    def _count(self, name, value, **labels):
+        # NOTE: caller holds the lock
+        self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def _write_prometheus_file(self):
+        # NOTE: caller holds the lock
+        if self.prometheus_file is None:
+            return
+        lines = []
+        last_name = None
+        for (name, labels), value in sorted(self.counters.items()):
+            if name != last_name:
+                lines.append('# TYPE {} counter'.format(name))
+                last_name = name
+            label_string = ','.join('{}="{}"'.format(key, str(label).replace('\\', '\\\\').replace('"', '\\"'))
+                                    for key, label in labels)
+            lines.append('{}{} {}'.format(name, '{' + label_string + '}' if label_string else '', repr(float(value))))
+        # the collector must never read a partially written file
+        tmp_file_name = self.prometheus_file + '.tmp'
+        with open(tmp_file_name, 'wt') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_file_name, self.prometheus_file)
+
+
+def job_summary(job, exit_codes, error=None):
+    """
+    Returns the JSON serializable summary of a finished yt2mp3_pipeline.PipelineJob:
+    its stage timestamps, the time spent waiting in the download and transcode queues,
+    the timing and output size of each step and the exit codes of its child processes.
+    """
+    timestamps = job.timestamps
+    stages = yt2mp3_pipeline.PipelineJob
+
+    def interval(start, end):
+        if start in timestamps and end in timestamps:
+            return timestamps[end] - timestamps[start]
+        return None
+
+    return {'event': 'job',
+            'time': timestamps.get(stages.STAGE_DONE, time.time()),
+            'job': job.job_id,
+            'video': job.state.args.video[0],
+            'result': job.state.output_destination if error is None else None,
+            'error': error,
+            'seconds': interval(stages.STAGE_QUEUED, stages.STAGE_DONE),
+            'queue_wait': {'download': interval(stages.STAGE_QUEUED, stages.STAGE_DOWNLOADING),
+                           'transcode': interval(stages.STAGE_DOWNLOADED, stages.STAGE_TRANSCODING)},
+            'stages': timestamps,
+            'steps': job.state.metrics.snapshot(),
+            'exit_codes': [{'tool': tool, 'code': code} for tool, code in exit_codes]}
+
+
+# one exporter per pair of files and process
+_exporters = {}
+_exporters_lock = threading.Lock()
+
+
+def exporter_from_args(args_namespace):
+    """
+    Returns the process wide MetricsExporter configured in args_namespace, or None if no metrics are exported.
+    """
+    events_file = getattr(args_namespace, 'events_file', None)
+    prometheus_file = getattr(args_namespace, 'prometheus_file', None)
+    if not events_file and not prometheus_file:
+        return None
+    key = tuple(os.path.abspath(f) if f else None for f in [events_file, prometheus_file])
+    with _exporters_lock:
+        exporter = _exporters.get(key)
+        if exporter is None:
+            exporter = MetricsExporter(*key)
+            _exporters[key] = exporter
+        return exporter
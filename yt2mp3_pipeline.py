@@ -0,0 +1,837 @@
+# pipelined, stage-aware job execution
+
+import argparse
+import collections
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+import yt2mp3_utils
+import yt2mp3_cache
+import yt2mp3_progress
+import yt2mp3_bandwidth
+import yt2mp3_metrics
+import yt2mp3_engine
+import yt2mp3_metadata
+import yt2mp3_postprocess
+import yt2mp3_silence
+
+
+def new_job_state(args_namespace):
+    """
+    Creates the container for all paths produced and consumed by the stages of a single job,
+    for the video's metadata once prefetched (see yt2mp3_metadata.compact_metadata)
+    and for the timings of its steps (see yt2mp3_metrics.JobMetrics).
+
+    Parameters:
+    -----------
+
+    args_namespace: argparse.Namespace - the options for a single video conversion call
+
+    Returns:
+    --------
+
+    argparse.Namespace object as a job state container
+    """
+    return argparse.Namespace(args=args_namespace,
+                              download_dir=None,
+                              archive_file=None,
+                              video_file=None,
+                              stream_file_name=None,
+                              encoded_cached=False,
+                              mp3_file=None,
+                              tmp_mp3_file=None,
+                              output_destination=None,
+                              cut_points=None,
+                              metadata=None,
+                              metrics=yt2mp3_metrics.JobMetrics())
+
+
+def is_silence_aware(args_namespace):
+    """
+    Are segments to end in quiet passages? Falls back to segments of equal length if numpy is not installed.
+    """
+    return args_namespace.segment_length is not None and getattr(args_namespace, 'silence_aware', False) \
+        and yt2mp3_silence.is_available()
+
+
+def output_format_of(args_namespace):
+    """
+    Returns the output format selected in args_namespace, see yt2mp3_utils.OUTPUT_FORMATS
+    """
+    return getattr(args_namespace, 'output_format', None) or yt2mp3_utils.DEFAULT_OUTPUT_FORMAT
+
+
+def encoding_key_of(args_namespace):
+    """
+    Returns the yt2mp3_utils.encoding_key of the output format and post-processing selected in args_namespace
+    """
+    return yt2mp3_utils.encoding_key(output_format_of(args_namespace),
+                                     yt2mp3_postprocess.settings_key(yt2mp3_postprocess.settings_from_args(args_namespace)))
+
+
+def download_stage(job_state, process_watcher=None, progress=None):
+    """
+    Network-bound stage: downloads the first video given in job_state.args.
+    In streaming mode, only checks whether the media can be streamed instead.
+    Previously downloaded media is taken from the media cache, if configured.
+    Nothing is downloaded at all if the encoded mp3 is cached already.
+
+    Parameters:
+    -----------
+
+    job_state: argparse.Namespace - the job state as created by new_job_state
+
+    process_watcher: object - (optional) some object instance containing a field child_processes
+        of type list expecting a registration of child processes.
+
+    progress: yt2mp3_progress.JobProgress - (optional) receives the download rate allotted to the job
+    """
+    video_url = job_state.args.video[0]
+    vid = yt2mp3_utils.video_id(video_url)
+    output_format = output_format_of(job_state.args)
+    download_format = yt2mp3_utils.download_format(output_format)
+    encoded_cache = yt2mp3_cache.encoded_cache_from_args(job_state.args)
+    if encoded_cache is not None and encoded_cache.contains_encoded(vid, download_format, encoding_key_of(job_state.args)):
+        # transcode_stage checks out the cached mp3. the source media is not needed.
+        job_state.encoded_cached = True
+        return
+
+    media_cache = yt2mp3_cache.media_cache_from_args(job_state.args)
+    cached = media_cache is not None and media_cache.contains_media(vid, download_format)
+    postprocess_settings = yt2mp3_postprocess.settings_from_args(job_state.args)
+    # trimming and loudness normalization measure the whole source before encoding it
+    if getattr(job_state.args, 'stream', False) and not cached and not yt2mp3_postprocess.needs_measurements(postprocess_settings):
+        # prefetched metadata spares asking youtube-dl, which would delay the start of the stream
+        metadata = job_state.metadata
+        if (metadata is None or metadata['selector'] != download_format) and getattr(job_state.args, 'prefetch_metadata', False):
+            metadata = yt2mp3_metadata.metadata_cache_from_args(job_state.args).get(video_url, download_format)
+        job_state.download_dir, file_name = yt2mp3_utils.probe_download_file_name(video_url, output_format,
+                                                                                  yt2mp3_engine.engine_from_args(job_state.args),
+                                                                                  metadata)
+        if yt2mp3_utils.is_streamable(file_name):
+            # nothing to download ahead of time. transcode_stage streams the media straight into ffmpeg
+            job_state.stream_file_name = file_name
+            return
+        print('[yt2mp3] Format of "{}" can not be streamed. Falling back to downloading the file first'.format(file_name))
+
+    with job_state.metrics.step('download_video') as step:
+        job_state.download_dir, job_state.archive_file = yt2mp3_utils.download_video(
+            video_url, process_watcher, media_cache, output_format,
+            yt2mp3_bandwidth.budget_from_args(job_state.args),
+            yt2mp3_bandwidth.parse_rate(getattr(job_state.args, 'job_rate_limit', None)),
+            progress.set_rate_limit if progress is not None else None,
+            yt2mp3_engine.engine_from_args(job_state.args))
+        step.output = job_state.download_dir
+
+
+def transcode_stage(job_state, process_watcher=None, encoded_callback=None, progress=None):
+    """
+    CPU-bound stage: converts the download to mp3 (or the selected output format)
+    and moves or splits it to the output destination.
+    Streamed jobs download and convert here at the same time.
+    Encoded mp3 files are taken from and added to the encoded cache, if configured.
+    If job_state.mp3_file exists already, e.g. for resumed jobs, only the output is written.
+
+    Parameters:
+    -----------
+
+    job_state: argparse.Namespace - the job state as created by new_job_state, after download_stage
+
+    process_watcher: object - (optional) some object instance containing a field child_processes
+        of type list expecting a registration of child processes.
+
+    encoded_callback: callable - (optional) called without arguments once the full length output file job_state.mp3_file exists
+
+    progress: yt2mp3_progress.JobProgress - (optional) see download_stage
+    """
+    if job_state.mp3_file is not None and os.path.isfile(job_state.mp3_file):
+        output_mp3(job_state, process_watcher)
+        return
+
+    args_namespace = job_state.args
+    vid = yt2mp3_utils.video_id(args_namespace.video[0])
+    output_format = output_format_of(args_namespace)
+    download_format = yt2mp3_utils.download_format(output_format)
+    encoded_cache = yt2mp3_cache.encoded_cache_from_args(args_namespace)
+    postprocessor = yt2mp3_postprocess.postprocessor_from_args(args_namespace, args_namespace.video[0], download_format)
+
+    if job_state.encoded_cached:
+        job_state.download_dir = yt2mp3_utils.download_dir_for(args_namespace.video[0])
+        yt2mp3_utils.ensure_dir_exists(job_state.download_dir)
+        with job_state.metrics.step('checkout_encoded') as step:
+            job_state.mp3_file = step.output = encoded_cache.checkout_encoded(vid, download_format, encoding_key_of(args_namespace),
+                                                                              job_state.download_dir)
+        if job_state.mp3_file is not None:
+            print('[yt2mp3] Using cached {} file "{}"'.format(output_format, job_state.mp3_file))
+            if encoded_callback:
+                encoded_callback()
+            output_mp3(job_state, process_watcher)
+            return
+        # evicted since download_stage has checked. catch up on the download.
+        job_state.encoded_cached = False
+        download_stage(job_state, process_watcher, progress)
+
+    if job_state.stream_file_name is not None:
+        stream_to_output(job_state, process_watcher, progress)
+        return
+
+    # post-processing, e.g. trimming or loudness normalization, applies to the audio as a whole
+    chunk_workers = 1 if postprocessor is not None else getattr(args_namespace, 'chunk_workers', 1) or 1
+    silence_aware = is_silence_aware(args_namespace)
+    if args_namespace.segment_length is not None and (getattr(args_namespace, 'single_pass', False) or chunk_workers > 1):
+        # decode once, write the segments straight to the output destination.
+        # in chunk-parallel mode, each segment is encoded by its own ffmpeg process.
+        # segments ending in quiet passages depend on the audio before them and are encoded one after the other
+        job_state.video_file = yt2mp3_utils.find_downloaded_file(job_state.download_dir, job_state.archive_file)
+        with job_state.metrics.step('determine_prepare_output'):
+            output_file_name = os.path.splitext(job_state.video_file)[0] + '.' + output_format
+            job_state.output_destination = yt2mp3_utils.determine_prepare_output(output_file_name,
+                                                                                 args_namespace.output,
+                                                                                 args_namespace.segment_length,
+                                                                                 output_format)
+        if silence_aware:
+            with job_state.metrics.step('encode_segments_at_quiet_passages') as step:
+                filter_args = postprocessor.filter_args(job_state.video_file, process_watcher) if postprocessor is not None else None
+                yt2mp3_utils.encode_segments_at_quiet_passages(job_state.video_file, job_state.output_destination,
+                                                               args_namespace.segment_length,
+                                                               args_namespace.segment_name,
+                                                               getattr(args_namespace, 'silence_window', None),
+                                                               process_watcher,
+                                                               output_format,
+                                                               filter_args)
+                step.output = job_state.output_destination
+        elif chunk_workers > 1:
+            with job_state.metrics.step('video_to_mp3_segments_chunked') as step:
+                yt2mp3_utils.video_to_mp3_segments_chunked(job_state.video_file, job_state.output_destination,
+                                                           args_namespace.segment_length,
+                                                           args_namespace.segment_name,
+                                                           chunk_workers,
+                                                           process_watcher,
+                                                           output_format)
+                step.output = job_state.output_destination
+        else:
+            with job_state.metrics.step('video_to_mp3_segments') as step:
+                yt2mp3_utils.video_to_mp3_segments(job_state.video_file, job_state.output_destination,
+                                                   args_namespace.segment_length,
+                                                   args_namespace.segment_name,
+                                                   process_watcher,
+                                                   output_format,
+                                                   postprocessor)
+                step.output = job_state.output_destination
+        return
+
+    if chunk_workers > 1:
+        with job_state.metrics.step('video_to_mp3_chunked') as step:
+            job_state.mp3_file, job_state.video_file, job_state.tmp_mp3_file = yt2mp3_utils.video_to_mp3_chunked(
+                job_state.download_dir, job_state.archive_file, chunk_workers, getattr(args_namespace, 'min_chunk_length', 300),
+                process_watcher, output_format)
+            step.output = job_state.mp3_file
+    else:
+        # the encode searches for quiet passages on the way, instead of decoding the encoded file once more
+        cut_point_finder = yt2mp3_silence.CutPointFinder(args_namespace.segment_length, getattr(args_namespace, 'silence_window', None)) \
+            if silence_aware else None
+        with job_state.metrics.step('video_to_mp3') as step:
+            job_state.mp3_file, job_state.video_file, job_state.tmp_mp3_file = yt2mp3_utils.video_to_mp3(job_state.download_dir,
+                                                                                                          job_state.archive_file,
+                                                                                                          process_watcher,
+                                                                                                          output_format,
+                                                                                                          postprocessor,
+                                                                                                          cut_point_finder)
+            step.output = job_state.mp3_file
+        if cut_point_finder is not None:
+            job_state.cut_points = cut_point_finder.finish()
+    if encoded_cache is not None:
+        with job_state.metrics.step('put_encoded'):
+            encoded_cache.put_encoded(vid, download_format, encoding_key_of(args_namespace), job_state.mp3_file)
+    if encoded_callback:
+        encoded_callback()
+    output_mp3(job_state, process_watcher)
+
+
+def stream_to_output(job_state, process_watcher=None, progress=None):
+    """
+    Streams the download straight into ffmpeg, writing the mp3 file or its segments.
+    The download takes part in the bandwidth budget at the fair share it gets when it starts.
+
+    Parameters:
+    -----------
+
+    job_state: argparse.Namespace - the job state, with stream_file_name set by download_stage
+
+    process_watcher: object - (optional) some object instance containing a field child_processes
+        of type list expecting a registration of child processes.
+
+    progress: yt2mp3_progress.JobProgress - (optional) see download_stage
+    """
+    args_namespace = job_state.args
+    output_format = output_format_of(args_namespace)
+    file_name_base = os.path.splitext(job_state.stream_file_name)[0]
+    # streams are only post-processed without measurements, i.e. with a tempo change at most. see download_stage
+    postprocess_settings = yt2mp3_postprocess.settings_from_args(args_namespace)
+    graph = yt2mp3_postprocess.filter_graph(postprocess_settings) if postprocess_settings is not None else None
+    filter_args = ['-af', graph] if graph else None
+    with job_state.metrics.step('determine_prepare_output'):
+        job_state.output_destination = yt2mp3_utils.determine_prepare_output('{}.{}'.format(file_name_base, output_format),
+                                                                             args_namespace.output,
+                                                                             args_namespace.segment_length,
+                                                                             output_format)
+    with yt2mp3_bandwidth.fixed_share_from_args(args_namespace) as rate:
+        if progress is not None:
+            progress.set_rate_limit(rate)
+        if args_namespace.segment_length is None:
+            job_state.tmp_mp3_file = yt2mp3_utils.output_file_names(job_state.stream_file_name, output_format)[1]
+            with job_state.metrics.step('stream_video_to_mp3') as step:
+                yt2mp3_utils.stream_video_to_mp3(args_namespace.video[0], job_state.tmp_mp3_file, None, process_watcher,
+                                                 output_format, filter_args, rate)
+                step.output = job_state.tmp_mp3_file
+            with job_state.metrics.step('move_download_to_output') as step:
+                yt2mp3_utils.move_download_to_output(job_state.tmp_mp3_file, job_state.output_destination)
+                step.output = job_state.output_destination
+        elif is_silence_aware(args_namespace):
+            with job_state.metrics.step('encode_segments_at_quiet_passages') as step:
+                download_proc = yt2mp3_utils.start_stream_download(args_namespace.video[0], output_format, process_watcher, rate)
+                yt2mp3_utils.encode_segments_at_quiet_passages('pipe:0', job_state.output_destination,
+                                                               args_namespace.segment_length,
+                                                               args_namespace.segment_name,
+                                                               getattr(args_namespace, 'silence_window', None),
+                                                               process_watcher,
+                                                               output_format,
+                                                               filter_args,
+                                                               stdin=download_proc.stdout)
+                download_proc.wait()
+                assert download_proc.returncode == 0, 'Streaming download failed for video "{}"'.format(args_namespace.video[0])
+                step.output = job_state.output_destination
+        else:
+            segment_pattern = yt2mp3_utils.segment_file_pattern(job_state.output_destination, args_namespace.segment_name,
+                                                                output_format)
+            with job_state.metrics.step('stream_video_to_mp3') as step:
+                yt2mp3_utils.stream_video_to_mp3(args_namespace.video[0], segment_pattern, args_namespace.segment_length,
+                                                 process_watcher, output_format, filter_args, rate)
+                step.output = job_state.output_destination
+
+
+def output_mp3(job_state, process_watcher=None):
+    """
+    Moves the full length output file job_state.mp3_file to the output destination, or splits it into segments there.
+
+    Parameters:
+    -----------
+
+    job_state: argparse.Namespace - the job state, with mp3_file set
+
+    process_watcher: object - (optional) some object instance containing a field child_processes
+        of type list expecting a registration of child processes.
+    """
+    args_namespace = job_state.args
+    output_format = output_format_of(args_namespace)
+    with job_state.metrics.step('determine_prepare_output'):
+        job_state.output_destination = yt2mp3_utils.determine_prepare_output(job_state.mp3_file,
+                                                                             args_namespace.output,
+                                                                             args_namespace.segment_length,
+                                                                             output_format)
+
+    if args_namespace.segment_length is None:
+        # no segments but single file: move output
+        with job_state.metrics.step('move_download_to_output') as step:
+            yt2mp3_utils.move_download_to_output(job_state.mp3_file, job_state.output_destination)
+            step.output = job_state.output_destination
+    else:
+        # split mp3 into segments
+        split_into_segments(job_state, job_state.mp3_file, process_watcher)
+
+
+def split_into_segments(job_state, mp3_file, process_watcher=None):
+    """
+    Splits the full length output file into segments in the output destination, in quiet passages if configured.
+
+    Parameters:
+    -----------
+
+    job_state: argparse.Namespace - the job state, with output_destination set
+
+    mp3_file: str - the full length output file. removed afterwards
+
+    process_watcher: object - (optional) some object instance containing a field child_processes
+        of type list expecting a registration of child processes.
+    """
+    args_namespace = job_state.args
+    with job_state.metrics.step('split_download_into_segments') as step:
+        yt2mp3_utils.split_download_into_segments(mp3_file, job_state.output_destination,
+                                                  args_namespace.segment_length,
+                                                  args_namespace.segment_name,
+                                                  process_watcher,
+                                                  output_format_of(args_namespace),
+                                                  getattr(args_namespace, 'silence_aware', False),
+                                                  getattr(args_namespace, 'silence_window', None),
+                                                  job_state.cut_points)
+        step.output = job_state.output_destination
+
+
+def restore_job_state(job_state, stage, stored_state):
+    """
+    Restores the artifacts of the stages a job has completed before it has been interrupted, see yt2mp3_jobstore.
+
+    Parameters:
+    -----------
+
+    job_state: argparse.Namespace - a fresh job state as created by new_job_state
+
+    stage: str - the last stage the interrupted job has entered
+
+    stored_state: dict - the recorded fields of the interrupted job's state
+
+    Returns:
+    --------
+
+    True, if the download stage can be skipped
+    """
+    if stage == PipelineJob.STAGE_ENCODED and stored_state.get('mp3_file') and os.path.isfile(stored_state['mp3_file']):
+        for field, value in stored_state.items():
+            setattr(job_state, field, value)
+        return True
+
+    if stage in [PipelineJob.STAGE_DOWNLOADED, PipelineJob.STAGE_TRANSCODING, PipelineJob.STAGE_ENCODED]:
+        if stored_state.get('stream_file_name'):
+            # nothing has been downloaded. the stream restarts in transcode_stage
+            job_state.download_dir = stored_state.get('download_dir')
+            job_state.stream_file_name = stored_state['stream_file_name']
+            return True
+        if stored_state.get('encoded_cached'):
+            job_state.encoded_cached = True
+            return True
+        download_dir, archive_file = stored_state.get('download_dir'), stored_state.get('archive_file')
+        if download_dir and archive_file and os.path.isdir(download_dir) and os.path.isfile(archive_file):
+            yt2mp3_utils.remove_partial_outputs(download_dir)
+            job_state.download_dir, job_state.archive_file = download_dir, archive_file
+            return True
+
+    # start over, reusing the previous download directory
+    job_state.download_dir = stored_state.get('download_dir')
+    return False
+
+
+def cleanup_stage(job_state, keep_download=False):
+    """
+    Removes all temporary files of a job, whether it succeeded or not.
+
+    Parameters:
+    -----------
+
+    job_state: argparse.Namespace - the job state as created by new_job_state
+
+    keep_download: bool - (optional) keep the (partially) downloaded media of failed jobs,
+        to be adopted by the next job for the same video
+    """
+    with job_state.metrics.step('cleanup'):
+        yt2mp3_utils.cleanup(job_state.download_dir, job_state.archive_file, job_state.video_file, job_state.tmp_mp3_file,
+                             keep_download)
+
+
+class JobStoppedError(Exception):
+    """
+    Raised into a job's future if the job has been stopped between two stages.
+    """
+    pass
+
+
+class PipelineJob(object):
+    """
+    A single video conversion job travelling through the stages of a PipelineScheduler.
+    """
+
+    STAGE_QUEUED = 'queued'
+    STAGE_DOWNLOADING = 'downloading'
+    STAGE_DOWNLOADED = 'downloaded'
+    STAGE_TRANSCODING = 'transcoding'
+    STAGE_ENCODED = 'encoded'
+    STAGE_DONE = 'done'
+
+    def __init__(self, args_namespace, process_watcher=None, stage_callback=None, progress=None, job_store=None, job_id=None,
+                 metrics_exporter=None):
+        """
+        Parameters:
+        -----------
+
+        args_namespace: argparse.Namespace - the options for a single video conversion call
+
+        process_watcher: object - (optional) some object instance containing a field child_processes
+            of type list expecting a registration of child processes.
+
+        stage_callback: callable - (optional) called as stage_callback(job, stage) from the worker
+            thread whenever the job enters a new stage
+
+        progress: yt2mp3_progress.JobProgress - (optional) the job's progress metrics,
+            fed by whoever collects the output of the process_watcher's child processes
+
+        job_store: yt2mp3_jobstore.JobStore - (optional) records each stage the job enters
+
+        job_id: str - (optional) the ID of the job in the job_store. a new one is generated by default
+
+        metrics_exporter: yt2mp3_metrics.MetricsExporter - (optional) exports the job's stage changes and step timings
+        """
+        self.job_id = job_id or uuid.uuid4().hex
+        self.job_store = job_store
+        self.metrics_exporter = metrics_exporter
+        # the watcher may be shared between jobs. only its child processes registered from here on are the job's
+        self.first_child_process = len(process_watcher.child_processes) if process_watcher is not None else 0
+        self.skip_download = False
+        self.state = new_job_state(args_namespace)
+        self.progress = progress if progress is not None else yt2mp3_progress.JobProgress()
+        self.process_watcher = process_watcher
+        self.stage_callback = stage_callback
+        self.future = Future()
+        self.stopped = False
+        self.stage = None
+        self.timestamps = {}
+        self.set_stage(PipelineJob.STAGE_QUEUED)
+
+    def set_stage(self, stage):
+        self.stage = stage
+        self.timestamps[stage] = time.time()
+        self.progress.set_stage(stage)
+        if self.job_store is not None:
+            self.record()
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stage_changed(self, stage)
+        if self.stage_callback:
+            self.stage_callback(self, stage)
+
+    def record(self, result=None, error=None):
+        """
+        Records the job's current stage and state in its job_store.
+        Finished and encoded jobs are committed right away, since they must not be repeated after a crash.
+        """
+        self.job_store.record(self.job_id, self.state.args, self.stage, self.state, result, error,
+                              flush=self.stage in [PipelineJob.STAGE_ENCODED, PipelineJob.STAGE_DONE])
+
+    def set_metadata(self, metadata):
+        """
+        Receives the metadata of the job's video from a yt2mp3_metadata.MetadataPrefetcher. None if unresolvable.
+        """
+        if metadata is not None:
+            self.state.metadata = metadata
+            self.progress.set_expected(metadata['duration'], metadata['filesize'])
+
+    def exit_codes(self):
+        """
+        Returns (tool, exit code) of each child process the job has registered with its process_watcher.
+        Processes still running have an exit code of None.
+        """
+        if self.process_watcher is None:
+            return []
+        return [(os.path.basename(process.args[0]), process.poll())
+                for process in self.process_watcher.child_processes[self.first_child_process:]]
+
+    def stop(self):
+        """
+        Marks the job as stopped. Queued jobs are cancelled, running jobs end after their current stage.
+        Killing already running child processes is up to the process_watcher.
+        """
+        self.stopped = True
+        self.future.cancel()
+
+    def check_stopped(self):
+        if self.stopped:
+            raise JobStoppedError('Job for video "{}" has been stopped'.format(self.state.args.video[0]))
+
+
+def scheduler_from_args(args_namespace, job_store=None):
+    """
+    Creates the PipelineScheduler configured by the command line arguments.
+    With adaptive concurrency, the pools are prepared to grow up to their configured maximum.
+    """
+    adaptive = getattr(args_namespace, 'adaptive_concurrency', False)
+    return PipelineScheduler(args_namespace.download_jobs, args_namespace.jobs, args_namespace.queue_size, job_store,
+                             args_namespace.max_download_jobs if adaptive else None,
+                             args_namespace.max_jobs if adaptive else None,
+                             yt2mp3_metrics.exporter_from_args(args_namespace),
+                             yt2mp3_metadata.prefetcher_from_args(args_namespace))
+
+
+class WorkerLimit(object):
+    """
+    Limits the number of concurrently working threads of a pool, like a semaphore whose number of permits
+    can be changed at runtime. Lowering the limit lets the surplus workers finish their current job first.
+    Workers take a permit before dequeuing their next job and check it again once they got one (see recheck),
+    since the limit may have been lowered while they were waiting for the job.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.holding = collections.deque()  # workers which have dequeued a job and wait for the limit, in queue order
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            # workers holding a job go first, keeping the jobs in queue order
+            while self.active + len(self.holding) >= self.limit:
+                self.condition.wait()
+            self.active += 1
+
+    def recheck(self):
+        """
+        Called with a permit after dequeuing a job. Waits until the job is within the current limit.
+        """
+        with self.condition:
+            if self.active <= self.limit and not self.holding:
+                return
+            self.active -= 1
+            worker = object()
+            self.holding.append(worker)
+            self.condition.notify_all()
+            while self.active >= self.limit or self.holding[0] is not worker:
+                self.condition.wait()
+            self.holding.popleft()
+            self.active += 1
+            self.condition.notify_all()
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            # both acquire and recheck wait on the condition, for different conditions
+            self.condition.notify_all()
+
+    def set_limit(self, limit):
+        with self.condition:
+            self.limit = limit
+            self.condition.notify_all()
+
+
+class PipelineScheduler(object):
+    """
+    Runs jobs in two independently sized worker pools, one for the network-bound download stage
+    and one for the CPU-bound transcode stage, connected by a bounded queue.
+    This way video N+1 is downloaded while video N is encoded, and finished downloads
+    can not pile up arbitrarily while the encoders are busy.
+    """
+
+    def __init__(self, n_download_workers, n_transcode_workers, queue_size=None, job_store=None,
+                 max_download_workers=None, max_transcode_workers=None, metrics_exporter=None, metadata_prefetcher=None):
+        """
+        Parameters:
+        -----------
+
+        n_download_workers: int - number of concurrent downloads
+
+        n_transcode_workers: int - number of concurrent ffmpeg conversions
+
+        queue_size: int - (optional) the number of finished downloads allowed to wait for a transcode worker.
+            defaults to n_transcode_workers
+
+        job_store: yt2mp3_jobstore.JobStore - (optional) durably records all jobs, such that they can be resumed
+
+        max_download_workers: int - (optional) the maximum number of concurrent downloads set_worker_limits may allow.
+            defaults to n_download_workers
+
+        max_transcode_workers: int - (optional) the maximum number of concurrent conversions set_worker_limits may allow.
+            defaults to n_transcode_workers
+
+        metrics_exporter: yt2mp3_metrics.MetricsExporter - (optional) exports the stage timings of all jobs
+
+        metadata_prefetcher: yt2mp3_metadata.MetadataPrefetcher - (optional) resolves the metadata of submitted jobs
+            while they wait for a download worker
+        """
+        self.job_store = job_store
+        self.metrics_exporter = metrics_exporter
+        self.metadata_prefetcher = metadata_prefetcher
+        n_download_workers = max(1, n_download_workers)
+        n_transcode_workers = max(1, n_transcode_workers)
+        self.download_limit = WorkerLimit(n_download_workers)
+        self.transcode_limit = WorkerLimit(n_transcode_workers)
+        self.download_queue = queue.Queue()
+        self.transcode_queue = queue.Queue(maxsize=max(1, queue_size or n_transcode_workers))
+        self.lock = threading.Lock()
+        self.is_shut_down = False
+
+        # as many threads as may ever be allowed to work. the limits decide how many actually do
+        self.download_threads = [self._start_worker(self._download_worker, 'Download Worker {}'.format(i))
+                                 for i in range(max(n_download_workers, max_download_workers or 0))]
+        self.transcode_threads = [self._start_worker(self._transcode_worker, 'Transcode Worker {}'.format(i))
+                                  for i in range(max(n_transcode_workers, max_transcode_workers or 0))]
+        self.active_download_workers = len(self.download_threads)
+
+    @property
+    def n_download_workers(self):
+        return self.download_limit.limit
+
+    @property
+    def n_transcode_workers(self):
+        return self.transcode_limit.limit
+
+    def set_worker_limits(self, n_download_workers=None, n_transcode_workers=None):
+        """
+        Changes the number of concurrent downloads and/or conversions, within the number of worker threads.
+        """
+        if n_download_workers is not None:
+            self.download_limit.set_limit(min(max(1, n_download_workers), len(self.download_threads)))
+        if n_transcode_workers is not None:
+            self.transcode_limit.set_limit(min(max(1, n_transcode_workers), len(self.transcode_threads)))
+
+    def _start_worker(self, target, name):
+        worker = threading.Thread(target=target, name=name, daemon=True)
+        worker.start()
+        return worker
+
+    def submit(self, args_namespace, process_watcher=None, stage_callback=None, progress=None, resume_from=None):
+        """
+        Submits a job for a single video conversion.
+
+        Parameters:
+        -----------
+
+        args_namespace: argparse.Namespace - the options for a single video conversion call
+
+        process_watcher: object - (optional) some object instance containing a field child_processes
+            of type list expecting a registration of child processes.
+
+        stage_callback: callable - (optional) called as stage_callback(job, stage) whenever the job enters a new stage
+
+        progress: yt2mp3_progress.JobProgress - (optional) the job's progress metrics
+
+        resume_from: argparse.Namespace - (optional) a job recorded by yt2mp3_jobstore.JobStore.jobs which has been interrupted.
+            The job continues after its last completed stage, with its recorded options instead of args_namespace.
+
+        Returns:
+        --------
+
+        the PipelineJob. its future resolves to the job's output destination
+        """
+        assert not self.is_shut_down, 'Can not submit jobs to a scheduler which has been shut down'
+        if resume_from is None:
+            job = PipelineJob(args_namespace, process_watcher, stage_callback, progress, self.job_store,
+                              metrics_exporter=self.metrics_exporter)
+        else:
+            job = PipelineJob(resume_from.args, process_watcher, stage_callback, progress, self.job_store, resume_from.job_id,
+                              self.metrics_exporter)
+            job.skip_download = restore_job_state(job.state, resume_from.stage, resume_from.state)
+            resumed_stage = resume_from.stage if job.skip_download else PipelineJob.STAGE_QUEUED
+            print('[yt2mp3] Resuming job for video "{}" after stage "{}"'.format(resume_from.video, resumed_stage))
+        if self.metadata_prefetcher is not None:
+            self.metadata_prefetcher.submit(job.state.args.video[0],
+                                            yt2mp3_utils.download_format(output_format_of(job.state.args)),
+                                            job.set_metadata)
+        self.download_queue.put(job)
+        return job
+
+    def shutdown(self, wait=True):
+        """
+        Stops accepting jobs. Already submitted jobs are still processed.
+
+        Parameters:
+        -----------
+
+        wait: bool - block until all submitted jobs are done
+        """
+        self.is_shut_down = True
+        for _ in self.download_threads:
+            self.download_queue.put(None)
+        if wait:
+            for worker in self.download_threads + self.transcode_threads:
+                worker.join()
+
+    def _fail(self, job, exception):
+        try:
+            cleanup_stage(job.state, keep_download=True)
+        finally:
+            self._finish(job, error=str(exception) or type(exception).__name__)
+            job.future.set_exception(exception)
+
+    def _finish(self, job, result=None, error=None):
+        job.set_stage(PipelineJob.STAGE_DONE)
+        if job.job_store is not None:
+            # record the outcome along with the final stage
+            job.record(result, error)
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.job_finished(job, job.exit_codes(), error)
+
+    def _download_worker(self):
+        while True:
+            self.download_limit.acquire()
+            job = self.download_queue.get()
+            if job is None:
+                self.download_limit.release()
+                break
+            self.download_limit.recheck()
+            try:
+                job = self._download(job)
+            finally:
+                self.download_limit.release()
+            if job is not None:
+                # blocks if all transcode workers are busy and the queue is full
+                self.transcode_queue.put(job)
+
+        with self.lock:
+            self.active_download_workers -= 1
+            last_download_worker = self.active_download_workers == 0
+        if last_download_worker:
+            if self.metadata_prefetcher is not None:
+                # all downloads have started. their metadata is of no use anymore
+                self.metadata_prefetcher.stop()
+            for _ in self.transcode_threads:
+                self.transcode_queue.put(None)
+
+    def _download(self, job):
+        """
+        Runs the download stage of a job. Returns the job, if it is to be transcoded
+        """
+        if job.stopped or not job.future.set_running_or_notify_cancel():
+            if job.job_store is not None:
+                # stopped before it has started. not to be resumed.
+                job.stage = PipelineJob.STAGE_DONE
+                job.record(error='stopped')
+            return None
+        try:
+            if not job.skip_download:
+                self._check_disk_space(job)
+                job.set_stage(PipelineJob.STAGE_DOWNLOADING)
+                download_stage(job.state, job.process_watcher, job.progress)
+                job.check_stopped()
+            job.set_stage(PipelineJob.STAGE_DOWNLOADED)
+        except BaseException as e:
+            self._fail(job, e)
+            return None
+        return job
+
+    def _check_disk_space(self, job):
+        """
+        Warns if the expected download size of the job, once known, exceeds the free disk space
+        """
+        metadata = job.state.metadata
+        if metadata is None or not metadata['filesize']:
+            return
+        free_bytes = shutil.disk_usage('.').free
+        if free_bytes < metadata['filesize']:
+            print('[yt2mp3] Warning: "{}" needs {:.1f}MiB of disk space, but only {:.1f}MiB are free'.format(
+                metadata['title'], metadata['filesize'] / 1024**2, free_bytes / 1024**2))
+
+    def _transcode_worker(self):
+        while True:
+            self.transcode_limit.acquire()
+            job = self.transcode_queue.get()
+            if job is None:
+                self.transcode_limit.release()
+                break
+            self.transcode_limit.recheck()
+            try:
+                self._transcode(job)
+            finally:
+                self.transcode_limit.release()
+
+    def _transcode(self, job):
+        try:
+            job.check_stopped()
+            job.set_stage(PipelineJob.STAGE_TRANSCODING)
+            transcode_stage(job.state, job.process_watcher, lambda: job.set_stage(PipelineJob.STAGE_ENCODED), job.progress)
+            job.check_stopped()
+            cleanup_stage(job.state)
+        except BaseException as e:
+            self._fail(job, e)
+            return
+        self._finish(job, result=job.state.output_destination)
+        job.future.set_result(job.state.output_destination)
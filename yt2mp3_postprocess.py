@@ -0,0 +1,333 @@
+# folds audio post-processing (loudness normalization, tempo, silence trimming) into the encode as one ffmpeg filter graph
+
+import json
+import math
+import os
+import re
+import subprocess
+import threading
+
+import yt2mp3_utils
+import yt2mp3_tools
+
+
+# the default loudness target in LUFS, as recommended for podcasts
+DEFAULT_LOUDNESS = -16.
+# the true peak and loudness range targets of the normalization
+TRUE_PEAK = -1.5
+LOUDNESS_RANGE = 11.
+# leading and trailing audio quieter than this for at least SILENCE_DURATION seconds is trimmed
+SILENCE_THRESHOLD = '-50dB'
+SILENCE_DURATION = 0.5
+# the silence kept at either end when trimming, so speech does not start or end abruptly
+TRIM_PADDING = 0.25
+# the range of tempo factors a single atempo filter accepts in all ffmpeg versions
+ATEMPO_RANGE = (0.5, 2.0)
+# the sample rate of the output, since loudnorm resamples to 192 kHz internally
+DEFAULT_SAMPLE_RATE = 48000
+
+SILENCE_START_PATTERN = re.compile(r'silence_start: (?P<time>-?[\d.]+)')
+SILENCE_END_PATTERN = re.compile(r'silence_end: (?P<time>-?[\d.]+)')
+DURATION_PATTERN = re.compile(r'Duration: (?P<hours>\d+):(?P<minutes>\d+):(?P<seconds>[\d.]+)')
+SAMPLE_RATE_PATTERN = re.compile(r'Audio: .*?(?P<sample_rate>\d+) Hz')
+
+
+def settings_from_args(args_namespace):
+    """
+    Returns the post-processing configured in args_namespace as a dict with the keys loudnorm (target loudness in LUFS
+    or None), tempo (factor or None) and trim_silence (bool), or None if no post-processing is configured
+    """
+    loudnorm = getattr(args_namespace, 'loudnorm', False)
+    settings = {'loudnorm': getattr(args_namespace, 'loudness_target', DEFAULT_LOUDNESS) if loudnorm else None,
+                'tempo': getattr(args_namespace, 'tempo', None),
+                'trim_silence': getattr(args_namespace, 'trim_silence', False)}
+    if settings['tempo'] == 1:
+        settings['tempo'] = None
+    if settings['loudnorm'] is None and settings['tempo'] is None and not settings['trim_silence']:
+        return None
+    return settings
+
+
+def settings_key(settings):
+    """
+    Returns a list of strings identifying the post-processing settings, e.g. for use as part of a cache key
+    """
+    if settings is None:
+        return []
+    return ['{}={}'.format(key, value) for key, value in sorted(settings.items()) if value]
+
+
+def required_filters(settings):
+    """
+    Returns the names of the ffmpeg filters the post-processing settings rely on
+    """
+    if settings is None:
+        return []
+    filters = []
+    if settings['trim_silence']:
+        filters += ['silencedetect', 'atrim', 'asetpts']
+    if settings['tempo'] is not None:
+        filters += ['atempo']
+    if settings['loudnorm'] is not None:
+        filters += ['loudnorm', 'aresample']
+    return filters
+
+
+def needs_measurements(settings):
+    return settings is not None and (settings['loudnorm'] is not None or settings['trim_silence'])
+
+
+def measure_source(media_file_name, process_watcher=None):
+    """
+    Measures the loudness (like the first pass of a two-pass loudnorm) and the leading and trailing silence
+    of a media file, in a single decode.
+
+    Parameters:
+    -----------
+
+    media_file_name: str - path to the media file
+
+    process_watcher: object - (optional) some object instance containing a field child_processes of
+        type list expecting a registration of child processes.
+
+    Returns:
+    --------
+
+    dict with the keys input_i, input_tp, input_lra, input_thresh (the loudnorm measurements, as strings),
+    leading_silence_end and trailing_silence_start (in seconds, None if there is no such silence),
+    duration (in seconds) and sample_rate. None if the file could not be measured
+    """
+    cmd = ['ffmpeg',
+           '-nostdin',
+           '-hide_banner',
+           '-i', media_file_name,
+           '-vn',
+           '-af', 'silencedetect=noise={}:d={},loudnorm=print_format=json'.format(SILENCE_THRESHOLD, SILENCE_DURATION),
+           '-f', 'null',
+           '-'
+           ]
+    print('[yt2mp3] Measuring loudness and silence of "{}"'.format(media_file_name))
+    # the measurements are read from stderr. stdout stays unused, so process watchers do not read the process
+    proc = subprocess.Popen(yt2mp3_tools.resolve(cmd), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    if process_watcher is not None:
+        process_watcher.child_processes.append(proc)
+    output = proc.communicate()[1]
+    if proc.returncode != 0:
+        return None
+    return parse_measurements(output)
+
+
+def parse_measurements(output):
+    """
+    Extracts the measurements returned by measure_source from the ffmpeg output
+    """
+    json_end = output.rfind('}')
+    json_start = output.rfind('{', 0, json_end)
+    try:
+        loudness = json.loads(output[json_start:json_end + 1])
+    except ValueError:
+        return None
+    measurements = {key: loudness.get(key) for key in ['input_i', 'input_tp', 'input_lra', 'input_thresh']}
+
+    duration_match = DURATION_PATTERN.search(output)
+    duration = None
+    if duration_match:
+        duration = (int(duration_match.group('hours')) * 3600 + int(duration_match.group('minutes')) * 60
+                    + float(duration_match.group('seconds')))
+    sample_rate_match = SAMPLE_RATE_PATTERN.search(output)
+
+    starts = [float(match.group('time')) for match in SILENCE_START_PATTERN.finditer(output)]
+    ends = [float(match.group('time')) for match in SILENCE_END_PATTERN.finditer(output)]
+    leading_silence_end = ends[0] if starts and starts[0] <= 0.01 and ends else None
+    trailing_silence_start = None
+    if starts and (len(ends) < len(starts) or (duration is not None and ends[-1] >= duration - 0.05)):
+        # the last silence lasts until the end of the audio
+        trailing_silence_start = starts[-1]
+    if trailing_silence_start is not None and trailing_silence_start <= (leading_silence_end or 0):
+        # silence throughout
+        leading_silence_end = trailing_silence_start = None
+
+    measurements.update(leading_silence_end=leading_silence_end,
+                        trailing_silence_start=trailing_silence_start,
+                        duration=duration,
+                        sample_rate=int(sample_rate_match.group('sample_rate')) if sample_rate_match else None)
+    return measurements
+
+
+def atempo_chain(tempo):
+    """
+    Returns the atempo filters changing the tempo by the given factor, chained where it exceeds ATEMPO_RANGE
+    """
+    filters = []
+    while tempo > ATEMPO_RANGE[1]:
+        filters.append('atempo={}'.format(ATEMPO_RANGE[1]))
+        tempo /= ATEMPO_RANGE[1]
+    while tempo < ATEMPO_RANGE[0]:
+        filters.append('atempo={}'.format(ATEMPO_RANGE[0]))
+        tempo /= ATEMPO_RANGE[0]
+    filters.append('atempo={:.6g}'.format(tempo))
+    return filters
+
+
+def filter_graph(settings, measurements=None):
+    """
+    Builds the ffmpeg filter graph applying the post-processing settings: silence trimming, then the tempo change,
+    then loudness normalization with the measured loudness (the second pass of a two-pass loudnorm).
+    The loudness is measured on the untrimmed source at its original tempo: both affect neither the gated
+    integrated loudness nor the peaks noticeably.
+
+    Parameters:
+    -----------
+
+    settings: dict - see settings_from_args
+
+    measurements: dict - (optional) see measure_source. required for trimming and loudness normalization
+
+    Returns:
+    --------
+
+    the filter graph, or None if there is nothing to apply
+    """
+    filters = []
+    if settings['trim_silence'] and measurements is not None:
+        trim = []
+        if measurements['leading_silence_end'] is not None:
+            trim.append('start={:.3f}'.format(max(0., measurements['leading_silence_end'] - TRIM_PADDING)))
+        if measurements['trailing_silence_start'] is not None:
+            trim.append('end={:.3f}'.format(measurements['trailing_silence_start'] + TRIM_PADDING))
+        if trim:
+            filters += ['atrim=' + ':'.join(trim), 'asetpts=PTS-STARTPTS']
+    if settings['tempo'] is not None:
+        filters += atempo_chain(settings['tempo'])
+    if settings['loudnorm'] is not None and measurements is not None:
+        try:
+            measured = [float(measurements[key]) for key in ['input_i', 'input_tp', 'input_lra', 'input_thresh']]
+        except (TypeError, ValueError):
+            measured = []
+        if measured and all(math.isfinite(value) for value in measured):
+            filters.append('loudnorm=I={}:TP={}:LRA={}:measured_I={}:measured_TP={}:measured_LRA={}:measured_thresh={}'
+                           ':linear=true'.format(settings['loudnorm'], TRUE_PEAK, LOUDNESS_RANGE, *measured))
+            filters.append('aresample={}'.format(measurements['sample_rate'] or DEFAULT_SAMPLE_RATE))
+        else:
+            # e.g. digital silence throughout
+            print('[yt2mp3] Loudness could not be measured. Skipping loudness normalization')
+    return ','.join(filters) or None
+
+
+class MeasurementCache(object):
+    """
+    Measurements of source media (see measure_source) by video ID, download format and file size, kept in memory and,
+    if a file is given, appended to a JSON-lines file for later processes.
+    """
+
+    def __init__(self, cache_file=None):
+        """
+        Parameters:
+        -----------
+
+        cache_file: str - (optional) the JSON-lines file persisting the cache. created if missing
+        """
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+        self.entries = {}
+        if cache_file is not None and os.path.isfile(cache_file):
+            with open(cache_file, 'rt') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue    # cut off by a crash
+                    self.entries[entry['key']] = entry['measurements']
+
+    @staticmethod
+    def key(video_url, download_format, media_file_name):
+        return '{}/{}/{}'.format(yt2mp3_utils.video_id(video_url), download_format, os.path.getsize(media_file_name))
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def put(self, key, measurements):
+        with self.lock:
+            self.entries[key] = measurements
+            if self.cache_file is not None:
+                with open(self.cache_file, 'at') as f:
+                    f.write(json.dumps({'key': key, 'measurements': measurements}) + '\n')
+
+
+class PostProcessor(object):
+    """
+    Provides the filter graph post-processing the audio of one video, measuring the source media
+    only if its measurements are not cached yet
+    """
+
+    def __init__(self, settings, video_url, download_format, cache):
+        """
+        Parameters:
+        -----------
+
+        settings: dict - see settings_from_args
+
+        video_url: str - the youtube video url or id
+
+        download_format: str - the youtube-dl format selector the source media has been downloaded with
+
+        cache: MeasurementCache - the cache of source measurements
+        """
+        self.settings = settings
+        self.video_url = video_url
+        self.download_format = download_format
+        self.cache = cache
+
+    def filter_args(self, media_file_name, process_watcher=None):
+        """
+        Returns the ffmpeg arguments applying the post-processing to the audio of media_file_name,
+        an empty list if there is nothing to apply
+        """
+        measurements = None
+        if needs_measurements(self.settings):
+            key = MeasurementCache.key(self.video_url, self.download_format, media_file_name)
+            measurements = self.cache.get(key)
+            if measurements is None:
+                measurements = measure_source(media_file_name, process_watcher)
+                if measurements is None:
+                    print('[yt2mp3] Could not measure "{}". Skipping silence trimming and loudness normalization'.format(
+                        media_file_name))
+                else:
+                    self.cache.put(key, measurements)
+            else:
+                print('[yt2mp3] Using cached loudness and silence measurements of "{}"'.format(media_file_name))
+        graph = filter_graph(self.settings, measurements)
+        return ['-af', graph] if graph else []
+
+
+# one measurement cache per cache file and process
+_measurement_caches = {}
+_measurement_caches_lock = threading.Lock()
+
+
+def measurement_cache_from_args(args_namespace):
+    """
+    Returns the process wide MeasurementCache, persisted in the CACHE_DIR configured in args_namespace (if any)
+    """
+    cache_dir = getattr(args_namespace, 'cache_dir', None)
+    cache_file = os.path.join(os.path.abspath(os.path.expanduser(cache_dir)), 'measurements.jsonl') if cache_dir else None
+    with _measurement_caches_lock:
+        cache = _measurement_caches.get(cache_file)
+        if cache is None:
+            if cache_file is not None:
+                yt2mp3_utils.ensure_dir_exists(os.path.dirname(cache_file))
+            cache = MeasurementCache(cache_file)
+            _measurement_caches[cache_file] = cache
+        return cache
+
+
+def postprocessor_from_args(args_namespace, video_url, download_format):
+    """
+    Creates the PostProcessor of a video if post-processing is configured in args_namespace, or returns None
+    """
+    settings = settings_from_args(args_namespace)
+    if settings is None:
+        return None
+    return PostProcessor(settings, video_url, download_format, measurement_cache_from_args(args_namespace))
@@ -0,0 +1,289 @@
+# structured progress and throughput metrics, parsed from youtube-dl and ffmpeg output
+
+import re
+import threading
+import time
+from collections import deque
+
+
+# youtube-dl, e.g. "[download]  45.3% of ~12.34MiB at  1.23MiB/s ETA 00:12" or "[download] 100% of 12.34MiB in 00:10"
+DOWNLOAD_PATTERN = re.compile(r'\[download\]\s+(?P<percent>[\d.]+)% of\s+~?(?P<size>[\d.]+)(?P<size_unit>[KMGT]?i?B)'
+                              r'(?:\s+at\s+(?P<speed>[\d.]+)(?P<speed_unit>[KMGT]?i?B)/s)?'
+                              r'(?:\s+ETA\s+(?P<eta>[\d:]+))?')
+# ffmpeg input header, e.g. "  Duration: 01:02:03.45, start: 0.000000, bitrate: 128 kb/s"
+DURATION_PATTERN = re.compile(r'Duration:\s*(?P<time>\d+:\d+:[\d.]+)')
+# ffmpeg -progress output, e.g. "out_time_us=62340000" or "speed=25.3x"
+FFMPEG_PROGRESS_PATTERN = re.compile(r'^(?P<key>[a-z_0-9]+)=\s*(?P<value>\S*)\s*$')
+FFMPEG_PROGRESS_KEYS = ['frame', 'fps', 'stream_0_0_q', 'bitrate', 'total_size', 'out_time_us', 'out_time_ms', 'out_time',
+                        'dup_frames', 'drop_frames', 'speed', 'progress']
+
+# yt2mp3_pipeline.PipelineJob.STAGE_DOWNLOADING, whose size may be known before youtube-dl reports it
+DOWNLOAD_STAGE = 'downloading'
+
+UNIT_FACTORS = {'B': 1, 'KB': 1e3, 'MB': 1e6, 'GB': 1e9, 'TB': 1e12,
+                'KiB': 1024, 'MiB': 1024**2, 'GiB': 1024**3, 'TiB': 1024**4}
+
+
+def parse_time(time_string):
+    """
+    Parses [[HH:]MM:]SS[.fff] into seconds. Returns None for unparseable input, such as "N/A".
+    """
+    try:
+        seconds = 0.
+        for part in time_string.split(':'):
+            seconds = 60 * seconds + float(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+class JobProgress(object):
+    """
+    Progress and throughput metrics of a single job, fed line by line with the output of its child processes.
+    Thread safe: may be fed from one thread and read from any other.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage = None
+        self.stage_started = None
+        self.last_lines = deque(maxlen=20)      # the most recent human readable output lines, e.g. for error reports
+        self.expected_duration = None           # of the video, if known ahead of time. see yt2mp3_metadata
+        self.expected_bytes = None              # of the download, if known ahead of time
+        self._reset_stage_metrics()
+
+    def _reset_stage_metrics(self):
+        self.percent = None                     # of the current stage
+        self.bytes_per_second = None            # download speed, or output write rate while encoding
+        self.realtime_factor = None             # encoded media seconds per wall clock second
+        self.eta_seconds = None                 # of the current stage
+        self.rate_limit = None                  # download rate allotted to the job, see yt2mp3_bandwidth
+        self.total_bytes = None
+        self.processed_bytes = None
+        self.media_duration = None              # of the ffmpeg input
+        self.media_time = None                  # position of the encoder in the input
+        self._size_sample = None                # (time, bytes) for output rate estimation
+
+    def set_stage(self, stage):
+        with self.lock:
+            self.stage = stage
+            self.stage_started = time.time()
+            self._reset_stage_metrics()
+            if stage == DOWNLOAD_STAGE:
+                self.total_bytes = self.expected_bytes
+
+    def set_expected(self, duration, total_bytes):
+        """
+        Sets the video duration in seconds and the download size in bytes known ahead of time (either may be None),
+        such that progress can be estimated before, or without, youtube-dl and ffmpeg reporting them
+        """
+        with self.lock:
+            self.expected_duration = duration
+            self.expected_bytes = total_bytes
+            if self.total_bytes is None and self.stage == DOWNLOAD_STAGE:
+                self.total_bytes = total_bytes
+
+    def set_rate_limit(self, bytes_per_second):
+        with self.lock:
+            self.rate_limit = bytes_per_second
+
+    def feed(self, line):
+        """
+        Parses a single line of child process output.
+
+        Parameters:
+        -----------
+
+        line: str - a line of output. line terminators are ignored
+
+        Returns:
+        --------
+
+        True if the line has been machine readable progress information (i.e. ffmpeg -progress output)
+        not meant for display, False otherwise
+        """
+        line = line.strip()
+        if not line:
+            return False
+
+        match = FFMPEG_PROGRESS_PATTERN.match(line)
+        if match and match.group('key') in FFMPEG_PROGRESS_KEYS:
+            with self.lock:
+                self._feed_ffmpeg_progress(match.group('key'), match.group('value'))
+            return True
+
+        with self.lock:
+            self.last_lines.append(line)
+            match = DOWNLOAD_PATTERN.search(line)
+            if match:
+                self._feed_download_progress(match)
+                return False
+            match = DURATION_PATTERN.search(line)
+            if match:
+                self.media_duration = parse_time(match.group('time'))
+        return False
+
+    def _feed_download_progress(self, match):
+        # NOTE: caller holds the lock
+        self.percent = float(match.group('percent'))
+        self.total_bytes = float(match.group('size')) * UNIT_FACTORS.get(match.group('size_unit'), 1)
+        self.processed_bytes = self.total_bytes * self.percent / 100.
+        if match.group('speed'):
+            self.bytes_per_second = float(match.group('speed')) * UNIT_FACTORS.get(match.group('speed_unit'), 1)
+        if match.group('eta'):
+            self.eta_seconds = parse_time(match.group('eta'))
+        elif self.percent >= 100:
+            self.eta_seconds = 0
+
+    def _feed_ffmpeg_progress(self, key, value):
+        # NOTE: caller holds the lock
+        if key in ['out_time_us', 'out_time_ms']:
+            # both are given in microseconds by ffmpeg
+            try:
+                self.media_time = int(value) / 1e6
+            except ValueError:
+                pass
+        elif key == 'speed':
+            try:
+                self.realtime_factor = float(value.rstrip('x'))
+            except ValueError:
+                pass
+        elif key == 'total_size':
+            try:
+                processed_bytes = int(value)
+            except ValueError:
+                return
+            now = time.time()
+            if self._size_sample is not None and now > self._size_sample[0]:
+                self.bytes_per_second = (processed_bytes - self._size_sample[1]) / (now - self._size_sample[0])
+            self._size_sample = (now, processed_bytes)
+            self.processed_bytes = processed_bytes
+        elif key == 'progress':
+            # end of a progress block: derive percent and eta
+            if value == 'end':
+                self.percent = 100.
+                self.eta_seconds = 0
+            elif (self.media_duration or self.expected_duration) and self.media_time is not None:
+                # ffmpeg reports no duration for piped input, see yt2mp3_utils.stream_video_to_mp3
+                media_duration = self.media_duration or self.expected_duration
+                self.percent = min(100., 100. * self.media_time / media_duration)
+                if self.realtime_factor:
+                    self.eta_seconds = max(0., media_duration - self.media_time) / self.realtime_factor
+
+    def snapshot(self):
+        """
+        Returns a dict of the current metrics: stage, stage_seconds, percent, bytes_per_second, rate_limit,
+        realtime_factor, eta_seconds, processed_bytes and total_bytes. Unknown values are None.
+        """
+        with self.lock:
+            return {'stage': self.stage,
+                    'stage_seconds': None if self.stage_started is None else time.time() - self.stage_started,
+                    'percent': self.percent,
+                    'bytes_per_second': self.bytes_per_second,
+                    'rate_limit': self.rate_limit,
+                    'realtime_factor': self.realtime_factor,
+                    'eta_seconds': self.eta_seconds,
+                    'processed_bytes': self.processed_bytes,
+                    'total_bytes': self.total_bytes}
+
+
+def aggregate_progress(snapshots, n_queued=0, n_workers=1, mean_job_seconds=None):
+    """
+    Aggregates the progress snapshots of several running jobs.
+
+    Parameters:
+    -----------
+
+    snapshots: list - JobProgress.snapshot() dicts of all running jobs
+
+    n_queued: int - (optional) the number of jobs waiting to be run
+
+    n_workers: int - (optional) the number of jobs running concurrently
+
+    mean_job_seconds: float - (optional) the mean run time of finished jobs, for estimating the time of queued jobs
+
+    Returns:
+    --------
+
+    dict with bytes_per_second (summed over all jobs) and queue_eta_seconds (None if unknown)
+    """
+    bytes_per_second = sum(s['bytes_per_second'] or 0 for s in snapshots)
+    etas = [s['eta_seconds'] for s in snapshots if s['eta_seconds'] is not None]
+    queue_eta_seconds = max(etas) if etas else None
+    if n_queued:
+        if mean_job_seconds is None:
+            queue_eta_seconds = None
+        else:
+            queue_eta_seconds = (queue_eta_seconds or 0) + n_queued * mean_job_seconds / max(1, n_workers)
+    return {'bytes_per_second': bytes_per_second, 'queue_eta_seconds': queue_eta_seconds}
+
+
+def format_progress(snapshot):
+    """
+    Returns a short human readable summary of a progress snapshot
+    """
+    parts = [snapshot['stage'] or '?']
+    if snapshot['percent'] is not None:
+        parts.append('{:5.1f}%'.format(snapshot['percent']))
+    if snapshot['bytes_per_second'] and snapshot.get('rate_limit'):
+        # actual versus allotted download rate
+        parts.append('{:.2f}/{:.2f}MiB/s'.format(snapshot['bytes_per_second'] / 1024**2, snapshot['rate_limit'] / 1024**2))
+    elif snapshot['bytes_per_second']:
+        parts.append('{:.2f}MiB/s'.format(snapshot['bytes_per_second'] / 1024**2))
+    if snapshot['realtime_factor']:
+        parts.append('{:.1f}x'.format(snapshot['realtime_factor']))
+    if snapshot['eta_seconds'] is not None:
+        parts.append('ETA {:.0f}s'.format(snapshot['eta_seconds']))
+    return ' '.join(parts)
+
+
+class ProgressWatcher(object):
+    """
+    A process watcher (see yt2mp3_utils.start_process) for use without GUI:
+    reads the output of each registered child process in its own thread and feeds it into a JobProgress.
+    """
+
+    def __init__(self, progress, echo=False, line_callback=None):
+        """
+        Parameters:
+        -----------
+
+        progress: JobProgress - the metrics to feed
+
+        echo: bool - (optional) print human readable output lines to the console
+
+        line_callback: callable - (optional) called with every output line, including progress lines
+        """
+        self.progress = progress
+        self.echo = echo
+        self.line_callback = line_callback
+        self.child_processes = ChildProcessReaderList(self._read_output)
+
+    def _read_output(self, process):
+        # universal newlines mode ends lines at \r as well, so each progress update is a line of its own
+        for line in iter(process.stdout.readline, ''):
+            self.handle_output(line)
+
+    def handle_output(self, line):
+        """
+        Processes a single output line, of a child process or of work done in-process (see yt2mp3_engine)
+        """
+        if self.line_callback:
+            self.line_callback(line)
+        if not self.progress.feed(line) and self.echo and line.strip():
+            print(line.rstrip())
+
+
+class ChildProcessReaderList(list):
+    """
+    A list of child processes, starting a daemon reader thread for each appended process
+    """
+
+    def __init__(self, reader):
+        super().__init__()
+        self.reader = reader
+
+    def append(self, process):
+        super().append(process)
+        if process.stdout is not None:
+            threading.Thread(target=self.reader, args=(process,), daemon=True).start()
@@ -0,0 +1,336 @@
+# finds cut points in quiet passages near each segment boundary, streaming the decoded audio in bounded memory
+
+import io
+import subprocess
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import yt2mp3_tools
+
+
+# the audio is analysed downmixed to mono at this rate. enough to tell speech from pauses, and cheap to decode and scan
+SAMPLE_RATE = 8000
+# the length in seconds of the frames the energy is measured on
+FRAME_LENGTH = 0.02
+# the length in seconds of the moving average over frame energies, such that a pause has to last to be chosen
+SMOOTHING_LENGTH = 0.3
+# the penalty in dB for a cut point at the edge of the search window, relative to one right at the target length.
+# a pause this much louder than the loudest acceptable one is never preferred over a closer one
+DISTANCE_PENALTY_DB = 6.
+# the number of bytes of decoded audio read at once (10 seconds at SAMPLE_RATE, 16 bit mono)
+BLOCK_SIZE = 10 * SAMPLE_RATE * 2
+
+
+def is_available():
+    return numpy is not None
+
+
+def default_search_window(segment_length):
+    """
+    Returns the time in seconds before and after each target segment boundary searched for a pause
+    """
+    return min(30., segment_length / 10.)
+
+
+class CutPointFinder(object):
+    """
+    Chooses cut points for segments of about segment_length seconds from 16 bit PCM samples fed in blocks.
+    Each cut point is the quietest point within search_window seconds of the previous cut point plus segment_length,
+    weighed against its distance to that target. Only the frame energies of the current search window are kept,
+    so memory does not grow with the length of the audio.
+    """
+
+    def __init__(self, segment_length, search_window=None, sample_rate=SAMPLE_RATE):
+        """
+        Parameters:
+        -----------
+
+        segment_length: float - the target length of the segments in seconds
+
+        search_window: float - (optional) the time in seconds before and after each target searched for a pause.
+            capped at a quarter of the segment length, so successive search windows do not overlap
+
+        sample_rate: int - (optional) the sample rate of the fed samples
+        """
+        if search_window is None:
+            search_window = default_search_window(segment_length)
+        search_window = min(search_window, segment_length / 4.)
+        self.frame_size = int(sample_rate * FRAME_LENGTH)
+        self.segment_frames = int(round(segment_length / FRAME_LENGTH))
+        self.window_frames = max(1, int(round(search_window / FRAME_LENGTH)))
+        self.smoothing_frames = max(1, int(round(SMOOTHING_LENGTH / FRAME_LENGTH)))
+        self.sample_rate = sample_rate
+        self.carry = numpy.zeros(0, dtype=numpy.int16)     # the samples of an incomplete frame at the end of the last block
+        self.n_frames = 0                                   # the number of frames analysed so far
+        self.last_cut_frame = 0
+        self.window = []                                    # arrays of frame energies within the current search window
+        self.cut_points = []                                # in seconds
+
+    def window_range(self):
+        """
+        Returns the first and the end frame of the current search window
+        """
+        target = self.last_cut_frame + self.segment_frames
+        return target - self.window_frames, target + self.window_frames
+
+    def feed(self, samples):
+        """
+        Analyses the next block of samples, a 1-dimensional numpy array of 16 bit integers
+        """
+        if len(self.carry):
+            samples = numpy.concatenate([self.carry, samples])
+        n_frames = len(samples) // self.frame_size
+        self.carry = samples[n_frames * self.frame_size:]
+        frames = samples[:n_frames * self.frame_size].reshape(n_frames, self.frame_size).astype(numpy.float32)
+        # mean power of each frame in dB. +1 keeps digital silence finite
+        energies = 10 * numpy.log10(numpy.mean(frames * frames, axis=1) + 1.)
+        self._consume(energies)
+
+    def _consume(self, energies):
+        first_frame = self.n_frames
+        self.n_frames += len(energies)
+        while True:
+            window_start, window_end = self.window_range()
+            lo = max(window_start - first_frame, 0)
+            hi = min(window_end - first_frame, len(energies))
+            if lo < hi:
+                self.window.append(energies[lo:hi])
+            if self.n_frames < window_end:
+                return
+            self._cut(window_start)
+
+    def _cut(self, window_start):
+        energies = numpy.concatenate(self.window)
+        self.window = []
+        if len(energies) > self.smoothing_frames:
+            smoothed = numpy.convolve(energies, numpy.ones(self.smoothing_frames) / self.smoothing_frames, mode='valid')
+            offset = self.smoothing_frames // 2     # the frame at the center of each averaged run
+        else:
+            smoothed, offset = energies, 0
+        frames = window_start + offset + numpy.arange(len(smoothed))
+        target = self.last_cut_frame + self.segment_frames
+        penalties = DISTANCE_PENALTY_DB * numpy.abs(frames - target) / self.window_frames
+        cut_frame = int(frames[numpy.argmin(smoothed + penalties)])
+        self.cut_points.append(cut_frame * FRAME_LENGTH)
+        self.last_cut_frame = cut_frame
+
+    def duration(self):
+        """
+        Returns the length in seconds of the audio fed so far
+        """
+        return self.n_frames * FRAME_LENGTH + len(self.carry) / self.sample_rate
+
+    def frontier(self):
+        """
+        Returns the number of the first frame the next cut point may fall on. All audio before belongs to the current segment.
+        """
+        return max(self.last_cut_frame, self.window_range()[0])
+
+    def finish(self):
+        """
+        Returns the list of cut points in seconds. Audio ending within the last search window is not cut off,
+        instead of leaving a very short last segment.
+        """
+        return list(self.cut_points)
+
+
+class AnalysisProcess(object):
+    """
+    Wraps an ffmpeg process writing decoded audio to its stdout, hiding the samples from process watchers,
+    which would otherwise read them as output lines. Watchers read the given output instead, if any.
+    """
+
+    def __init__(self, process, output=None):
+        self.process = process
+        self.args = process.args
+        self.stdout = output
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    def poll(self):
+        return self.process.poll()
+
+    def wait(self, timeout=None):
+        return self.process.wait(timeout)
+
+    def kill(self):
+        self.process.kill()
+
+    def terminate(self):
+        self.process.terminate()
+
+
+def pcm_output_args(filter_args=None, sample_rate=SAMPLE_RATE, channels=1):
+    """
+    Returns the ffmpeg arguments of an additional output writing the (filtered) audio as 16 bit PCM to stdout,
+    e.g. to search for quiet passages during an encode instead of decoding the source once more.
+    Filters apply to each output separately, so the filter_args of the encode have to be repeated.
+    """
+    return ['-map', '0:a'] + list(filter_args or []) + ['-ac', '{}'.format(channels),
+                                                         '-ar', '{}'.format(sample_rate),
+                                                         '-f', 's16le',
+                                                         'pipe:1']
+
+
+def start_analysed_process(cmd, process_watcher=None, **popen_kwargs):
+    """
+    Starts an ffmpeg process writing PCM samples to its stdout, see pcm_output_args.
+    If a process watcher is given, it reads the process' stderr instead, with machine readable progress information.
+
+    Parameters:
+    -----------
+
+    cmd: list - the ffmpeg command
+
+    process_watcher: object - (optional) some object instance containing a field child_processes of
+        type list expecting a registration of child processes.
+
+    popen_kwargs: further keyword arguments to subprocess.Popen
+
+    Returns:
+    --------
+
+    the subprocess.Popen object
+    """
+    cmd = yt2mp3_tools.resolve(cmd)
+    if process_watcher is None:
+        return subprocess.Popen(cmd, stdout=subprocess.PIPE, **popen_kwargs)
+    cmd = cmd[:1] + ['-progress', 'pipe:2'] + cmd[1:]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **popen_kwargs)
+    process_watcher.child_processes.append(AnalysisProcess(proc, io.TextIOWrapper(proc.stderr, errors='replace')))
+    return proc
+
+
+def pcm_blocks(stream, channels=1):
+    """
+    Reads 16 bit PCM from stream until its end, yielding numpy arrays of shape (samples, channels)
+    """
+    sample_size = 2 * channels
+    carry = b''
+    while True:
+        block = stream.read(BLOCK_SIZE * channels)
+        if not block:
+            return
+        block = carry + block
+        n_bytes = len(block) // sample_size * sample_size
+        carry = block[n_bytes:]
+        if n_bytes:
+            yield numpy.frombuffer(block[:n_bytes], dtype='<i2').reshape(-1, channels)
+
+
+def feed_process(proc, finder):
+    """
+    Feeds the mono PCM samples written by proc to finder until the process exits.
+
+    Returns:
+    --------
+
+    the return code of proc
+    """
+    try:
+        for samples in pcm_blocks(proc.stdout):
+            finder.feed(samples[:, 0])
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+    return returncode
+
+
+def split_pcm_stream(stream, finder, channels, start_segment):
+    """
+    Distributes the PCM samples read from stream to consecutive segments, cut at the cut points chosen by finder.
+    Samples are handed on as soon as no cut point can precede them, so only the current search window is held back.
+
+    Parameters:
+    -----------
+
+    stream: file - 16 bit PCM at the sample rate of finder
+
+    finder: CutPointFinder - chooses the cut points
+
+    channels: int - the number of interleaved channels in stream
+
+    start_segment: callable - called with the index of a segment, returns a file-like object with write(bytes) and close()
+
+    Returns:
+    --------
+
+    the number of segments
+    """
+    held_back = []          # sample arrays not yet handed on
+    held_back_start = 0     # the index of the first held back sample
+    segment = start_segment(0)
+    n_segments = 1
+
+    def hand_on(end):
+        nonlocal held_back, held_back_start
+        n_samples = end - held_back_start
+        if n_samples <= 0 or not held_back:
+            return
+        samples = numpy.concatenate(held_back) if len(held_back) > 1 else held_back[0]
+        segment.write(samples[:n_samples].tobytes())
+        held_back = [samples[n_samples:]] if n_samples < len(samples) else []
+        held_back_start += min(n_samples, len(samples))
+
+    for samples in pcm_blocks(stream, channels):
+        # downmixed for the analysis
+        finder.feed(samples.mean(axis=1).astype(numpy.int16) if channels > 1 else samples[:, 0])
+        held_back.append(samples)
+        while len(finder.cut_points) >= n_segments:
+            hand_on(int(round(finder.cut_points[n_segments - 1] / FRAME_LENGTH)) * finder.frame_size)
+            segment.close()
+            segment = start_segment(n_segments)
+            n_segments += 1
+        hand_on(finder.frontier() * finder.frame_size)
+    hand_on(held_back_start + sum(len(samples) for samples in held_back))
+    segment.close()
+    return n_segments
+
+
+def find_cut_points(media_file, segment_length, search_window=None, process_watcher=None):
+    """
+    Decodes the audio of media_file and chooses cut points near multiples of segment_length in quiet passages.
+    The audio is streamed through a CutPointFinder in blocks, so peak memory does not depend on the length of the file.
+    Only for files which are not encoded by this job, e.g. taken from the encoded cache: encodes search for
+    quiet passages on the way, see pcm_output_args.
+
+    Parameters:
+    -----------
+
+    media_file: str - the path to the media file
+
+    segment_length: float - the target length of the segments in seconds
+
+    search_window: float - (optional) see CutPointFinder
+
+    process_watcher: object - (optional) some object instance containing a field child_processes of
+        type list expecting a registration of child processes.
+
+    Returns:
+    --------
+
+    (list of cut points in seconds, duration of the audio in seconds), or None if the audio could not be decoded
+    """
+    assert is_available(), 'Silence-aware segmentation requires the numpy Python package'
+    finder = CutPointFinder(segment_length, search_window)
+    cmd = ['ffmpeg',
+           '-nostdin',
+           '-v', 'error',
+           '-i', media_file,
+           '-vn',
+           '-ac', '1',
+           '-ar', '{}'.format(SAMPLE_RATE),
+           '-f', 's16le',
+           'pipe:1'
+           ]
+    proc = subprocess.Popen(yt2mp3_tools.resolve(cmd), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if process_watcher is not None:
+        process_watcher.child_processes.append(AnalysisProcess(proc))
+    if feed_process(proc, finder) != 0:
+        return None
+    return finder.finish(), finder.duration()
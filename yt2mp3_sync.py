@@ -0,0 +1,66 @@
+# incremental mirroring of playlists and channels into an output folder
+
+import json
+import os
+import threading
+import time
+
+
+ARCHIVE_FILE_NAME = '.yt2mp3-archive.txt'
+MANIFEST_FILE_NAME = '.yt2mp3-manifest.jsonl'
+
+
+class SyncArchive(object):
+    """
+    The persistent state of a mirror folder: a download archive in the format of youtube-dl,
+    listing all videos converted so far, and a manifest with one JSON line per video and its output.
+    Both files are only ever appended to. A video counts as mirrored once it is listed in the archive.
+    """
+
+    def __init__(self, mirror_dir):
+        """
+        Parameters:
+        -----------
+
+        mirror_dir: str - the output folder of the mirror
+        """
+        self.archive_file = os.path.join(mirror_dir, ARCHIVE_FILE_NAME)
+        self.manifest_file = os.path.join(mirror_dir, MANIFEST_FILE_NAME)
+        self.lock = threading.Lock()
+        self.video_ids = set()
+        if os.path.isfile(self.archive_file):
+            with open(self.archive_file, 'rt') as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) == 2:
+                        self.video_ids.add(fields[1])
+
+    def __contains__(self, video_id):
+        return video_id in self.video_ids
+
+    def __len__(self):
+        return len(self.video_ids)
+
+    def add(self, video_id, title, output_destination):
+        """
+        Records a mirrored video. The manifest is written first, such that each archived video has a manifest entry.
+
+        Parameters:
+        -----------
+
+        video_id: str - the ID of the converted video
+
+        title: str or None - the title of the video
+
+        output_destination: str - the output file or segment folder of the video
+        """
+        entry = {'id': video_id,
+                 'title': title,
+                 'output': os.path.relpath(output_destination, os.path.dirname(self.manifest_file)),
+                 'time': time.time()}
+        with self.lock:
+            with open(self.manifest_file, 'at') as f:
+                f.write(json.dumps(entry) + '\n')
+            with open(self.archive_file, 'at') as f:
+                f.write('youtube {}\n'.format(video_id))
+            self.video_ids.add(video_id)
@@ -0,0 +1,167 @@
+# discovers the external tools (ffmpeg, ffprobe, youtube-dl) and what they are capable of, once per installed binary
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+
+
+TOOLS = ['ffmpeg', 'ffprobe', 'youtube-dl']
+# the ffmpeg capability listings recorded by the probe
+FFMPEG_CAPABILITIES = ['encoders', 'muxers', 'filters']
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'yt2mp3', 'tools.json')
+# e.g. " A....D libmp3lame  libmp3lame MP3 (MPEG audio layer 3)" or " DE mp3  MP3 (MPEG audio layer 3)".
+# legend lines (" A..... = Audio") and headers do not match
+CAPABILITY_PATTERN = re.compile(r'^\s*[A-Z.|d]{1,6}\s+(?P<name>[^\s=]\S*)')
+
+
+def binary_stamp(path):
+    """
+    Returns what identifies an installed binary: its resolved path, modification time and size
+    """
+    real_path = os.path.realpath(path)
+    stat = os.stat(real_path)
+    return {'path': path, 'real_path': real_path, 'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def output_of(cmd):
+    try:
+        return subprocess.check_output(cmd, universal_newlines=True, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def probe_tool(name, path):
+    """
+    Runs the tool to determine its version and, for ffmpeg, its encoders, muxers and filters.
+
+    Returns:
+    --------
+    dict with the binary_stamp fields, version and (ffmpeg only) one list of names per FFMPEG_CAPABILITIES
+    """
+    info = binary_stamp(path)
+    version_output = output_of([path, '--version' if name == 'youtube-dl' else '-version']).strip()
+    info['version'] = version_output.split('\n')[0] if version_output else None
+    if name == 'ffmpeg':
+        for capability in FFMPEG_CAPABILITIES:
+            names = []
+            for line in output_of([path, '-hide_banner', '-' + capability]).splitlines():
+                match = CAPABILITY_PATTERN.match(line)
+                if match:
+                    names.append(match.group('name'))
+            info[capability] = names
+    return info
+
+
+def load_cache(cache_file):
+    try:
+        with open(cache_file, 'rt') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache_file, tools):
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file_name = cache_file + '.tmp'
+        with open(tmp_file_name, 'wt') as f:
+            json.dump(tools, f, indent=1)
+        os.replace(tmp_file_name, cache_file)
+    except OSError as e:
+        # probing again next time is merely slower
+        print('[yt2mp3] Could not write tool cache "{}": {}'.format(cache_file, e))
+
+
+def discover_tools(cache_file=DEFAULT_CACHE_FILE, previous=None):
+    """
+    Resolves the paths of all TOOLS on the PATH and probes those not probed before.
+    Probes are reused from previous (if given) or the cache_file as long as the binary has not been replaced,
+    i.e. its path, modification time and size are unchanged. Resolving and checking does not start any process.
+
+    Returns:
+    --------
+    dict tool name -> probe_tool result, or None for tools which are not installed
+    """
+    cached = previous if previous is not None else load_cache(cache_file)
+    tools = {}
+    changed = False
+    for name in TOOLS:
+        path = shutil.which(name)
+        if path is None:
+            tools[name] = None
+            continue
+        info = cached.get(name)
+        stamp = binary_stamp(path)
+        if info is None or any(info.get(key) != value for key, value in stamp.items()):
+            print('[yt2mp3] Probing "{}"'.format(path))
+            info = probe_tool(name, path)
+            changed = True
+        tools[name] = info
+    if changed or any(cached.get(name) is not None and tools[name] is None for name in TOOLS):
+        save_cache(cache_file, tools)
+    return tools
+
+
+# the tools found by this process
+_tools = None
+_tools_lock = threading.Lock()
+
+
+def get_tools(revalidate=False):
+    """
+    Returns the process wide result of discover_tools. Discovered on first use, and checked
+    against the installed binaries again if revalidate is set.
+    """
+    global _tools
+    with _tools_lock:
+        if _tools is None or revalidate:
+            _tools = discover_tools(previous=_tools)
+        return _tools
+
+
+def tool_path(name):
+    """
+    Returns the absolute path of the tool, or its bare name if it is not installed
+    """
+    info = get_tools().get(name)
+    return info['path'] if info is not None else name
+
+
+def resolve(cmd):
+    """
+    Returns the command with its executable replaced by the discovered absolute path
+    """
+    return [tool_path(cmd[0])] + list(cmd[1:])
+
+
+def supports(capability, name):
+    """
+    Checks whether the installed ffmpeg provides e.g. the encoder, muxer or filter of the given name.
+
+    Parameters:
+    -----------
+    capability: str - one of FFMPEG_CAPABILITIES
+
+    name: str - the name as listed by ffmpeg, e.g. libmp3lame or loudnorm
+    """
+    info = get_tools().get('ffmpeg')
+    return info is not None and name in info.get(capability, [])
+
+
+def tool_report():
+    """
+    Returns a human readable summary of the discovered tools
+    """
+    lines = []
+    for name, info in sorted(get_tools().items()):
+        if info is None:
+            lines.append('{}: not found'.format(name))
+            continue
+        lines.append('{}: {} ({})'.format(name, info['path'], info['version']))
+        for capability in FFMPEG_CAPABILITIES:
+            if capability in info:
+                lines.append('  {} {}'.format(len(info[capability]), capability))
+    return '\n'.join(lines)
@@ -3,7 +3,58 @@
 import subprocess
 import os
 import glob
+import json
 import shutil
+import time
+import fnmatch
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import yt2mp3_tools
+import yt2mp3_silence
+import yt2mp3_engine
+
+
+# the supported output formats (and file extensions), each with
+#   download_format: the youtube-dl format selector, preferring sources which are cheapest to turn into this format
+#   copy_codecs: source audio codecs which can be stream-copied (remuxed) into the output container without re-encoding
+#   encoder_settings: the ffmpeg encoder settings for all other sources
+#   encoder: the ffmpeg encoder the encoder_settings select
+#   frame_size: the number of samples per encoded frame. chunk boundaries are aligned to frames
+OUTPUT_FORMATS = {'mp3': {'download_format': 'bestaudio',
+                          'copy_codecs': ['mp3'],
+                          'encoder_settings': ['-q:a', '0'],
+                          'encoder': 'libmp3lame',
+                          'frame_size': 1152,
+                          # frames borrowing bits from earlier frames can not be spliced into a different encode
+                          'splice_settings': ['-reservoir', '0']},
+                  'm4a': {'download_format': 'bestaudio[ext=m4a]/bestaudio',
+                          'copy_codecs': ['aac'],
+                          'encoder_settings': ['-c:a', 'aac', '-b:a', '192k'],
+                          'encoder': 'aac',
+                          'frame_size': 1024,
+                          'splice_settings': []},
+                  'opus': {'download_format': 'bestaudio[acodec=opus]/bestaudio',
+                           'copy_codecs': ['opus'],
+                           'encoder_settings': ['-c:a', 'libopus', '-b:a', '128k'],
+                           'encoder': 'libopus',
+                           'frame_size': 960,
+                           'splice_settings': []},
+                  }
+DEFAULT_OUTPUT_FORMAT = 'mp3'
+# the time in seconds each chunk of a chunked encode is encoded beyond its boundaries, see video_to_mp3_chunked
+CHUNK_OVERLAP = 1.
+
+# files in download directories which are never the downloaded media, see find_downloaded_file
+PARTIAL_FILE_PATTERNS = ['downloaded.txt', 'downloaded.format', '*.part', '*.part-Frag*', '*.ytdl', '*.tmp.*']
+# files in download directories which are never outputs, see sweep_download_dirs
+TEMPORARY_FILE_PATTERNS = PARTIAL_FILE_PATTERNS + ['*.source.*']
+
+# distinguishes the partial outputs of concurrent jobs within this process, see partial_output_tag
+_partial_output_counter = itertools.count()
+
+# media containers ffmpeg can decode from a non-seekable pipe
+STREAMABLE_EXTENSIONS = ['webm', 'ogg', 'opus', 'mp3']
 
 
 def video_id(video_id_or_url):
@@ -20,10 +71,14 @@ def video_id(video_id_or_url):
     """
 
     if 'watch?v=' in video_id_or_url:
-        return video_id_or_url.split('watch?v=')[1]
+        vid = video_id_or_url.split('watch?v=')[1]
+    elif 'youtu.be/' in video_id_or_url:
+        vid = video_id_or_url.split('youtu.be/')[1]
     else:
         # assume we already have an video id
-        return video_id_or_url
+        vid = video_id_or_url
+    # drop further url parameters such as playlist indices or time stamps
+    return vid.split('&')[0].split('?')[0].split('#')[0]
 
 
 def video_url(video_id_or_url):
@@ -43,27 +98,108 @@ def video_url(video_id_or_url):
     return 'https://www.youtube.com/watch?v={}'.format(vid)
 
 
-def check_requirements():
+def start_process(cmd, process_watcher=None, quiet=False, **popen_kwargs):
     """
-    Checks whether the required applications (ffmpeg, youtube-dl) are installed and callable.
+    Starts a child process. If a process watcher is given, the process output (stdout and stderr)
+    is piped for the watcher to collect, and ffmpeg is asked for machine readable progress information.
+
+    Parameters:
+    -----------
+    cmd: list - the command to execute
+
+    process_watcher: object - (optional) some object instance containing a field child_processes of
+        type list expecting a registration of child processes.
+        This is hacky, but currently the only solution I am aware of.
+
+    quiet: bool - (optional) discard the output of unwatched processes instead of writing it to the console
+
+    popen_kwargs: further keyword arguments to subprocess.Popen
+
+    Returns:
+    --------
+    the subprocess.Popen object
+    """
+    cmd = yt2mp3_tools.resolve(cmd)
+    if process_watcher:
+        if os.path.basename(cmd[0]) == 'ffmpeg':
+            # key=value progress blocks on stdout, in addition to the human readable stats line
+            cmd = cmd[:1] + ['-progress', 'pipe:1'] + cmd[1:]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, **popen_kwargs)
+        process_watcher.child_processes.append(proc)
+    elif quiet:
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **popen_kwargs)
+    else:
+        proc = subprocess.Popen(cmd, **popen_kwargs)
+    return proc
+
+
+def download_format(output_format):
+    """
+    Returns the youtube-dl format selector to use for the given output format
+    """
+    return OUTPUT_FORMATS[output_format]['download_format']
+
+
+def encoding_key(output_format, postprocess_key=()):
+    """
+    Returns a list of strings identifying how media is turned into the given output format,
+    e.g. for use as part of a cache key.
+
+    Parameters:
+    -----------
+    output_format: str - the output format. see OUTPUT_FORMATS.
+
+    postprocess_key: list - (optional) the strings identifying the post-processing applied, see yt2mp3_postprocess.settings_key
+    """
+    return [output_format] + OUTPUT_FORMATS[output_format]['encoder_settings'] + list(postprocess_key)
+
+
+def download_dir_for(video_url):
+    """
+    Returns the (temporary) download directory used for the video behind video_url
+
+    Parameters:
+    -----------
+    video_url: str - The youtube video url or id
+
+    Returns:
+    --------
+    path to the download directory
+    """
+    return '.tmp-{}'.format(video_id(video_url))
+
+
+def check_requirements(output_format=None, filters=()):
+    """
+    Checks whether the required applications (ffmpeg, youtube-dl) are installed and callable,
+    and whether ffmpeg provides the encoder for output_format (if given) and the given filters.
     Suggest installation commands (currently for snap only) if problems are encountered.
+    The tools are probed once per installed binary (see yt2mp3_tools), so repeated checks start no processes.
     TODO: extend for alternative systems: Windows, OSX, other linux distros and package managers
     """
     # TODO: infer current system, call corresponding sub-method
     # TODO: upon failure: ask in command prompt,
     # whether the required install commands should be executed, and if so, as sudo
-    try:
-        subprocess.check_output(['which',  'ffmpeg'])
-        subprocess.check_output(['which',  'youtube-dl'])
-    except subprocess.CalledProcessError:
+    tools = yt2mp3_tools.get_tools(revalidate=True)
+    if tools['ffmpeg'] is None or tools['youtube-dl'] is None:
         print('[yt2mp3] One or both of the requried executables could not be found.'
               + 'Please make sure ffmpeg and youtube-dl are installed and executable.\n'
               + 'E.g. on systems supporting the snap package manager, execute\n'
               + '   "snap install ffmpeg youtube-dl"')
         exit()
+    if output_format is not None and not yt2mp3_tools.supports('encoders', OUTPUT_FORMATS[output_format]['encoder']):
+        print('[yt2mp3] The installed ffmpeg ({}) lacks the encoder "{}" required for {} output.'.format(
+            tools['ffmpeg']['path'], OUTPUT_FORMATS[output_format]['encoder'], output_format))
+        exit()
+    missing_filters = [name for name in filters if not yt2mp3_tools.supports('filters', name)]
+    if missing_filters:
+        print('[yt2mp3] The installed ffmpeg ({}) lacks the filters {} required for the post-processing.'.format(
+            tools['ffmpeg']['path'], ', '.join(missing_filters)))
+        exit()
 
 
-def download_video(video_url, process_watcher=None):
+def download_video(video_url, process_watcher=None, media_cache=None, output_format=DEFAULT_OUTPUT_FORMAT,
+                   bandwidth_budget=None, job_rate=None, rate_callback=None, engine=None):
     """
     Downloads the video behind video_url from youtube using youtube-dl.
     Writes the ID of the downloaded video to a (temporary) txt file and returns the file name
@@ -76,86 +212,586 @@ def download_video(video_url, process_watcher=None):
         of type list expecting a registration of child processes.
         This is hacky, but currently the only solution I am aware of.
 
+    media_cache: yt2mp3_cache.MediaCache - (optional) a cache of previously downloaded media.
+        consulted before youtube-dl is called, and populated after successful downloads.
+
+    output_format: str - (optional) the desired output format. see OUTPUT_FORMATS.
+        determines which of the available audio formats is downloaded.
+
+    bandwidth_budget: yt2mp3_bandwidth.BandwidthBudget - (optional) the download rate budget shared with concurrent downloads
+
+    job_rate: float - (optional) the maximum download rate of this video in bytes per second
+
+    rate_callback: callable - (optional) called with the allotted download rate in bytes per second (or None) whenever it is set
+
+    engine: yt2mp3_engine.YoutubeDLEngine - (optional) download in-process instead of starting a youtube-dl process
+
     Returns:
     --------
     Path to the file containing the IDs of the downloaded/created files
     Path to the downloaded mp3 file
     """
-    download_dir = '.tmp-{}'.format(video_id(video_url))
+    download_dir = download_dir_for(video_url)
     archive_file = '{}/downloaded.txt'.format(download_dir)
+    format_file = '{}/downloaded.format'.format(download_dir)
     ensure_dir_exists(download_dir)
+
+    # adopt what a failed or interrupted previous run (or a concurrent job for the same video) has left behind
+    remove_partial_outputs(download_dir)
+    if os.path.isfile(archive_file):
+        try:
+            previous_file_name = find_downloaded_file(download_dir, archive_file)
+        except (AssertionError, IndexError):
+            # the media file has been removed since
+            previous_file_name = None
+        if previous_file_name is not None and read_format_file(format_file) == download_format(output_format):
+            print('[yt2mp3] Reusing previous download "{}"'.format(previous_file_name))
+            return download_dir, archive_file
+        if previous_file_name is not None:
+            print('[yt2mp3] Removing previous download "{}" of another format'.format(previous_file_name))
+            os.remove(previous_file_name)
+        os.remove(archive_file)
+
+    vid = video_id(video_url)
+    if media_cache is not None:
+        cached_file = media_cache.checkout_media(vid, download_format(output_format), download_dir)
+        if cached_file is not None:
+            print('[yt2mp3] Using cached download "{}"'.format(cached_file))
+            write_archive_file(archive_file, vid)
+            write_format_file(format_file, download_format(output_format))
+            return download_dir, archive_file
+
     # youtube-dl also provides a command line interface which is more
-    # rich and clear than its python API
+    # rich and clear than its python API.
+    # partial downloads (.part files) of previous runs are continued via HTTP range requests
+    output_template = '{}/%(title)s-%(id)s.%(ext)s'.format(download_dir)
     cmd = ['youtube-dl',
            '--ignore-errors',
-           '--format', 'bestaudio',
+           '--continue',
+           '--format', download_format(output_format),
            '--download-archive', archive_file,
-           '--output', '{}/%(title)s-%(id)s.%(ext)s'.format(download_dir),
-           video_url
+           '--output', output_template
            ]
-    if process_watcher:
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-        process_watcher.child_processes.append(proc)
+    if engine is not None:
+        # the same options, applied to a youtube_dl instance kept alive across downloads
+        engine.download(video_url, output_template, archive_file, download_format(output_format), process_watcher,
+                        bandwidth_budget, job_rate, rate_callback)
+    elif bandwidth_budget is None:
+        if rate_callback:
+            rate_callback(job_rate)
+        proc = start_process(cmd + (['--limit-rate', str(int(job_rate))] if job_rate else []) + [video_url], process_watcher)
+        proc.wait()
     else:
-        proc = subprocess.Popen(cmd)
-    proc.wait()
+        token = bandwidth_budget.join(job_rate)
+        try:
+            restart = True
+            while restart:
+                # restarts continue the partial download at the new fair share of the budget
+                rate = bandwidth_budget.share(token)
+                if rate_callback:
+                    rate_callback(rate)
+                proc = start_process(cmd + (['--limit-rate', str(int(rate))] if rate else []) + [video_url], process_watcher)
+                restart = bandwidth_budget.wait(proc, token, rate)
+        finally:
+            bandwidth_budget.leave(token)
 
     assert os.path.isfile(archive_file), 'Download failed for video "{}"'.format(video_url)
+    write_format_file(format_file, download_format(output_format))
+    if media_cache is not None:
+        media_cache.put_media(vid, download_format(output_format), find_downloaded_file(download_dir, archive_file))
     return download_dir, archive_file
 
 
-def video_to_mp3(download_dir, archive_file, process_watcher=None):
+def write_archive_file(archive_file, vid):
     """
-    Converts a downloaded video to mp3
+    Writes a download archive file in the format youtube-dl uses, for downloads youtube-dl has not made itself.
 
     Parameters:
     -----------
-    download_dir: str - the directory the video is currently located in
+    archive_file: str - path to the archive file
 
-    archive_file: str - the path to the during the download created archive file holding the video id
+    vid: str - the video id
+    """
+    with open(archive_file, 'wt') as f:
+        f.write('youtube {}\n'.format(vid))
 
-    process_watcher: object - (optional) some object instance containing a field child_processes of
-        type list expecting a registration of child processes.
-        This is hacky, but currently the only solution I am aware of.
+
+def write_format_file(format_file, format_selector):
+    """
+    Records the youtube-dl format selector the media in a download directory has been downloaded with,
+    such that it is only reused for outputs downloading the same format, see download_video.
+
+    Parameters:
+    -----------
+    format_file: str - path to the format file
+
+    format_selector: str - the youtube-dl format selector, see download_format
+    """
+    with open(format_file, 'wt') as f:
+        f.write(format_selector + '\n')
+
+
+def read_format_file(format_file):
+    """
+    Returns the format selector recorded by write_format_file, or None if there is none.
+    """
+    try:
+        with open(format_file, 'rt') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def partial_output_tag():
+    """
+    Returns a tag unique to one conversion, naming its partial outputs ("<name>.<tag>.tmp.<ext>" and "chunks-<tag>"),
+    such that concurrent jobs for the same video do not write to or remove each other's files.
+    The tag starts with the process ID, see remove_partial_outputs.
+    """
+    return '{}-{}'.format(os.getpid(), next(_partial_output_counter))
+
+
+def _partial_output_is_orphaned(tag):
+    """
+    Tells whether the process which has written partial outputs with the given tag (see partial_output_tag) is gone.
+    Outputs without a (valid) tag stem from older versions and are always orphaned.
+    """
+    try:
+        pid = int(tag.split('-')[0])
+    except ValueError:
+        return True
+    if pid == os.getpid():
+        # the job may still be running in this process. its own cleanup removes its outputs
+        return False
+    if os.name == 'nt':
+        # liveness of other processes can not be probed without extra dependencies. leave it to sweep_download_dirs
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        # e.g. a process of another user
+        return False
+    return False
+
+
+def remove_partial_outputs(download_dir):
+    """
+    Removes the partial outputs interrupted conversions have left in download_dir,
+    which would otherwise be mistaken for downloads or block ffmpeg from writing its outputs.
+    The partial outputs of conversions still running in other jobs are kept.
+    """
+    for partial_file in glob.glob(os.path.join(download_dir, '*.tmp.*')):
+        tag = os.path.basename(partial_file).rsplit('.tmp.', 1)[0].rpartition('.')[2]
+        if _partial_output_is_orphaned(tag):
+            os.remove(partial_file)
+    for chunk_dir in glob.glob(os.path.join(download_dir, 'chunks*')):
+        if os.path.isdir(chunk_dir) and _partial_output_is_orphaned(os.path.basename(chunk_dir)[len('chunks-'):]):
+            shutil.rmtree(chunk_dir, ignore_errors=True)
+
+
+def sweep_download_dirs(max_age_seconds, parent_dir='.'):
+    """
+    Garbage-collects the .tmp-<id> download directories of failed or interrupted jobs which have not been touched for max_age_seconds.
+    Younger directories are left alone, to be adopted by the next job for the same video, see download_video.
+    Files which may be outputs of jobs without explicit output destination are kept.
+
+    Parameters:
+    -----------
+    max_age_seconds: float - the minimum time since the last modification of anything within a directory
+
+    parent_dir: str - (optional) the directory holding the download directories
 
     Returns:
     --------
+    the number of removed download directories
+    """
+    output_extensions = set('.' + output_format for output_format in OUTPUT_FORMATS)
+    n_removed = 0
+    for download_dir in glob.glob(os.path.join(parent_dir, '.tmp-*')):
+        if not os.path.isdir(download_dir):
+            continue
+        last_modified = max([os.path.getmtime(os.path.join(root, name))
+                             for root, dir_names, file_names in os.walk(download_dir)
+                             for name in dir_names + file_names] + [os.path.getmtime(download_dir)])
+        if time.time() - last_modified < max_age_seconds:
+            continue
+
+        remove_partial_outputs(download_dir)
+        for name in os.listdir(download_dir):
+            path = os.path.join(download_dir, name)
+            if os.path.isfile(path) and (any(fnmatch.fnmatch(name, pattern) for pattern in TEMPORARY_FILE_PATTERNS)
+                                         or os.path.splitext(name)[1] not in output_extensions):
+                os.remove(path)
+        if os.listdir(download_dir):
+            print('[yt2mp3] Keeping possible outputs in orphaned download directory "{}"'.format(download_dir))
+        else:
+            print('[yt2mp3] Removing orphaned download directory "{}"'.format(download_dir))
+            os.rmdir(download_dir)
+            n_removed += 1
+    return n_removed
 
-    path to the downloaded mp3 file name
+
+def link_or_copy_file(source_file_name, target_file_name):
+    """
+    Hard links source_file_name to target_file_name, or copies it if linking is not possible
+    (e.g. across file systems).
     """
+    try:
+        os.link(source_file_name, target_file_name)
+    except OSError:
+        shutil.copy2(source_file_name, target_file_name)
+
+
+def find_downloaded_file(download_dir, archive_file):
+    """
+    Locates the media file downloaded by download_video
+
+    Parameters:
+    -----------
+    download_dir: str - the directory the video is currently located in
+
+    archive_file: str - the path to the during the download created archive file holding the video id
+
+    Returns:
+    --------
 
+    path to the downloaded media file
+    """
     assert os.path.isdir(download_dir), "Download directory {} missing!".format(download_dir)
     assert os.path.isfile(archive_file), "Archive file {} missing! Did the download fail?".format(archive_file)
     video_id = None
     with open(archive_file, 'rt') as f:
         video_id = f.read().split(' ')[1].strip()
     pattern = '{}/*{}.*'.format(download_dir, video_id)
-    downloaded_file_name = glob.glob(pattern)[0]
-    mp3_file_name = os.path.splitext(downloaded_file_name)[0] + '.mp3'
-    tmp_mp3_file_name = mp3_file_name.replace('.mp3', '.tmp.mp3')
+    candidates = [file_name for file_name in glob.glob(pattern)
+                  if os.path.isfile(file_name)
+                  and not any(fnmatch.fnmatch(os.path.basename(file_name), partial_pattern)
+                              for partial_pattern in PARTIAL_FILE_PATTERNS)]
+    # a source moved out of the way of its output (see video_to_mp3) is the download. otherwise outputs left behind
+    # by previous runs are younger than the download they have been converted from
+    candidates.sort(key=lambda file_name: ('.source.' not in os.path.basename(file_name), os.path.getmtime(file_name)))
+    downloaded_file_name = candidates[0]
 
     # redundant
     assert os.path.isfile(downloaded_file_name), 'Downloaded file has magically vanished?'
+    return downloaded_file_name
+
+
+def probe_download_file_name(video_url, output_format=DEFAULT_OUTPUT_FORMAT, engine=None, metadata=None):
+    """
+    Determines the file name the download of video_url would be written to, without downloading it:
+    from already resolved metadata if given, and by asking youtube-dl otherwise.
+
+    Parameters:
+    -----------
+    video_url: str - The youtube video url or id
+
+    output_format: str - (optional) the desired output format. see OUTPUT_FORMATS.
+
+    engine: yt2mp3_engine.YoutubeDLEngine - (optional) ask in-process instead of starting a youtube-dl process
+
+    metadata: dict - (optional) the video's yt2mp3_metadata.compact_metadata for the download format of output_format
+
+    Returns:
+    --------
+    Path to the (created) download directory
+    Path the downloaded media file would have
+    """
+    download_dir = download_dir_for(video_url)
+    ensure_dir_exists(download_dir)
+    if metadata is not None and metadata.get('title') is not None and metadata.get('ext'):
+        # the same output template as below
+        return download_dir, '{}/{}-{}.{}'.format(download_dir, yt2mp3_engine.sanitize_file_name(metadata['title']),
+                                                  metadata['id'], metadata['ext'])
+    if engine is not None:
+        return download_dir, engine.get_filename(video_url, '{}/%(title)s-%(id)s.%(ext)s'.format(download_dir),
+                                                 download_format(output_format))
+    cmd = ['youtube-dl',
+           '--get-filename',
+           '--format', download_format(output_format),
+           '--output', '{}/%(title)s-%(id)s.%(ext)s'.format(download_dir),
+           video_url
+           ]
+    file_name = subprocess.check_output(yt2mp3_tools.resolve(cmd), universal_newlines=True).strip().split('\n')[-1]
+    return download_dir, file_name
+
+
+def list_playlist(playlist_url, engine=None):
+    """
+    Lists the videos of a playlist or channel without resolving each of them, which is cheap even for large channels.
+
+    Parameters:
+    -----------
+    playlist_url: str - the URL of a playlist or channel
+
+    engine: yt2mp3_engine.YoutubeDLEngine - (optional) list in-process instead of starting a youtube-dl process
+
+    Returns:
+    --------
+    list of dicts with the keys id and title, in playlist order
+    """
+    if engine is not None:
+        return engine.list_playlist(playlist_url)
+    cmd = ['youtube-dl',
+           '--ignore-errors',
+           '--flat-playlist',
+           '--dump-json',
+           playlist_url
+           ]
+    entries = []
+    for line in subprocess.check_output(yt2mp3_tools.resolve(cmd), universal_newlines=True).splitlines():
+        if line.strip():
+            entry = json.loads(line)
+            entries.append({'id': entry['id'], 'title': entry.get('title')})
+    return entries
+
+
+def probe_media(media_file_name):
+    """
+    Determines codec and sample rate of the first audio stream of a media file, and its duration, using ffprobe.
+
+    Parameters:
+    -----------
+    media_file_name: str - path to the media file
+
+    Returns:
+    --------
+    dict with keys codec_name (str, e.g. "opus", "aac", "mp3"), sample_rate (int) and duration (float, in seconds).
+    values which could not be determined are None.
+    """
+    cmd = ['ffprobe',
+           '-v', 'error',
+           '-select_streams', 'a:0',
+           '-show_entries', 'stream=codec_name,sample_rate:format=duration',
+           '-of', 'json',
+           media_file_name
+           ]
+    info = {'codec_name': None, 'sample_rate': None, 'duration': None}
+    try:
+        probed = json.loads(subprocess.check_output(yt2mp3_tools.resolve(cmd), universal_newlines=True))
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return info
+
+    streams = probed.get('streams') or [{}]
+    info['codec_name'] = streams[0].get('codec_name')
+    try:
+        info['sample_rate'] = int(streams[0]['sample_rate'])
+    except (KeyError, ValueError):
+        pass
+    try:
+        info['duration'] = float(probed['format']['duration'])
+    except (KeyError, ValueError):
+        pass
+    return info
+
+
+def probe_audio_codec(media_file_name):
+    """
+    Determines the codec of the first audio stream of a media file using ffprobe.
+
+    Parameters:
+    -----------
+    media_file_name: str - path to the media file
+
+    Returns:
+    --------
+    the ffmpeg codec name, e.g. "opus", "aac", "mp3". None if the file could not be probed.
+    """
+    return probe_media(media_file_name)['codec_name']
+
+
+def conversion_settings(media_file_name, output_format, codec=None, filter_args=None):
+    """
+    Returns the ffmpeg audio codec settings turning media_file_name into output_format:
+    a stream copy if the source codec fits the output container and no filters are applied,
+    the format's encoder settings otherwise.
+
+    Parameters:
+    -----------
+    media_file_name: str - path to the source media file
+
+    output_format: str - the desired output format. see OUTPUT_FORMATS.
+
+    codec: str - (optional) the already probed source audio codec
+
+    filter_args: list - (optional) ffmpeg arguments filtering the audio, e.g. as returned by
+        yt2mp3_postprocess.PostProcessor.filter_args
+
+    Returns:
+    --------
+    list of ffmpeg arguments
+    """
+    if filter_args:
+        # filtered audio is always re-encoded
+        return list(filter_args) + OUTPUT_FORMATS[output_format]['encoder_settings']
+    if codec is None:
+        codec = probe_audio_codec(media_file_name)
+    if codec in OUTPUT_FORMATS[output_format]['copy_codecs']:
+        print('[yt2mp3] Source audio codec "{}" fits into {} output. Copying without re-encoding'.format(codec, output_format))
+        return ['-c:a', 'copy']
+    return OUTPUT_FORMATS[output_format]['encoder_settings']
+
+
+def is_streamable(file_name):
+    """
+    Can a media file of this type be decoded by ffmpeg from a non-seekable pipe?
+    E.g. mp4/m4a containers may store their index at the end of the file and thus can not.
+
+    Parameters:
+    -----------
+    file_name: str - the (would-be) name of the downloaded media file
+
+    Returns:
+    --------
+    True if the file can be streamed
+    """
+    return os.path.splitext(file_name)[1].lstrip('.').lower() in STREAMABLE_EXTENSIONS
+
+
+def start_stream_download(video_url, output_format=DEFAULT_OUTPUT_FORMAT, process_watcher=None, rate=None):
+    """
+    Starts youtube-dl writing the audio download to its stdout, to be piped into ffmpeg.
+    Only ffmpeg gets registered with the process watcher: the youtube-dl stdout carries the media stream
+    and must not be read by anyone else. Killing ffmpeg terminates youtube-dl via the broken pipe.
+
+    Parameters:
+    -----------
+    rate: float - (optional) the maximum download rate in bytes per second. a stream can not be restarted,
+        so the rate is kept for the whole download, see yt2mp3_bandwidth.fixed_share_from_args
+
+    Returns:
+    --------
+    the subprocess.Popen object
+    """
+    download_cmd = ['youtube-dl',
+                    '--format', download_format(output_format),
+                    '--output', '-',
+                    ] + (['--limit-rate', str(int(rate))] if rate else []) + [video_url]
+    return subprocess.Popen(yt2mp3_tools.resolve(download_cmd), stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL if process_watcher else None)
+
+
+def stream_video_to_mp3(video_url, output_file_name, segment_length=None, process_watcher=None, output_format=DEFAULT_OUTPUT_FORMAT,
+                        filter_args=None, rate=None):
+    """
+    Pipes the audio download of youtube-dl directly into ffmpeg, so encoding overlaps
+    downloading and no intermediate media file is written.
+    Since the source codec is unknown before the stream starts, the audio is always re-encoded.
+
+    Parameters:
+    -----------
+    video_url: str - The youtube video url or id
+
+    output_file_name: str - the mp3 file to write. if segment_length is given,
+        the full segment file pattern as returned by segment_file_pattern
+
+    segment_length: int or None - (optional) the length in seconds of the target mp3 segments
+
+    process_watcher: object - (optional) some object instance containing a field child_processes of
+        type list expecting a registration of child processes.
+        This is hacky, but currently the only solution I am aware of.
+
+    output_format: str - (optional) the desired output format. see OUTPUT_FORMATS.
+
+    filter_args: list - (optional) ffmpeg arguments filtering the audio before it is encoded
+
+    rate: float - (optional) the maximum download rate in bytes per second, see start_stream_download
+    """
+    convert_cmd = ['ffmpeg',
+                   '-i', 'pipe:0',
+                   '-vn'] + list(filter_args or []) + OUTPUT_FORMATS[output_format]['encoder_settings']
+    if segment_length is not None:
+        convert_cmd += ['-f', 'segment',
+                        '-segment_time', '{}'.format(segment_length)]
+    convert_cmd += [output_file_name]
+
+    print('[yt2mp3] Streaming "{}" into "{}"'.format(video_url, output_file_name))
+    download_proc = start_stream_download(video_url, output_format, process_watcher, rate)
+    convert_proc = start_process(convert_cmd, process_watcher, stdin=download_proc.stdout)
+    download_proc.stdout.close()  # allow youtube-dl to receive SIGPIPE if ffmpeg exits
+    convert_proc.wait()
+    download_proc.wait()
+
+    assert download_proc.returncode == 0, 'Streaming download failed for video "{}"'.format(video_url)
+    assert convert_proc.returncode == 0, 'Streaming conversion failed for video "{}"'.format(video_url)
+
+
+def video_to_mp3(download_dir, archive_file, process_watcher=None, output_format=DEFAULT_OUTPUT_FORMAT, postprocessor=None,
+                 cut_point_finder=None):
+    """
+    Converts a downloaded video to mp3, or any other of the OUTPUT_FORMATS.
+    The audio stream is copied without re-encoding where the source codec allows it and no post-processing is applied.
+
+    Parameters:
+    -----------
+    download_dir: str - the directory the video is currently located in
+
+    archive_file: str - the path to the during the download created archive file holding the video id
+
+    process_watcher: object - (optional) some object instance containing a field child_processes of
+        type list expecting a registration of child processes.
+        This is hacky, but currently the only solution I am aware of.
+
+    output_format: str - (optional) the desired output format. see OUTPUT_FORMATS.
+
+    postprocessor: yt2mp3_postprocess.PostProcessor - (optional) the post-processing applied as part of the encode
+
+    cut_point_finder: yt2mp3_silence.CutPointFinder - (optional) searched for quiet passages during the encode,
+        fed from a second ffmpeg output of the same decode
+
+    Returns:
+    --------
+
+    path to the downloaded mp3 file name
+    """
+
+    downloaded_file_name = find_downloaded_file(download_dir, archive_file)
+    mp3_file_name, tmp_mp3_file_name = output_file_names(downloaded_file_name, output_format)
+    if downloaded_file_name == mp3_file_name:
+        # e.g. m4a downloads for m4a outputs. move the source out of the way of the output file
+        source_file_name = '{}.source{}'.format(*os.path.splitext(downloaded_file_name))
+        shutil.move(downloaded_file_name, source_file_name)
+        downloaded_file_name = source_file_name
 
     # convert
+    filter_args = postprocessor.filter_args(downloaded_file_name, process_watcher) if postprocessor is not None else None
     cmd = ['ffmpeg',
            '-i', downloaded_file_name,
-           '-q:a', '0',
-           '-vn', tmp_mp3_file_name]
-    if process_watcher:
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-        process_watcher.child_processes.append(proc)
+           '-vn'] + conversion_settings(downloaded_file_name, output_format, filter_args=filter_args) + [tmp_mp3_file_name]
+    if cut_point_finder is not None:
+        cmd += yt2mp3_silence.pcm_output_args(filter_args)
+        yt2mp3_silence.feed_process(yt2mp3_silence.start_analysed_process(cmd, process_watcher), cut_point_finder)
     else:
-        proc = subprocess.Popen(cmd)
-    proc.wait()
+        proc = start_process(cmd, process_watcher)
+        proc.wait()
 
     assert os.path.isfile(tmp_mp3_file_name), 'Conversion from Video to MP3 file failed! (pre-rename)'
     shutil.move(tmp_mp3_file_name, mp3_file_name)
     assert os.path.isfile(mp3_file_name), 'Conversion from Video to MP3 file failed! (post-rename)'
-    print('[yt2mp3] MP3 output saved to {}'.format(mp3_file_name))
+    print('[yt2mp3] {} output saved to {}'.format(output_format.upper(), mp3_file_name))
     return mp3_file_name, downloaded_file_name, tmp_mp3_file_name
 
 
+def output_file_names(downloaded_file_name, output_format=DEFAULT_OUTPUT_FORMAT):
+    """
+    Returns the names of the output file converted from downloaded_file_name, and of the partial output it is written
+    to first, unique to this conversion (see partial_output_tag)
+
+    Parameters:
+    -----------
+    downloaded_file_name: str - path to the downloaded media file, possibly moved out of the way of the output
+
+    output_format: str - (optional) the desired output format. see OUTPUT_FORMATS.
+    """
+    file_name_base = os.path.splitext(downloaded_file_name)[0]
+    if file_name_base.endswith('.source'):
+        file_name_base = file_name_base[:-len('.source')]
+    return ('{}.{}'.format(file_name_base, output_format),
+            '{}.{}.tmp.{}'.format(file_name_base, partial_output_tag(), output_format))
+
+
 def ensure_dir_exists(path_to_dir):
     """
     Ensures the path to a directory exists by attempting to create it if necessary.
@@ -169,7 +805,7 @@ def ensure_dir_exists(path_to_dir):
         os.makedirs(path_to_dir)
 
 
-def determine_prepare_output(downloaded_file, output_dest, segment_length):
+def determine_prepare_output(downloaded_file, output_dest, segment_length, output_format=DEFAULT_OUTPUT_FORMAT):
     """
     Determines and prepares the output location of the downloaded file.
 
@@ -184,6 +820,8 @@ def determine_prepare_output(downloaded_file, output_dest, segment_length):
     segment_length: int or None - optional.
         Either a time in seconds or None. Determines whether the output is a directory or a file
 
+    output_format: str - (optional) the output format and thus file extension of single file outputs
+
     Returns:
     --------
 
@@ -198,8 +836,8 @@ def determine_prepare_output(downloaded_file, output_dest, segment_length):
         output_dest = downloaded_file
 
     if output_is_file:
-        if not output_dest.endswith('.mp3'):
-            output_dest += '.mp3'
+        if not output_dest.endswith('.' + output_format):
+            output_dest += '.' + output_format
     else:
         ensure_dir_exists(output_dest)
 
@@ -223,10 +861,71 @@ def move_download_to_output(downloaded_file_name, output_destination):
         shutil.move(downloaded_file_name, output_destination)
 
 
-def split_download_into_segments(downloaded_file_name, output_destination, segment_length, segment_naming_pattern, process_watcher=None):
+def segment_file_pattern(output_destination, segment_naming_pattern, output_format=DEFAULT_OUTPUT_FORMAT):
+    """
+    Builds the full ffmpeg segment muxer output pattern from the output folder and the segment naming pattern.
+
+    Parameters:
+    -----------
+
+    output_destination: str - path to the output folder.
+
+    segment_naming_pattern: str - the naming pattern after which the generated segments are to be called.
+
+    output_format: str - (optional) the output format and thus file extension of the segments.
+        replaces the extension of any other output format given in segment_naming_pattern
+
+    Returns:
+    --------
+
+    the path pattern of the segment files
+    """
+    pattern_base, pattern_extension = os.path.splitext(segment_naming_pattern)
+    if pattern_extension.lstrip('.') in OUTPUT_FORMATS:
+        segment_naming_pattern = pattern_base
+    segment_naming_pattern += '.' + output_format
+    return '{}/{}'.format(output_destination, segment_naming_pattern)
+
+
+def silence_segment_times(media_file, segment_length, search_window=None, process_watcher=None):
+    """
+    Determines the segment muxer options cutting media_file in quiet passages near multiples of segment_length.
+
+    Returns:
+    --------
+
+    the ffmpeg segment muxer options, or None if the cut points could not be determined
+    """
+    if not yt2mp3_silence.is_available():
+        print('[yt2mp3] Silence-aware segmentation requires numpy (pip install numpy). Using segments of equal length')
+        return None
+    print('[yt2mp3] Searching "{}" for quiet passages to split at'.format(media_file))
+    result = yt2mp3_silence.find_cut_points(media_file, segment_length, search_window, process_watcher)
+    if result is None:
+        print('[yt2mp3] Could not analyse "{}". Using segments of equal length'.format(media_file))
+        return None
+    cut_points, duration = result
+    print('[yt2mp3] Splitting {:.0f}s of audio at {} quiet passages'.format(duration, len(cut_points)))
+    return cut_point_segment_times(cut_points, segment_length)
+
+
+def cut_point_segment_times(cut_points, segment_length):
+    """
+    Returns the segment muxer options cutting at the given cut points in seconds, see yt2mp3_silence.CutPointFinder
+    """
+    if not cut_points:
+        # a single segment. the finder does not leave more than a segment and a search window uncut
+        return ['-segment_time', '{}'.format(2 * segment_length)]
+    return ['-segment_times', ','.join('{:.3f}'.format(cut_point) for cut_point in cut_points)]
+
+
+def split_download_into_segments(downloaded_file_name, output_destination, segment_length, segment_naming_pattern, process_watcher=None,
+                                 output_format=DEFAULT_OUTPUT_FORMAT, silence_aware=False, search_window=None, cut_points=None):
     """
     Splits the downloaded singular mp3 file into segments of equal length,
     and stores the files in the specified output destination.
+    In silence-aware mode, each segment ends in the quietest passage near its target length instead (see yt2mp3_silence).
+    Either way, the segments are cut without re-encoding.
     Removes the source file after finishing the process.
 
     Parameters:
@@ -243,41 +942,415 @@ def split_download_into_segments(downloaded_file_name, output_destination, segme
     process_watcher: object - (optional) some object instance containing a field child_processes of
         type list expecting a registration of child processes.
         This is hacky, but currently the only solution I am aware of.
+
+    output_format: str - (optional) the output format of the segments. see OUTPUT_FORMATS.
+
+    silence_aware: bool - (optional) cut in quiet passages near the target lengths. falls back to equal lengths
+        if numpy is not installed or the file can not be analysed
+
+    search_window: float - (optional) the time in seconds before and after each target length searched for a quiet passage
+
+    cut_points: list - (optional) the silence-aware cut points in seconds, if found while the file was encoded
     """
 
     assert os.path.isdir(output_destination), "Path to folder {} does not exist!".format(output_destination)
-    if not segment_naming_pattern.endswith('.mp3'):
-        segment_naming_pattern += '.mp3'
-
-    segment_naming_pattern = '{}/{}'.format(output_destination, segment_naming_pattern)
+    segment_naming_pattern = segment_file_pattern(output_destination, segment_naming_pattern, output_format)
+    segment_times = ['-segment_time', '{}'.format(segment_length)]
+    if silence_aware and cut_points is not None:
+        print('[yt2mp3] Splitting "{}" at {} quiet passages'.format(downloaded_file_name, len(cut_points)))
+        segment_times = cut_point_segment_times(cut_points, segment_length)
+    elif silence_aware:
+        segment_times = silence_segment_times(downloaded_file_name, segment_length, search_window, process_watcher) or segment_times
     cmd = ['ffmpeg',
            '-i', downloaded_file_name,
-           '-f', 'segment',
-           '-segment_time', '{}'.format(segment_length),
+           '-f', 'segment'
+           ] + segment_times + [
            '-c', 'copy',
            segment_naming_pattern
            ]
 
     print('[yt2mp3] Splitting downloaded file "{}" into segments "{}"'.format(downloaded_file_name, segment_naming_pattern))
-    if process_watcher:
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-        process_watcher.child_processes.append(proc)
-    else:
-        proc = subprocess.Popen(cmd)
+    proc = start_process(cmd, process_watcher)
     proc.wait()
 
-    assert len(glob.glob('{}/*.mp3'.format(output_destination))) > 0,\
-        'Warning! No output mp3 segments have been generated at "{}/*.mp3"'.format(output_destination)
+    assert len(glob.glob('{}/*.{}'.format(output_destination, output_format))) > 0,\
+        'Warning! No output segments have been generated at "{}/*.{}"'.format(output_destination, output_format)
 
     # TODO add command line option for this
     print('[yt2mp3] removing downloaded file "{}"'.format(downloaded_file_name))
     os.remove(downloaded_file_name)
 
 
-def cleanup(download_dir, archive_file, video_file, tmp_mp3_file_name):
+def video_to_mp3_segments(downloaded_file_name, output_destination, segment_length, segment_naming_pattern, process_watcher=None,
+                          output_format=DEFAULT_OUTPUT_FORMAT, postprocessor=None):
+    """
+    Converts a downloaded video to mp3 and splits it into segments of equal length in a single ffmpeg run,
+    writing the segments directly to the output destination.
+    Avoids writing (and re-reading) the full length mp3 file, as video_to_mp3 followed by
+    split_download_into_segments would.
+
+    Parameters:
+    -----------
+
+    downloaded_file_name: str - the path to the downloaded media file
+
+    output_destination: str - path to the output folder. should exist.
+
+    segment_length: int - the length in seconds of the target mp3 segments
+
+    segment_naming_pattern: str - the naming pattern after which the generated segments are to be called.
+
+    process_watcher: object - (optional) some object instance containing a field child_processes of
+        type list expecting a registration of child processes.
+        This is hacky, but currently the only solution I am aware of.
+
+    output_format: str - (optional) the output format of the segments. see OUTPUT_FORMATS.
+
+    postprocessor: yt2mp3_postprocess.PostProcessor - (optional) the post-processing applied as part of the encode.
+        segment lengths refer to the post-processed audio
+    """
+
+    assert os.path.isdir(output_destination), "Path to folder {} does not exist!".format(output_destination)
+    segment_naming_pattern = segment_file_pattern(output_destination, segment_naming_pattern, output_format)
+    filter_args = postprocessor.filter_args(downloaded_file_name, process_watcher) if postprocessor is not None else None
+    cmd = ['ffmpeg',
+           '-i', downloaded_file_name,
+           '-vn'] + conversion_settings(downloaded_file_name, output_format, filter_args=filter_args) + [
+           '-f', 'segment',
+           '-segment_time', '{}'.format(segment_length),
+           segment_naming_pattern
+           ]
+
+    print('[yt2mp3] Converting downloaded file "{}" into mp3 segments "{}"'.format(downloaded_file_name, segment_naming_pattern))
+    proc = start_process(cmd, process_watcher)
+    proc.wait()
+
+    assert len(glob.glob('{}/*.{}'.format(output_destination, output_format))) > 0,\
+        'Warning! No output segments have been generated at "{}/*.{}"'.format(output_destination, output_format)
+
+
+def chunk_time_ranges(duration, chunk_length, sample_rate, output_format, merge_tail=False):
+    """
+    Divides the time span [0, duration] into consecutive ranges of (roughly) chunk_length seconds.
+    All boundaries are aligned to the frame size of the output format, such that chunks encoded from
+    frame aligned start times share the frame grid of a single encode, see video_to_mp3_chunked.
+
+    Parameters:
+    -----------
+
+    duration: float - the total duration in seconds
+
+    chunk_length: float - the desired length of each chunk in seconds
+
+    sample_rate: int or None - the sample rate of the encoded output
+
+    output_format: str - the output format. see OUTPUT_FORMATS.
+
+    merge_tail: bool - (optional) append a remainder shorter than chunk_length to the last chunk
+        instead of making it a chunk of its own
+
+    Returns:
+    --------
+
+    list of (start, duration) tuples in seconds. the duration of the last range is None, i.e. open ended.
+    """
+    frame_duration = OUTPUT_FORMATS[output_format]['frame_size'] / float(sample_rate or 48000)
+    frames_per_chunk = max(1, int(round(chunk_length / frame_duration)))
+    chunk_length = frames_per_chunk * frame_duration
+    n_chunks = int(duration // chunk_length)
+    if not merge_tail and duration % chunk_length > frame_duration:
+        n_chunks += 1
+    n_chunks = max(1, n_chunks)
+
+    ranges = [(i * chunk_length, chunk_length) for i in range(n_chunks)]
+    ranges[-1] = (ranges[-1][0], None)
+    return ranges
+
+
+def encode_time_range(source_file_name, target_file_name, start, duration, settings, process_watcher=None):
+    """
+    Encodes the time range [start, start + duration] of the source file into the target file.
+
+    Parameters:
+    -----------
+
+    source_file_name: str - path to the source media file
+
+    target_file_name: str - path to the encoded output file
+
+    start: float - the start of the time range in seconds
+
+    duration: float or None - the length of the time range in seconds. None encodes until the end of the source
+
+    settings: list - the ffmpeg codec settings
+
+    process_watcher: object - (optional) some object instance containing a field child_processes of
+        type list expecting a registration of child processes.
+        This is hacky, but currently the only solution I am aware of.
+    """
+    cmd = ['ffmpeg',
+           '-ss', '{:.6f}'.format(start)]
+    if duration is not None:
+        cmd += ['-t', '{:.6f}'.format(duration)]
+    cmd += ['-i', source_file_name,
+            '-vn'] + settings + [target_file_name]
+    proc = start_process(cmd, process_watcher, quiet=True)
+    proc.wait()
+    assert proc.returncode == 0 and os.path.isfile(target_file_name), \
+        'Encoding of time range {:.1f}s+{}s of "{}" failed!'.format(start, duration, source_file_name)
+
+
+def encode_time_ranges_in_parallel(source_file_name, target_file_names, time_ranges, settings, n_workers, process_watcher=None):
+    """
+    Encodes each of the time ranges into the corresponding target file, using up to n_workers ffmpeg processes at once.
+
+    Parameters:
+    -----------
+
+    source_file_name: str - path to the source media file
+
+    target_file_names: list - the paths to the encoded output files, one per time range
+
+    time_ranges: list - (start, duration) tuples as returned by chunk_time_ranges
+
+    settings: list - the ffmpeg codec settings
+
+    n_workers: int - the maximum number of concurrent ffmpeg processes
+
+    process_watcher: object - (optional) some object instance containing a field child_processes of
+        type list expecting a registration of child processes.
+        This is hacky, but currently the only solution I am aware of.
+    """
+    print('[yt2mp3] Encoding "{}" in {} chunks with {} workers'.format(source_file_name, len(time_ranges), n_workers))
+    with ThreadPoolExecutor(max_workers=max(1, n_workers)) as executor:
+        futures = [executor.submit(encode_time_range, source_file_name, target_file_name, start, duration, settings, process_watcher)
+                   for target_file_name, (start, duration) in zip(target_file_names, time_ranges)]
+        for future in futures:
+            future.result()
+
+
+def video_to_mp3_chunked(download_dir, archive_file, n_workers, min_chunk_length, process_watcher=None,
+                         output_format=DEFAULT_OUTPUT_FORMAT):
+    """
+    Converts a downloaded video like video_to_mp3, but splits long sources into n_workers time ranges,
+    encodes them in parallel ffmpeg processes and joins the results via the ffmpeg concat demuxer.
+
+    Each chunk is encoded CHUNK_OVERLAP seconds beyond its boundaries, and the join drops the overlapping frames.
+    Encoder priming and end padding thus fall into the dropped frames, and the frames at each junction are
+    encoded in the steady state of their encoder, on the frame grid of the neighbouring chunk.
+    The junctions are not bit exact: the frames meeting at a junction come from two encoder runs,
+    which may leave a faint transient at the boundary, but no gap or repeated audio.
+    Falls back to video_to_mp3 for sources shorter than two chunks, unknown durations, or sources which can
+    be copied without re-encoding.
+
+    Parameters:
+    -----------
+    download_dir: str - the directory the video is currently located in
+
+    archive_file: str - the path to the during the download created archive file holding the video id
+
+    n_workers: int - the number of parallel ffmpeg processes
+
+    min_chunk_length: float - the minimum length of a chunk in seconds
+
+    process_watcher: object - (optional) some object instance containing a field child_processes of
+        type list expecting a registration of child processes.
+        This is hacky, but currently the only solution I am aware of.
+
+    output_format: str - (optional) the desired output format. see OUTPUT_FORMATS.
+
+    Returns:
+    --------
+
+    see video_to_mp3
+    """
+    downloaded_file_name = find_downloaded_file(download_dir, archive_file)
+    media_info = probe_media(downloaded_file_name)
+    settings = conversion_settings(downloaded_file_name, output_format, media_info['codec_name'])
+    duration = media_info['duration']
+    if duration is None or duration < 2 * min_chunk_length or n_workers < 2 or settings == ['-c:a', 'copy']:
+        return video_to_mp3(download_dir, archive_file, process_watcher, output_format)
+
+    mp3_file_name, tmp_mp3_file_name = output_file_names(downloaded_file_name, output_format)
+    if downloaded_file_name == mp3_file_name:
+        source_file_name = '{}.source{}'.format(*os.path.splitext(downloaded_file_name))
+        shutil.move(downloaded_file_name, source_file_name)
+        downloaded_file_name = source_file_name
+
+    chunk_dir = os.path.join(download_dir, 'chunks-{}'.format(partial_output_tag()))
+    ensure_dir_exists(chunk_dir)
+    sample_rate = 48000 if output_format == 'opus' else media_info['sample_rate']
+    time_ranges = chunk_time_ranges(duration, max(min_chunk_length, duration / n_workers), sample_rate, output_format, merge_tail=True)
+    chunk_file_names = [os.path.join(chunk_dir, '{:05d}.{}'.format(i, output_format)) for i in range(len(time_ranges))]
+    # a whole number of frames, such that the overlapping encodes stay on the same frame grid
+    frame_duration = OUTPUT_FORMATS[output_format]['frame_size'] / float(sample_rate or 48000)
+    overlap = max(1, int(round(CHUNK_OVERLAP / frame_duration))) * frame_duration
+    encoded_ranges = []
+    for start, chunk_duration in time_ranges:
+        encoded_start = max(0., start - overlap)
+        encoded_duration = None if chunk_duration is None else start + chunk_duration + overlap - encoded_start
+        encoded_ranges.append((encoded_start, encoded_duration))
+    try:
+        encode_time_ranges_in_parallel(downloaded_file_name, chunk_file_names, encoded_ranges,
+                                       settings + OUTPUT_FORMATS[output_format]['splice_settings'], n_workers, process_watcher)
+
+        # join the chunks without re-encoding, dropping the overlaps
+        chunk_list_file_name = os.path.join(chunk_dir, 'chunks.txt')
+        with open(chunk_list_file_name, 'wt') as f:
+            for chunk_file_name, (start, chunk_duration), (encoded_start, _) in zip(chunk_file_names, time_ranges, encoded_ranges):
+                f.write("file '{}'\n".format(os.path.abspath(chunk_file_name).replace("'", "'\\''")))
+                if start > encoded_start:
+                    f.write('inpoint {:.6f}\n'.format(start - encoded_start))
+                if chunk_duration is not None:
+                    f.write('outpoint {:.6f}\n'.format(start + chunk_duration - encoded_start))
+        cmd = ['ffmpeg',
+               '-f', 'concat',
+               '-safe', '0',
+               '-i', chunk_list_file_name,
+               '-c', 'copy',
+               tmp_mp3_file_name]
+        proc = start_process(cmd, process_watcher)
+        proc.wait()
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    assert os.path.isfile(tmp_mp3_file_name), 'Joining of encoded chunks failed! (pre-rename)'
+    shutil.move(tmp_mp3_file_name, mp3_file_name)
+    assert os.path.isfile(mp3_file_name), 'Joining of encoded chunks failed! (post-rename)'
+    print('[yt2mp3] {} output saved to {}'.format(output_format.upper(), mp3_file_name))
+    return mp3_file_name, downloaded_file_name, tmp_mp3_file_name
+
+
+def video_to_mp3_segments_chunked(downloaded_file_name, output_destination, segment_length, segment_naming_pattern, n_workers,
+                                  process_watcher=None, output_format=DEFAULT_OUTPUT_FORMAT):
+    """
+    Converts a downloaded video into segments of equal length like video_to_mp3_segments,
+    but encodes the segments in up to n_workers parallel ffmpeg processes, each writing one final segment.
+
+    Parameters:
+    -----------
+
+    downloaded_file_name: str - the path to the downloaded media file
+
+    output_destination: str - path to the output folder. should exist.
+
+    segment_length: int - the length in seconds of the target segments
+
+    segment_naming_pattern: str - the naming pattern after which the generated segments are to be called.
+        a printf-style pattern as understood by the ffmpeg segment muxer, e.g. "%03d.mp3"
+
+    n_workers: int - the number of parallel ffmpeg processes
+
+    process_watcher: object - (optional) some object instance containing a field child_processes of
+        type list expecting a registration of child processes.
+        This is hacky, but currently the only solution I am aware of.
+
+    output_format: str - (optional) the output format of the segments. see OUTPUT_FORMATS.
+    """
+    media_info = probe_media(downloaded_file_name)
+    if media_info['duration'] is None or n_workers < 2:
+        return video_to_mp3_segments(downloaded_file_name, output_destination, segment_length, segment_naming_pattern,
+                                     process_watcher, output_format)
+
+    assert os.path.isdir(output_destination), "Path to folder {} does not exist!".format(output_destination)
+    segment_naming_pattern = segment_file_pattern(output_destination, segment_naming_pattern, output_format)
+    settings = conversion_settings(downloaded_file_name, output_format, media_info['codec_name'])
+    sample_rate = 48000 if output_format == 'opus' else media_info['sample_rate']
+    time_ranges = chunk_time_ranges(media_info['duration'], segment_length, sample_rate, output_format)
+    segment_file_names = [segment_naming_pattern % i for i in range(len(time_ranges))]
+    encode_time_ranges_in_parallel(downloaded_file_name, segment_file_names, time_ranges, settings, n_workers, process_watcher)
+
+
+class SegmentEncoder(object):
+    """
+    An ffmpeg process encoding 16 bit PCM written to it into a single segment file, see encode_segments_at_quiet_passages
+    """
+
+    def __init__(self, file_name, sample_rate, channels, output_format, process_watcher=None):
+        self.file_name = file_name
+        cmd = ['ffmpeg',
+               '-f', 's16le',
+               '-ar', '{}'.format(sample_rate),
+               '-ac', '{}'.format(channels),
+               '-i', 'pipe:0'] + OUTPUT_FORMATS[output_format]['encoder_settings'] + [file_name]
+        # the progress of the job is reported by the decoding process. registered to be stopped with the job only
+        self.proc = subprocess.Popen(yt2mp3_tools.resolve(cmd), stdin=subprocess.PIPE,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if process_watcher is not None:
+            process_watcher.child_processes.append(yt2mp3_silence.AnalysisProcess(self.proc))
+
+    def write(self, data):
+        self.proc.stdin.write(data)
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+        assert self.proc.returncode == 0, 'Encoding of segment "{}" failed!'.format(self.file_name)
+
+
+def encode_segments_at_quiet_passages(input_file_name, output_destination, segment_length, segment_naming_pattern,
+                                      search_window=None, process_watcher=None, output_format=DEFAULT_OUTPUT_FORMAT,
+                                      filter_args=None, stdin=None):
+    """
+    Converts a video into segments ending in quiet passages near their target lengths (see yt2mp3_silence),
+    without writing a full length file: the audio is decoded once, searched for quiet passages on the way,
+    and handed on to one encoder per segment as soon as no cut point can precede it.
+    Cut points depend on the audio before them, so the segments are encoded one after the other.
+
+    Parameters:
+    -----------
+
+    input_file_name: str - the path to the downloaded media file, or "pipe:0" to read from stdin
+
+    output_destination: str - path to the output folder. should exist.
+
+    segment_length: int - the target length in seconds of the segments
+
+    segment_naming_pattern: str - the naming pattern after which the generated segments are to be called.
+
+    search_window: float - (optional) the time in seconds before and after each target length searched for a quiet passage
+
+    process_watcher: object - (optional) some object instance containing a field child_processes of
+        type list expecting a registration of child processes.
+        This is hacky, but currently the only solution I am aware of.
+
+    output_format: str - (optional) the output format of the segments. see OUTPUT_FORMATS.
+
+    filter_args: list - (optional) ffmpeg arguments filtering the audio before it is encoded
+
+    stdin: file - (optional) the pipe to read from, e.g. the stdout of start_stream_download.
+        closed in this process once handed to ffmpeg
+    """
+    assert os.path.isdir(output_destination), "Path to folder {} does not exist!".format(output_destination)
+    segment_naming_pattern = segment_file_pattern(output_destination, segment_naming_pattern, output_format)
+    sample_rate, channels = (48000 if output_format == 'opus' else 44100), 2
+    cmd = ['ffmpeg',
+           '-i', input_file_name,
+           '-vn'] + list(filter_args or []) + ['-ac', '{}'.format(channels),
+                                               '-ar', '{}'.format(sample_rate),
+                                               '-f', 's16le',
+                                               'pipe:1']
+    print('[yt2mp3] Converting "{}" into segments "{}" ending in quiet passages'.format(input_file_name, segment_naming_pattern))
+    proc = yt2mp3_silence.start_analysed_process(cmd, process_watcher, stdin=stdin)
+    if stdin is not None:
+        stdin.close()   # allow the writing process to receive SIGPIPE if ffmpeg exits
+    finder = yt2mp3_silence.CutPointFinder(segment_length, search_window, sample_rate)
+    try:
+        n_segments = yt2mp3_silence.split_pcm_stream(
+            proc.stdout, finder, channels,
+            lambda index: SegmentEncoder(segment_naming_pattern % index, sample_rate, channels, output_format, process_watcher))
+    finally:
+        proc.stdout.close()
+        proc.wait()
+    assert proc.returncode == 0, 'Decoding of "{}" failed!'.format(input_file_name)
+    print('[yt2mp3] Split {:.0f}s of audio into {} segments'.format(finder.duration(), n_segments))
+
+
+def cleanup(download_dir, archive_file, video_file, tmp_mp3_file_name, keep_download=False):
     """
     After a successful execution of all other functions, remove the left-over
     file containing the download file information.
+    After failures, the download may be kept for the next attempt, see download_video.
 
     Parameters:
     -----------
@@ -289,10 +1362,17 @@ def cleanup(download_dir, archive_file, video_file, tmp_mp3_file_name):
     video_file: str or None - the downloaded video file
 
     tmp_mp3_file_name: str or None - a temporary file location for mp3 file conversion
+
+    keep_download: bool - (optional) keep the archive file, the downloaded media and partial downloads
     """
 
     print(download_dir, archive_file, video_file, tmp_mp3_file_name)
 
+    if keep_download:
+        archive_file = video_file = None
+        if download_dir and os.path.isdir(download_dir):
+            print('[yt2mp3] Keeping download directory "{}" for the next attempt'.format(download_dir))
+
     if archive_file and os.path.isfile(archive_file):
         print('[yt2mp3] Removing download archive file "{}"'.format(archive_file))
         os.remove(archive_file)